@@ -0,0 +1,263 @@
+"""Benchmark cases for the hot paths of generating, storing and evaluating data sets.
+Every case has a setup function that prepares the inputs for a combination of parameters, outside the timing,
+and a function that is timed. Parameter grids sweep the sample count, dimension and number of domains."""
+
+from functools import partial
+import shutil
+import tempfile
+
+import numpy as np
+
+# temporary directories of the storage cases, removed by `cleanup`
+_TEMP_DIRS = []
+
+
+class Case:
+    def __init__(self, name: str, setup, func, grid: dict, quick_grid: dict = None):
+        """
+        :param name: unique name, like 'shifter.shift'
+        :param setup: function called with a combination of parameters, returns the arguments of func
+        :param func: function that is timed, called with the arguments returned by setup
+        :param grid: for every parameter of setup, the values to sweep over
+        :param quick_grid: smaller grid for quick runs, e.g. to check the suite itself. Defaults to the first value
+        of every parameter.
+        """
+        self.name = name
+        self.setup = setup
+        self.func = func
+        self.grid = grid
+        self.quick_grid = quick_grid or {key: values[:1] for key, values in grid.items()}
+
+
+def _features(n: int, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    from sklearn.datasets import make_classification
+    x, y = make_classification(n_samples=n, n_features=dim, n_informative=dim, n_redundant=0, n_repeated=0,
+                               n_clusters_per_class=2, random_state=0)
+    return x.astype(np.float32), y
+
+
+def _dataset(n: int, dim: int) -> tuple:
+    """Global, source and target sets with n samples each."""
+    x, y = _features(3 * n, dim)
+    return x[:n], y[:n], x[n:2 * n] + 1, y[n:2 * n], x[2 * n:] - 1, y[2 * n:]
+
+
+def _shift_setup(n, dim, n_domains):
+    from datagen.conceptshift.shifter import Shifter
+    x, y = _features(n, dim)
+    return Shifter(n_domains=n_domains, rot=.5, trans=2, scale=.5), x, y
+
+
+def _shift(shifter, x, y):
+    # shift scales its input in place, so every repeat gets a copy
+    shifter.shift(x.copy(), y)
+
+
+def _domain_select_setup(n, n_domains):
+    from datagen.conceptshift.selector import DomainSelector
+    x, y = _features(n, 5)
+    domain = np.random.randint(0, n_domains, n)
+    n_select = n // 10
+    return DomainSelector(n_select, n_select, n_select, 1, 1), x, y, domain
+
+
+def _domain_select(selector, x, y, domain):
+    selector.select(x, y, domain)
+
+
+def _feature_select_setup(n, dim):
+    from datagen.covshift.selector import FeatureSelector
+    x, y = _features(n, dim)
+    n_select = n // 10
+    return FeatureSelector(n_select, n_select, n_select, 1., 1., 2.), x, y
+
+
+def _feature_select(selector, x, y):
+    selector.select(x, y)
+
+
+def _sample_biased_setup(n, dim):
+    x, y = _features(n, dim)
+    return x, y, n // 10, x.mean(0), x.std(0)
+
+
+def _sample_biased(x, y, n, mean, std):
+    from datagen.covshift.selector import sample_biased
+    sample_biased(x, y, n, mean, std)
+
+
+def _analyze_setup(n, dim):
+    return _dataset(n, dim),
+
+
+def _analyze(dataset):
+    from evaluate.evaluate import analyze_data
+    analyze_data(dataset)
+
+
+def _two_sample_setup(n, n_permutations):
+    xg, _, xs, _, xt, _ = _dataset(n, 5)
+    return {'g': xg, 's': xs, 't': xt}, n_permutations
+
+
+def _two_sample(sets, n_permutations):
+    from evaluate.twosample import two_sample_stats
+    two_sample_stats(sets, n_permutations=n_permutations)
+
+
+def _store_setup(n, dim):
+    from storage.storage import Store
+    path = tempfile.mkdtemp(prefix='benchmark-')
+    _TEMP_DIRS.append(path)
+    store = Store.new('store', path)
+    data = _dataset(n, dim)
+    store.save_data(*data)
+    return store, data
+
+
+def _store_save(store, data):
+    store.save_data(*data)
+
+
+def _store_load(store, data):
+    store.load_data()
+
+
+def _codec_setup(n, dim, codec):
+    from storage.storage import Store
+    path = tempfile.mkdtemp(prefix='benchmark-')
+    _TEMP_DIRS.append(path)
+    store = Store.new('store', path, codec=codec)
+    data = _dataset(n, dim)
+    store.save_data(*data)
+    return store, data
+
+
+def _codec_load_rows(store, data):
+    # a hundredth of the rows of a single feature
+    n = len(data[2])
+    store.load_array('xs', slice(n // 2, n // 2 + n // 100), 0)
+
+
+def _kernel_setup(n, dim):
+    import tensorflow as tf
+    x, _ = _features(2 * n, dim)
+    return tf.constant(x[:n]), tf.constant(x[n:])
+
+
+def _compute_kernel(x, y):
+    from models.mmd import compute_kernel
+    compute_kernel(x, y).numpy()
+
+
+def _mmd(x, y):
+    from models.mmd import mmd
+    mmd(x, y).numpy()
+
+
+def _summarize_setup(n, n_resamples):
+    acc = np.random.uniform(.5, 1., size=(n, 4))
+    return acc, n_resamples
+
+
+def _summarize(acc, n_resamples):
+    from util.stats import summarize
+    summarize(acc, ['s-only', 's->g', 's->t', 't-only'], n_resamples=n_resamples)
+
+
+def _corr_setup(n, n_columns):
+    import pandas as pd
+    return pd.DataFrame(np.random.normal(size=(n, n_columns))),
+
+
+def _highest_corr(df):
+    from util.corr import highest_corr
+    highest_corr(df, 10, absolute=True)
+
+
+FIT_PARAMS = dict(epochs=2, batch_size=64, verbose=0)
+
+
+def _autoencoder_setup(n, dim):
+    from models.autoencoder import Autoencoder
+    xg, yg, xs, ys, xt, yt = _dataset(n, dim)
+    model = Autoencoder(input_dim=dim, encoder_dim=max(2, dim // 2))
+    # build and trace the models once, so the timing excludes the one-time graph construction
+    model.fit(xs, ys, xt, **FIT_PARAMS)
+    return model, xs, ys, xt
+
+
+def _autoencoder_fit(model, xs, ys, xt):
+    model.fit(xs, ys, xt, **FIT_PARAMS)
+
+
+def _autoencoder_predict(model, xs, ys, xt):
+    model.predict(xt)
+
+
+def _evaluate_setup(n, dim):
+    from models.autoencoder import Autoencoder
+    return _dataset(n, dim), lambda: Autoencoder(input_dim=dim, encoder_dim=max(2, dim // 2))
+
+
+def _evaluate_deep(dataset, builder):
+    from evaluate.evaluate import evaluate_deep
+    evaluate_deep(dataset, builder, FIT_PARAMS, train_split=.7)
+
+
+def _evaluate_folds_setup(n, dim, folds):
+    from models.autoencoder import Autoencoder
+    return _dataset(n, dim), partial(Autoencoder, input_dim=dim, encoder_dim=max(2, dim // 2)), folds
+
+
+def _evaluate_folds(dataset, builder, folds):
+    from evaluate.evaluate import evaluate_deep
+    evaluate_deep(dataset, builder, FIT_PARAMS, train_split=.7, folds=folds, parallel=True)
+
+
+CASES = [
+    Case('shifter.shift', _shift_setup, _shift,
+         dict(n=[10000, 100000], dim=[5, 20], n_domains=[2, 4, 8])),
+    Case('domain_selector.select', _domain_select_setup, _domain_select,
+         dict(n=[10000, 100000], n_domains=[2, 4, 8])),
+    Case('feature_selector.select', _feature_select_setup, _feature_select,
+         dict(n=[10000, 100000], dim=[5, 20])),
+    Case('sample_biased', _sample_biased_setup, _sample_biased,
+         dict(n=[10000, 100000], dim=[5, 20])),
+    Case('analyze_data', _analyze_setup, _analyze,
+         dict(n=[1000, 10000], dim=[5, 20])),
+    Case('codec.save_data', _codec_setup, _store_save,
+         dict(n=[100000], dim=[20], codec=['npz', 'zlib-shuffle', 'lzma-shuffle'])),
+    Case('codec.load_data', _codec_setup, _store_load,
+         dict(n=[100000], dim=[20], codec=['npz', 'zlib-shuffle', 'lzma-shuffle'])),
+    Case('codec.load_rows', _codec_setup, _codec_load_rows,
+         dict(n=[100000], dim=[20], codec=['npz', 'zlib-shuffle', 'lzma-shuffle'])),
+    Case('two_sample_stats', _two_sample_setup, _two_sample,
+         dict(n=[1000, 3000], n_permutations=[100, 500])),
+    Case('store.save_data', _store_setup, _store_save,
+         dict(n=[1000, 100000], dim=[5, 20])),
+    Case('store.load_data', _store_setup, _store_load,
+         dict(n=[1000, 100000], dim=[5, 20])),
+    Case('stats.summarize', _summarize_setup, _summarize,
+         dict(n=[100, 1000], n_resamples=[1000, 10000])),
+    Case('corr.highest', _corr_setup, _highest_corr,
+         dict(n=[1000, 10000], n_columns=[50, 500])),
+    Case('compute_kernel', _kernel_setup, _compute_kernel,
+         dict(n=[64, 512], dim=[3, 20])),
+    Case('mmd', _kernel_setup, _mmd,
+         dict(n=[64, 512], dim=[3, 20])),
+    Case('autoencoder.fit', _autoencoder_setup, _autoencoder_fit,
+         dict(n=[1000, 5000], dim=[5, 20])),
+    Case('autoencoder.predict', _autoencoder_setup, _autoencoder_predict,
+         dict(n=[1000, 5000], dim=[5, 20])),
+    Case('evaluate_deep', _evaluate_setup, _evaluate_deep,
+         dict(n=[1000], dim=[5, 20])),
+    Case('evaluate_deep.folds', _evaluate_folds_setup, _evaluate_folds,
+         dict(n=[1000], dim=[5], folds=[3, 5])),
+]
+
+
+def cleanup() -> None:
+    """Remove the temporary stores created by the storage cases."""
+    while _TEMP_DIRS:
+        shutil.rmtree(_TEMP_DIRS.pop(), ignore_errors=True)
@@ -0,0 +1,73 @@
+"""Compare the storage codecs of a data set on size, write speed and read speed, against plain .npz files.
+Sizes depend on the values, so the data sets are generated like those of the experiments. Run from the repository root:
+
+    python -m benchmark.codec
+    python -m benchmark.codec --n 100000 --dim 20 --storage-dtype float16
+
+Speeds are in MB per second of the uncompressed arrays, of the best of several repeats. 'rows' reads a hundredth of
+the rows of a single feature, which chunked codecs do without decompressing the rest of the file."""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmark.cases import _dataset
+from storage.storage import Store, CODECS
+from util.dtype import DEFAULT_STORAGE_DTYPE, as_storage
+
+REPEAT = 3
+
+
+def _best(func, repeat: int = REPEAT) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compare_codecs(n: int, dim: int, storage_dtype: str = DEFAULT_STORAGE_DTYPE, codecs: list[str] = CODECS,
+                   repeat: int = REPEAT) -> list[dict]:
+    """Size, write and read speed of a data set of three sets with n samples of dim features, for every codec.
+    :returns: per codec, the size in MB, the size relative to npz, and the speeds in MB/s
+    """
+    data = _dataset(n, dim)
+    raw_mb = sum(as_storage(x, storage_dtype).nbytes if i % 2 == 0 else x.nbytes
+                 for i, x in enumerate(data)) / 2 ** 20
+    path = tempfile.mkdtemp(prefix='benchmark-')
+    res = []
+    try:
+        for codec in codecs:
+            store = Store.new(codec, path, storage_dtype=storage_dtype, codec=codec)
+            write = _best(lambda: store.save_data(*data), repeat)
+            size_mb = sum(entry.stat().st_size for entry in os.scandir(store.path_full)) / 2 ** 20
+            read = _best(store.load_data, repeat)
+            rows = _best(lambda: store.load_array('xs', slice(n // 2, n // 2 + max(1, n // 100)), 0), repeat)
+            res.append(dict(codec=codec, size_mb=size_mb, write_mb_s=raw_mb / write, read_mb_s=raw_mb / read,
+                            rows_ms=rows * 1e3))
+    finally:
+        shutil.rmtree(path)
+
+    npz = next((r for r in res if r['codec'] == 'npz'), None)
+    for r in res:
+        r['ratio'] = r['size_mb'] / npz['size_mb'] if npz is not None else None
+    return res
+
+
+if __name__ == "__main__":
+    """Print a table of the size, write and read speed of every codec for one data set size."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100000, help="samples per set")
+    parser.add_argument('--dim', type=int, default=20, help="number of features")
+    parser.add_argument('--storage-dtype', default=DEFAULT_STORAGE_DTYPE, help="floating point type on disk")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="number of repeats per measurement")
+    cli_args = parser.parse_args()
+
+    print(f"{'codec':<14} {'size MB':>9} {'vs npz':>7} {'write MB/s':>11} {'read MB/s':>10} {'rows ms':>8}")
+    for result in compare_codecs(cli_args.n, cli_args.dim, cli_args.storage_dtype, repeat=cli_args.repeat):
+        ratio = f"{result['ratio']:.2f}" if result['ratio'] is not None else '-'
+        print(f"{result['codec']:<14} {result['size_mb']:9.2f} {ratio:>7} {result['write_mb_s']:11.1f} "
+              f"{result['read_mb_s']:10.1f} {result['rows_ms']:8.2f}")
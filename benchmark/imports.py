@@ -0,0 +1,75 @@
+"""Check that the modules used by helper scripts and workers import fast, and do not load heavy dependencies.
+Every module is imported in a fresh interpreter, so earlier imports do not hide the cost. Run from the repository root:
+
+    python -m benchmark.imports
+    python -m benchmark.imports --budget 1.0
+
+Exits with 1 when a module is over budget, or loads one of the heavy modules at import time."""
+
+import argparse
+import json
+import subprocess
+import sys
+
+BUDGET_SECONDS = 1.0
+HEAVY = ('tensorflow', 'adapt', 'optuna', 'plotly', 'matplotlib', 'pandas')
+
+# modules that import without any of the heavy dependencies, e.g. to move data sets or run the job queue
+MODULES = [
+    'storage.storage',
+    'storage.preload',
+    'util.batch',
+    'util.jobqueue',
+    'evaluate.evaluate',
+    'models.autoencoder',
+    'models.mmd',
+    'experiment.optimize',
+    'experiment.pipeline',
+    'experiment.validate',
+]
+
+# a lazy module that was never accessed is still of type _LazyModule
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+loaded = [name for name in {heavy!r}
+          if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule']
+print(json.dumps(dict(seconds=seconds, loaded=loaded)))
+"""
+
+
+def import_time(module: str) -> dict:
+    """Import a module in a fresh interpreter.
+    :returns: seconds spent importing, and the heavy modules that were executed"""
+    out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY)],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def check(modules: list[str] = None, budget: float = BUDGET_SECONDS) -> list[str]:
+    """Import every module and report its time.
+    :returns: the modules that are over budget or load heavy dependencies"""
+    failed = []
+    for module in modules or MODULES:
+        res = import_time(module)
+        flag = ''
+        if res['seconds'] > budget or res['loaded']:
+            flag = 'FAIL'
+            failed.append(module)
+        print(f"{module:<26} {res['seconds']:6.2f} s  {', '.join(res['loaded']):<30} {flag}")
+    return failed
+
+
+if __name__ == "__main__":
+    """Check the import time of the given modules, default all in MODULES."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=None, help="modules to check, default all")
+    parser.add_argument('--budget', type=float, default=BUDGET_SECONDS, help="maximum seconds per import")
+    cli_args = parser.parse_args()
+
+    found = check(cli_args.modules, cli_args.budget)
+    print(f"{len(found)} modules over budget or loading heavy dependencies")
+    if found:
+        raise SystemExit(1)
@@ -0,0 +1,175 @@
+"""Run the benchmark suite on CPU, and compare the results against a baseline. Run from the repository root:
+
+    python -m benchmark.run run --out results/benchmark/baseline.json
+    python -m benchmark.run run --cases shifter.shift store.load_data --quick
+    python -m benchmark.run compare results/benchmark/baseline.json results/benchmark/<time>.json
+
+Timings are the best of several repeats, which is the least sensitive to other load on the machine.
+Only compare results from the same machine, the metadata in every result file tells them apart."""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+from importlib import metadata
+
+import numpy as np
+
+# benchmarks run on CPU only, so results are comparable between machines with and without a GPU
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+from benchmark.cases import CASES, cleanup
+
+REPEAT = 5
+MIN_SAMPLE_SECONDS = 0.05
+THRESHOLD = 0.2
+PACKAGES = ('numpy', 'scipy', 'scikit-learn', 'tensorflow', 'adapt', 'pandas')
+
+
+def machine_metadata() -> dict:
+    """Description of the machine and software versions, stored with every result."""
+    versions = dict()
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(node=platform.node(), platform=platform.platform(), machine=platform.machine(),
+                processor=platform.processor(), cpu_count=os.cpu_count(), python=platform.python_version(),
+                packages=versions, commit=commit)
+
+
+def measure(func, args: tuple, repeat: int = REPEAT) -> list[float]:
+    """Seconds per call of func(*args), for each repeat. Fast functions are called several times per repeat,
+    so that every repeat takes at least MIN_SAMPLE_SECONDS."""
+    func(*args)  # warm up caches and lazy initialization
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SAMPLE_SECONDS or number >= 2 ** 20:
+            break
+        number *= 2
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def run(case_names: list[str] = None, quick: bool = False, repeat: int = REPEAT) -> dict:
+    """Run the benchmark cases, for every combination of their parameters.
+    :param case_names: names of the cases to run, all if None
+    :param quick: use the small grid of every case, to check the suite itself
+    :param repeat: number of timed repeats per combination
+    :returns: the results, with machine metadata
+    """
+    cases = [case for case in CASES if case_names is None or case.name in case_names]
+    if case_names is not None and len(cases) != len(case_names):
+        unknown = set(case_names) - {case.name for case in cases}
+        raise ValueError(f"Unknown benchmark cases: {sorted(unknown)}")
+
+    results = []
+    try:
+        for case in cases:
+            grid = case.quick_grid if quick else case.grid
+            for values in itertools.product(*grid.values()):
+                params = dict(zip(grid.keys(), values))
+                np.random.seed(0)
+                args = case.setup(**params)
+                times = measure(case.func, args, repeat)
+                results.append(dict(case=case.name, params=params, times=times,
+                                    best=min(times), median=float(np.median(times))))
+                print(f"{case.name:<26} {json.dumps(params):<40} {min(times) * 1e3:10.3f} ms")
+    finally:
+        cleanup()
+
+    return dict(created=time.strftime("%Y-%m-%d_%H-%M-%S"), quick=quick, repeat=repeat,
+                machine=machine_metadata(), results=results)
+
+
+def _key(result: dict) -> tuple:
+    return result['case'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline: dict, current: dict, threshold: float = THRESHOLD) -> list[dict]:
+    """Compare the best times of the same case and parameters.
+    :param threshold: relative slowdown above which a result counts as regression, 0.2 is 20% slower
+    :returns: the regressions, with the ratio of current to baseline time
+    """
+    for key in ('node', 'processor', 'cpu_count'):
+        if baseline['machine'].get(key) != current['machine'].get(key):
+            print(f"Warning: results are from different machines, {key} differs: "
+                  f"{baseline['machine'].get(key)} vs {current['machine'].get(key)}")
+
+    reference = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        base = reference.get(_key(result))
+        if base is None:
+            continue
+        ratio = result['best'] / base['best']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(dict(case=result['case'], params=result['params'], ratio=ratio))
+        elif ratio < 1 / (1 + threshold):
+            flag = 'faster'
+        print(f"{result['case']:<26} {json.dumps(result['params']):<40} "
+              f"{base['best'] * 1e3:10.3f} -> {result['best'] * 1e3:10.3f} ms  x{ratio:5.2f}  {flag}")
+
+    missing = set(reference) - {_key(result) for result in current['results']}
+    if missing:
+        print(f"{len(missing)} results of the baseline are missing in the current results")
+    return regressions
+
+
+if __name__ == "__main__":
+    """Run the benchmark suite, or compare two result files. Exits with 1 when compare finds regressions."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmark cases")
+    run_parser.add_argument('--cases', nargs='*', default=None, help="names of the cases to run, default all")
+    run_parser.add_argument('--quick', action='store_true', help="run only the smallest parameters of every case")
+    run_parser.add_argument('--repeat', type=int, default=REPEAT, help="number of repeats per measurement")
+    run_parser.add_argument('--out', default=None, help="result file, default results/benchmark/<time>.json")
+
+    compare_parser = commands.add_parser('compare', help="flag regressions against a baseline")
+    compare_parser.add_argument('baseline', help="result file of the baseline")
+    compare_parser.add_argument('current', help="result file to check")
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                                help="relative slowdown that counts as regression")
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'run':
+        res = run(cli_args.cases, cli_args.quick, cli_args.repeat)
+        out = cli_args.out or os.path.join('results', 'benchmark', f"{res['created']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, 'w') as f:
+            json.dump(res, f, indent=4)
+        print(f"Saved results to {out}")
+    else:
+        with open(cli_args.baseline, 'r') as f:
+            baseline_res = json.load(f)
+        with open(cli_args.current, 'r') as f:
+            current_res = json.load(f)
+        found = compare(baseline_res, current_res, cli_args.threshold)
+        print(f"{len(found)} regressions above {cli_args.threshold:.0%}")
+        if found:
+            raise SystemExit(1)
@@ -4,10 +4,13 @@ import numpy as np
 from .shifter import Shifter
 from .selector import DomainSelector
 from sklearn.datasets import make_classification
+from util.dtype import COMPUTE_DTYPE
+from util.instrument import stage
 
 
 class ConceptShiftDataBuilder:
-    def __init__(self, init_classify: dict, shifter: Shifter, selector: DomainSelector):
+    def __init__(self, init_classify: dict, shifter: Shifter, selector: DomainSelector,
+                 dtype: str = COMPUTE_DTYPE.__name__):
         """
         Create a dataset builder class with some configuration, that can be reused to create similar datasets.
         To generate from the same initial distribution, but using a different selection each time,
@@ -16,10 +19,12 @@ class ConceptShiftDataBuilder:
         :param init_classify: parameters for sklearn.dataset.make_classification for the initial dataset
         :param shifter: Shifter object that creates multiple domains by applying random transformations
         :param selector: DomainSelector that selects with bias, based on domains as created by shifter
+        :param dtype: floating point type of the generated features, float32 matches the precision used for training
         """
         self.init_classify = init_classify
         self.shifter = shifter
         self.selector = selector
+        self.dtype = dtype
 
     def generate(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
@@ -27,9 +32,13 @@ class ConceptShiftDataBuilder:
 
         :return:  tuple (xg, yg, xs, ys, xt, yt), where s=source, g=global, t=target.
         """
-        x, y = make_classification(**self.init_classify)
-        x, y, domain = self.shifter.shift(x, y)
-        xg, yg, xs, ys, xt, yt = self.selector.select(x, y, domain)
+        with stage('make_classification'):
+            x, y = make_classification(**self.init_classify)
+            x = x.astype(self.dtype, copy=False)
+        with stage('shift'):
+            x, y, domain = self.shifter.shift(x, y)
+        with stage('select'):
+            xg, yg, xs, ys, xt, yt = self.selector.select(x, y, domain)
         return xg, yg, xs, ys, xt, yt
 
     def to_json(self) -> dict:
@@ -39,6 +48,7 @@ class ConceptShiftDataBuilder:
         return {
             'class_name': self.__class__.__name__,
             'init_classify': self.init_classify,
+            'dtype': self.dtype,
             'shifter': shifter_json,
             'selector': selector_json
         }
\ No newline at end of file
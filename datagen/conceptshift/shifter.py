@@ -51,7 +51,7 @@ class Shifter:
             rot_init = special_ortho_group.rvs(dim)
             rot_init = (1-self.rot) * np.identity(dim) + self.rot * rot_init
             rot, _ = np.linalg.qr(rot_init)  # make it orthogonal again
-            x_ = x_.dot(rot)
+            x_ = x_.dot(rot.astype(x.dtype, copy=False))
 
             # translate
             trans = 2*(np.random.random(dim) - 0.5) * std * self.trans
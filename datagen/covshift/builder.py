@@ -3,10 +3,12 @@ import numpy as np
 
 from .selector import FeatureSelector
 from sklearn.datasets import make_classification
+from util.dtype import COMPUTE_DTYPE
+from util.instrument import stage
 
 
 class CovShiftBuilder:
-    def __init__(self, init_classify: dict, selector: FeatureSelector):
+    def __init__(self, init_classify: dict, selector: FeatureSelector, dtype: str = COMPUTE_DTYPE.__name__):
         """
         Create a dataset builder class with some configuration, that can be reused to create similar datasets.
         To generate from the same initial distribution, but using a different selection each time,
@@ -14,9 +16,11 @@ class CovShiftBuilder:
 
         :param init_classify: parameters for sklearn.dataset.make_classification for the initial dataset
         :param selector: selector object that splits the initial set into source, global and target
+        :param dtype: floating point type of the generated features, float32 matches the precision used for training
         """
         self.init_classify = init_classify
         self.selector = selector
+        self.dtype = dtype
 
     def generate(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
@@ -24,8 +28,11 @@ class CovShiftBuilder:
 
         :return:  tuple (xg, yg, xs, ys, xt, yt), where s=source, g=global, t=target.
         """
-        x, y = make_classification(**self.init_classify)
-        xg, yg, xs, ys, xt, yt = self.selector.select(x, y)
+        with stage('make_classification'):
+            x, y = make_classification(**self.init_classify)
+            x = x.astype(self.dtype, copy=False)
+        with stage('select'):
+            xg, yg, xs, ys, xt, yt = self.selector.select(x, y)
         return xg, yg, xs, ys, xt, yt
 
     def to_json(self):
@@ -34,5 +41,6 @@ class CovShiftBuilder:
         return {
             'class_name': self.__class__.__name__,
             'init_classify': self.init_classify,
+            'dtype': self.dtype,
             'selector': selector_json
         }
\ No newline at end of file
@@ -1,19 +1,52 @@
 """Visualization functions for datasets created with the datagen module"""
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib import cm
-
-import plotly.express as px
 import pandas as pd
 
-from sklearn.decomposition import PCA
-from sklearn.metrics import accuracy_score
+# matplotlib, plotly and sklearn are imported by the functions that use them, so importing this module is fast
+
+# points drawn as markers in the interactive plots, larger sets are downsampled per set and label
+MAX_POINTS = 50000
+# grid resolution of the decision boundary, scaled with the number of points between these bounds
+MIN_RESOLUTION = 100
+MAX_RESOLUTION = 400
+PREDICT_BATCH_SIZE = 8192
+
+SET_NAMES = ['global', 'source', 'target']
+COLORS = {'global': '#00CC96', 'source': '#636EFA', 'target': '#EF553B'}
+
+
+def stratified_sample(strata: np.ndarray, max_points: int, seed: int = 0) -> np.ndarray:
+    """Indices of at most max_points rows, sampled from every stratum in proportion to its size.
+    Every non-empty stratum keeps at least one row, so small sets stay visible next to large ones.
+    :param strata: stratum of every row, like the combination of set and label
+    :returns: sorted indices of the sampled rows, all rows if there are at most max_points
+    """
+    if max_points is None or len(strata) <= max_points:
+        return np.arange(len(strata))
+    rng = np.random.default_rng(seed)
+    values, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    quotas = np.maximum(1, np.round(counts * max_points / len(strata))).astype(int)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    picked = [rng.choice(order[start:start + count], quota, replace=False)
+              for start, count, quota in zip(starts, counts, quotas)]
+    return np.sort(np.concatenate(picked))
+
+
+def _concat_sets(xg, yg, xs, ys, xt, yt, max_points: int = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Features, labels and set index (into SET_NAMES) of all sets, downsampled per set and label."""
+    x = np.concatenate([xg, xs, xt])
+    y = np.concatenate([yg, ys, yt])
+    domain = np.repeat(np.arange(3), [len(xg), len(xs), len(xt)])
+    index = stratified_sample(domain * 2 + y.astype(int), max_points)
+    return x[index], y[index], domain[index]
 
 
 def visualize_shift2d(xg, yg, xs, ys, xt, yt, title=None):
     """Plot the positions of the source, global and target sets, with markers for binary labels.
     Uses matplotlib."""
+    from matplotlib import pyplot as plt
 
     _, ax1 = plt.subplots(1, 1, dpi=200, figsize=(4, 4))
     if title:
@@ -36,34 +69,40 @@ def visualize_shift2d(xg, yg, xs, ys, xt, yt, title=None):
     plt.show()
 
 
-def visualize_shift2d_px(xg, yg, xs, ys, xt, yt):
+def visualize_shift2d_px(xg, yg, xs, ys, xt, yt, max_points: int = MAX_POINTS):
     """Plot the positions of the source, global and target sets, with markers for binary labels.
-    Uses plotly for interactive notebooks."""
+    Uses plotly for interactive notebooks.
+    :param max_points: draw at most this many points, sampled per set and label, None draws all.
+    For larger sets, `visualize_shift2d_density` shows all points."""
+    import plotly.express as px
 
+    x, y, domain = _concat_sets(xg, yg, xs, ys, xt, yt, max_points)
     data = {
-        'feature1': np.concatenate([xg[:, 0], xs[:, 0], xt[:, 0]]),
-        'feature2': np.concatenate([xg[:, 1], xs[:, 1], xt[:, 1]]),
-        'label': np.concatenate([yg, ys, yt]),
-        'domain': ['global'] * len(xg) + ['source'] * len(xs) + ['target'] * len(xt)}
+        'feature1': x[:, 0],
+        'feature2': x[:, 1],
+        'label': y,
+        'domain': np.array(SET_NAMES)[domain]}
     df = pd.DataFrame(data)
     symbol_mapping = {1: 'circle', 0: 'x'}
-    color_mapping = {'global': '#00CC96', 'source': '#636EFA', 'target': '#EF553B'}
     fig = px.scatter(df, x='feature1', y='feature2',
-                     color='domain', color_discrete_map=color_mapping,
+                     color='domain', color_discrete_map=COLORS,
                      symbol='label', symbol_map=symbol_mapping)
     fig.show()
 
 
-def visualize_shift3d_px(xg, yg, xs, ys, xt, yt):
+def visualize_shift3d_px(xg, yg, xs, ys, xt, yt, max_points: int = MAX_POINTS):
     """Plot the positions of the source, global and target sets, with markers for binary labels.
-    Uses plotly for interactive notebooks."""
+    Uses plotly for interactive notebooks.
+    :param max_points: draw at most this many points, sampled per set and label, None draws all"""
+    import plotly.express as px
 
+    x, y, domain = _concat_sets(xg, yg, xs, ys, xt, yt, max_points)
     data = {
-        'feature1': np.concatenate([xg[:, 0], xs[:, 0], xt[:, 0]]),
-        'feature2': np.concatenate([xg[:, 1], xs[:, 1], xt[:, 1]]),
-        'feature3': np.concatenate([xg[:, 2], xs[:, 2], xt[:, 2]]),
-        'label': np.concatenate([yg, ys, yt]),
-        'domain': ['global'] * len(xg) + ['source'] * len(xs) + ['target'] * len(xt)}
+        'feature1': x[:, 0],
+        'feature2': x[:, 1],
+        'feature3': x[:, 2],
+        'label': y,
+        'domain': np.array(SET_NAMES)[domain]}
     df = pd.DataFrame(data)
     symbol_mapping = {1: 'circle', 0: 'x'}
     color_mapping = {'global': 'green', 'source': 'blue', 'target': 'orange'}
@@ -74,23 +113,87 @@ def visualize_shift3d_px(xg, yg, xs, ys, xt, yt):
     fig.show()
 
 
-def visualize_decision_boundary2d(xs, ys, xt, yt, model, name=None):
+def visualize_shift2d_density(xg, yg, xs, ys, xt, yt, bins: int = 200, overlay_points: int = 0, title=None):
+    """Plot the density of the source, global and target sets, per label, as 2D histograms.
+    Only the bin counts are sent to plotly, so it stays interactive for millions of points.
+    Click a legend entry to hide the histogram of a set and label.
+    :param bins: number of bins along each feature
+    :param overlay_points: also draw this many points as markers, sampled per set and label
+    :param title: plot title
+    """
+    import plotly.graph_objects as go
+
+    sets = [(xg, yg), (xs, ys), (xt, yt)]
+    low = np.min([x[:, :2].min(0) for x, _ in sets if len(x)], 0)
+    high = np.max([x[:, :2].max(0) for x, _ in sets if len(x)], 0)
+    edges = [np.linspace(low[i], high[i], bins + 1) for i in range(2)]
+    centers = [(e[:-1] + e[1:]) / 2 for e in edges]
+
+    fig = go.Figure()
+    for name, (x, y) in zip(SET_NAMES, sets):
+        for label, opacity in ((1, 0.8), (0, 0.4)):
+            counts, _, _ = np.histogram2d(x[y == label, 0], x[y == label, 1], bins=edges)
+            # empty bins are transparent, counts on a log scale so sparse regions remain visible
+            z = np.where(counts > 0, np.log1p(counts), np.nan).T
+            fig.add_trace(go.Heatmap(x=centers[0], y=centers[1], z=z, name=f'{name}, label {label}',
+                                     colorscale=[[0, _rgba(COLORS[name], 0.15)], [1, _rgba(COLORS[name], 1.)]],
+                                     opacity=opacity,
+                                     showscale=False, showlegend=True, legendgroup=name, hoverinfo='skip'))
+
+    if overlay_points:
+        x, y, domain = _concat_sets(xg, yg, xs, ys, xt, yt, overlay_points)
+        for i, name in enumerate(SET_NAMES):
+            for label, symbol in ((1, 'circle'), (0, 'x')):
+                selected = (domain == i) & (y == label)
+                fig.add_trace(go.Scattergl(x=x[selected, 0], y=x[selected, 1], mode='markers',
+                                           name=f'{name}, label {label} (sample)', legendgroup=name,
+                                           marker=dict(color=COLORS[name], symbol=symbol, size=3)))
+
+    fig.update_layout(title=title, xaxis_title='feature1', yaxis_title='feature2', plot_bgcolor='white')
+    fig.show()
+
+
+def _rgba(color: str, alpha: float) -> str:
+    """CSS rgba color of a hex color like '#00CC96'."""
+    red, green, blue = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgba({red}, {green}, {blue}, {alpha})'
+
+
+def _grid_resolution(n_points: int) -> int:
+    """Resolution of the decision boundary grid, finer for more points, since they show finer detail."""
+    return int(np.clip(np.sqrt(n_points), MIN_RESOLUTION, MAX_RESOLUTION))
+
+
+def visualize_decision_boundary2d(xs, ys, xt, yt, model, name=None, resolution: int = None,
+                                  max_points: int = MAX_POINTS):
     """Given a trained model, plots the: labeled source data, the decision boundary,
      the position of the target data, and computes the accuracy.
      Optionally add a name to the plot title.
-     Taken mostly from: https://adapt-python.github.io/adapt/examples/Two_moons.html"""
-    yt_pred = model.predict(xt)
-    acc = accuracy_score(yt, yt_pred > 0.5)
-
+     Taken mostly from: https://adapt-python.github.io/adapt/examples/Two_moons.html
+     :param resolution: number of grid points along each feature, default scales with the number of points
+     :param max_points: draw at most this many points of each set, sampled per label. The accuracy uses all points."""
+    from matplotlib import pyplot as plt
+    from matplotlib import cm
+    from sklearn.decomposition import PCA
+    from sklearn.metrics import accuracy_score
+
+    resolution = resolution or _grid_resolution(len(xs) + len(xt))
     x_min, y_min = np.min([xs.min(0), xt.min(0)], 0)
     x_max, y_max = np.max([xs.max(0), xt.max(0)], 0)
-    x_grid, y_grid = np.meshgrid(np.linspace(x_min-0.1, x_max+0.1, 100),
-                                 np.linspace(y_min-0.1, y_max+0.1, 100))
-    x_grid_ = np.stack([x_grid.ravel(), y_grid.ravel()], -1)
-    yp_grid = model.predict(x_grid_).reshape(100, 100)
-
-    x_pca = np.concatenate((model.encoder_.predict(xs),
-                            model.encoder_.predict(xt)))
+    x_grid, y_grid = np.meshgrid(np.linspace(x_min-0.1, x_max+0.1, resolution),
+                                 np.linspace(y_min-0.1, y_max+0.1, resolution))
+    x_grid_ = np.stack([x_grid.ravel(), y_grid.ravel()], -1).astype(xt.dtype)
+
+    # the target set and the grid in a single call, with large batches
+    y_pred = model.predict(np.concatenate([xt, x_grid_]), batch_size=PREDICT_BATCH_SIZE, verbose=0)
+    acc = accuracy_score(yt, y_pred[:len(xt)] > 0.5)
+    yp_grid = y_pred[len(xt):].reshape(resolution, resolution)
+
+    # only the drawn points are encoded
+    xs_index = stratified_sample(ys, max_points)
+    xt_index = stratified_sample(yt, max_points)
+    xs, ys, xt = xs[xs_index], ys[xs_index], xt[xt_index]
+    x_pca = model.encoder_.predict(np.concatenate([xs, xt]), batch_size=PREDICT_BATCH_SIZE, verbose=0)
     x_pca = PCA(2).fit_transform(x_pca)
 
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
@@ -1,9 +1,20 @@
 """Contains utility functions that can be used for evaluating a dataset and DA model's performance"""
 
-from sklearn.metrics import accuracy_score
+import time
+
 from tqdm import tqdm
 import numpy as np
 
+from models.weights import restore_weights
+from evaluate.twosample import two_sample_stats, N_PERMUTATIONS
+from util.dtype import COMPUTE_DTYPE, as_compute
+from util.instrument import stage
+from util.metrics import record_fit
+from util.schedule import Scheduler, is_picklable
+
+# configurations that can start from the weights of the source-only model, instead of a random initialization
+WARM_START_CONFIGS = ('s->t', 's->g')
+
 
 def acc_slope(acc: np.ndarray, last_portion: float = 0.05, preceding_portion: float = 0.05) -> float:
     """Compute an indication of convergence, by the slope of the accuracy.
@@ -19,9 +30,12 @@ def acc_slope(acc: np.ndarray, last_portion: float = 0.05, preceding_portion: fl
     return (np.mean(last_samples) - np.mean(preceding_samples)) / (0.5*(last_num + preceding_num))
 
 
-def analyze_data(dataset) -> dict:
+def analyze_data(dataset, n_permutations: int = N_PERMUTATIONS) -> dict:
     """Analyze properties of a dataset using some directly computable statistical measures, without ML.
+    Includes the MMD and energy distance between the sets with their permutation p-values, see evaluate/twosample.py,
+    as a cheap indication of the shift before evaluating models.
     :param dataset: tuple (xg, yg, xs, ys, xt, yt) where s=source, g=global, t=target.
+    :param n_permutations: permutations of the two-sample tests, 0 to skip the tests
     :returns dict with metrics
     """
     res = dict()
@@ -33,10 +47,44 @@ def analyze_data(dataset) -> dict:
         res[f'num-{name}'] = x.shape[0]
         res[f'uniqueness-{name}'] = np.unique(x, axis=0).shape[0] / x.shape[0]
         res[f'class-marginal-{name}'] = np.mean(y)
+    if n_permutations > 0:
+        res.update(two_sample_stats({'g': xg, 's': xs, 't': xt}, n_permutations=n_permutations))
     return res
 
 
-def evaluate_deep(dataset, model_builder, fit_params: dict, train_split: float, distance: bool = False, verbose: bool = False) -> dict:
+def kfold_bounds(n_folds: int, n: int) -> list[tuple[int, int]]:
+    """Test rows of every fold of k-fold cross-validation, as the first and the end of a range of rows.
+    Fold 0 tests on the first rows, like the head of a train/test split.
+    :param n_folds: number of folds, at least 2
+    :param n: number of rows
+    """
+    if not 2 <= n_folds <= n:
+        raise ValueError(f"Number of folds should be between 2 and the number of rows {n}, got {n_folds}")
+    bounds = np.arange(n_folds + 1) * n // n_folds
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def kfold_split(bounds: tuple[int, int], *arrays) -> tuple[tuple, tuple]:
+    """Training and test rows of a fold, see `kfold_bounds`. The test rows are a view of the arrays, the training rows
+    are the other rows, copied when the fold is trained, so only the folds in training hold a copy.
+    :param bounds: first and end of the test rows
+    :param arrays: arrays of the same length, e.g. the features and labels of a domain
+    :returns: the training rows and the test rows of every array
+    """
+    start, stop = bounds
+    return (tuple(np.delete(array, np.s_[start:stop], axis=0) for array in arrays),
+            tuple(array[start:stop] for array in arrays))
+
+
+def _fold_domains(bounds: dict, domains: dict) -> tuple[dict, dict]:
+    """Training and test rows of a fold of every domain, keyed like the bounds."""
+    splits = {key: kfold_split(bounds[key], domains[key]['x'], domains[key]['y']) for key in bounds}
+    return {key: splits[key][0] for key in splits}, {key: splits[key][1] for key in splits}
+
+
+def evaluate_deep(dataset, model_builder, fit_params: dict, train_split: float, distance: bool = False, verbose: bool = False,
+                  warm_start: bool = False, warm_start_fit_params: dict = None, pretrained: dict = None,
+                  checkpoint=None, folds: int = None, parallel: bool = False) -> dict:
     """Evaluate a domain adaptation model on a dataset.
     Trains and evaluates the model multiple times with various combinations of domains.
     Can be used to both evaluate the efficiency of the DA with respect to baselines,
@@ -47,27 +95,65 @@ def evaluate_deep(dataset, model_builder, fit_params: dict, train_split: float,
     Model should have fit and predict methods, like BaseAdaptDeep.
     Can also be a dictionary, to use a different model for every configuration. Keys formatted like "s-only" or "s->t".
     :param fit_params: parameters like epoch, batch size etc. for `model.fit`
-    :param train_split: proportion to use for training data, use rest for test.
+    :param train_split: proportion to use for training data, use rest for test. Ignored if folds is given.
     :param distance: compute distance between domains by training a classifier.
     Costly, accounts for about 40% of total evaluation time, disable to speed up.
     :param verbose: show progress bars
+    :param warm_start: initialize the 's->t' and 's->g' models with the weights of the trained 's-only' model.
+    Requires the same architecture for these configurations. The Autoencoder then keeps the restored encoder,
+    and skips its pretraining.
+    :param warm_start_fit_params: fit parameters for the warm started models, e.g. with fewer epochs.
+    If None, uses fit_params.
+    :param pretrained: dictionary of already trained models to use instead of training, keys like "s-only".
+    For example models restored with `Store.load_model`.
+    :param checkpoint: function called as `checkpoint(name, model, input_shape)` after training each model,
+    for example to store its weights.
+    :param folds: number of folds to cross-validate every configuration with, instead of a single train/test split.
+    Every metric is then the mean over the folds, with the standard deviation over the folds as '<metric>-std'.
+    Models trained on one fold are not kept, so pretrained and checkpoint are not supported.
+    :param parallel: train the folds in parallel worker processes, see util/schedule.py.
+    Only if model_builder can be pickled, e.g. functools.partial(DANN, **params) rather than a lambda.
+    Every worker then receives a pickled copy of the data set, and builds the training rows of its fold itself.
+    Off by default, `batch_eval` opts in, where a worker of the batch runs the folds in its own process.
     :returns dictionary with all computed results
     """
 
-    xg, yg, xs, ys, xt, yt = dataset
-    domains = {
-        's': {'x': xs, 'y': ys},
-        'g': {'x': xg, 'y': yg},
-        't': {'x': xt, 'y': yt},
-    }
+    domains = _make_domains(dataset)
+
+    if folds is None:
+        # compute index of train/test split, in case each domain has different sample count
+        split_indexes = {key: int(train_split*len(domains[key]['x'])) for key in domains}
+        train = {key: (domains[key]['x'][split_indexes[key]:], domains[key]['y'][split_indexes[key]:])
+                 for key in domains}
+        test = {key: (domains[key]['x'][:split_indexes[key]], domains[key]['y'][:split_indexes[key]])
+                for key in domains}
+        metrics = _evaluate_split(train, test, model_builder, fit_params, verbose, warm_start,
+                                  warm_start_fit_params, pretrained or dict(), checkpoint)
+    else:
+        if pretrained or checkpoint is not None:
+            raise ValueError("Cross-validation with folds does not support pretrained models or checkpoints")
+        bounds = {key: kfold_bounds(folds, len(domains[key]['x'])) for key in domains}
+        splits = [{key: bounds[key][i] for key in domains} for i in range(folds)]
+        args = (domains, model_builder, fit_params, False, warm_start, warm_start_fit_params)
+        results = _map_folds(_evaluate_fold, splits, args, _workload('evaluate_deep', model_builder, fit_params),
+                             parallel, verbose)
+        metrics = _fold_summary(results)
 
-    # compute index of train/test split, in case each domain has different sample count
-    split_indexes = {
-        'g': int(train_split*len(xg)),
-        's': int(train_split*len(xs)),
-        't': int(train_split*len(xt))
-    }
+    if distance:
+        with stage('distance'):
+            dists = _calculate_distance(domains, fit_params, model_builder, verbose)
+        for key in dists:
+            metrics[key] = dists[key]
+
+    return metrics
 
+
+def _evaluate_split(train: dict, test: dict, model_builder, fit_params: dict, verbose: bool, warm_start: bool,
+                    warm_start_fit_params: dict, pretrained: dict, checkpoint) -> dict:
+    """Train every configuration on one split of the domains and evaluate it, see `evaluate_deep`.
+    :param train: (x, y) training rows per domain, keys 's', 'g' and 't'
+    :param test: (x, y) test rows per domain
+    """
     # first train models
     metrics = dict()
     models = dict()
@@ -86,16 +172,31 @@ def evaluate_deep(dataset, model_builder, fit_params: dict, train_split: float,
         else:
             builder = model_builder
 
-        # create new model and fit to the training split of the data
-        models[name] = builder().fit(
-            domains[source]['x'][split_indexes[source]:],
-            domains[source]['y'][split_indexes[source]:],
-            domains[target]['x'][split_indexes[target]:], **fit_params)
-
-        # compute a convergence indication from the history
-        if hasattr(models[name], 'history_') and 'acc' in models[name].history_:
-            indication = acc_slope(models[name].history_['acc'])
-            metrics[f'{name}-convergence-acc-slope'] = indication
+        if name in pretrained:
+            models[name] = pretrained[name]
+            metrics.update(_convergence(name, models[name]))
+            pbar.set_description("Using pretrained model")
+            continue
+
+        # create new model, optionally starting from the source-only model
+        model = builder()
+        params = fit_params
+        x_source, y_source = train[source]
+        input_shape = x_source.shape[1:]
+        if warm_start and name in WARM_START_CONFIGS:
+            restore_weights(model, models['s-only'].get_weights(), input_shape)
+            if warm_start_fit_params is not None:
+                params = warm_start_fit_params
+
+        # fit to the training split of the data
+        start = time.perf_counter()
+        with stage(name), stage('fit'):
+            models[name] = model.fit(x_source, y_source, train[target][0], **params)
+        record_fit(name, len(x_source), params.get('epochs', 1), time.perf_counter() - start)
+        if checkpoint is not None:
+            checkpoint(name, models[name], input_shape)
+
+        metrics.update(_convergence(name, models[name]))
         pbar.set_description("Finished training")
 
     # then evaluate accuracy on different test sets (not every combination is used)
@@ -104,27 +205,37 @@ def evaluate_deep(dataset, model_builder, fit_params: dict, train_split: float,
         ('s-only', 't'),
         ('s->t', 't'),
         ('s->g', 't')], disable=not verbose)
-    for model, test in pbar:
-        name = f"{model}-acc-on-{test}"
-        pbar.set_description(f"Evaluating model '{model}' on '{test}'")
-
-        x = domains[test]['x'][:split_indexes[test]]
-        y = domains[test]['y'][:split_indexes[test]]
-
-        y_pred = models[model].predict(x)
-        acc = accuracy_score(y, y_pred > 0.5)
+    for model, test_domain in pbar:
+        name = f"{model}-acc-on-{test_domain}"
+        pbar.set_description(f"Evaluating model '{model}' on '{test_domain}'")
+
+        x, y = test[test_domain]
+        with stage(model), stage('predict'):
+            y_pred = models[model].predict(x)
+        acc = _accuracy(y, y_pred)
         metrics[name] = acc
         pbar.set_description("Finished evaluating")
 
-    if distance:
-        dists = _calculate_distance(domains, fit_params, model_builder, verbose)
-        for key in dists:
-            metrics[key] = dists[key]
-
     return metrics
 
 
-def evaluate_single(dataset, model_builder, fit_params: dict, source: str, target: str,  train_split: float = 0.7) -> float:
+def _convergence(name: str, model) -> dict:
+    """Convergence indication from the training history of a model, also of a restored one, if it has a history."""
+    history = getattr(model, 'history_', None)
+    if history and 'acc' in history:
+        return {f'{name}-convergence-acc-slope': acc_slope(history['acc'])}
+    return dict()
+
+
+def _evaluate_fold(bounds: dict, domains: dict, model_builder, fit_params: dict, verbose: bool, warm_start: bool,
+                   warm_start_fit_params: dict) -> dict:
+    train, test = _fold_domains(bounds, domains)
+    return _evaluate_split(train, test, model_builder, fit_params, verbose, warm_start, warm_start_fit_params,
+                           dict(), None)
+
+
+def evaluate_single(dataset, model_builder, fit_params: dict, source: str, target: str,  train_split: float = 0.7,
+                    folds: int = None, parallel: bool = False) -> float:
     """Evaluate a domain adaptation model on a dataset and return accuracy on the target domain
     :param train_split: proportion to use for training data, use rest for validation.
     :param dataset: (tuple of xg, yg, xs, ys, xt, yt) data and labels for source, global and target sets
@@ -132,37 +243,106 @@ def evaluate_single(dataset, model_builder, fit_params: dict, source: str, targe
     :param fit_params: parameters like epoch, batch size etc. for `model.fit`
     :param source: labeled training data, either 's' 't' or 'g'
     :param target: unlabeled training data, either 's' 't' or 'g'
+    :param folds: number of folds to cross-validate with instead of a single split, returns the mean accuracy
+    :param parallel: train the folds in parallel worker processes, see `evaluate_deep`
     :returns dictionary with all computed results
     """
+    if folds is None:
+        return fit_single(dataset, model_builder(), fit_params, source, target, train_split)
+
+    domains = _make_domains(dataset)
+    domains = {key: domains[key] for key in (source, target)}
+    bounds = {key: kfold_bounds(folds, len(domains[key]['x'])) for key in domains}
+    splits = [{key: bounds[key][i] for key in domains} for i in range(folds)]
+    args = (domains, model_builder, fit_params, source, target)
+    results = _map_folds(_fit_fold, splits, args, _workload('evaluate_single', model_builder, fit_params), parallel)
+    return float(np.mean(results))
+
+
+def _fit_fold(bounds: dict, domains: dict, model_builder, fit_params: dict, source: str, target: str) -> float:
+    train, test = _fold_domains(bounds, domains)
+    start = time.perf_counter()
+    model = model_builder().fit(train[source][0], train[source][1], train[target][0], **fit_params)
+    record_fit(f'{source}->{target}', len(train[source][0]), fit_params.get('epochs', 1), time.perf_counter() - start)
+    x, y = test[target]
+    return _accuracy(y, model.predict(x))
+
+
+def fit_single(dataset, model, fit_params: dict, source: str, target: str, train_split: float = 0.7) -> float:
+    """Like `evaluate_single`, but fits a given model. If the model was already trained on the same configuration,
+    training continues for the epochs in fit_params, instead of starting over. Models whose class sets
+    `resumable = False`, like the Autoencoder, do not support this, see `batch_eval_fidelity`.
+    :param model: new or previously trained model, like BaseAdaptDeep
+    :returns accuracy on the test split of the target domain
+    """
 
-    xg, yg, xs, ys, xt, yt = dataset
-    domains = {
-        's': {'x': xs, 'y': ys},
-        'g': {'x': xg, 'y': yg},
-        't': {'x': xt, 'y': yt},
-    }
+    domains = _make_domains(dataset)
 
-    split_indexes = {
-        'g': int(train_split*len(xg)),
-        's': int(train_split*len(xs)),
-        't': int(train_split*len(xt))
-    }
+    split_indexes = {key: int(train_split*len(domains[key]['x'])) for key in domains}
 
     # train
-    model = model_builder().fit(
+    start = time.perf_counter()
+    model = model.fit(
         domains[source]['x'][split_indexes[source]:],
         domains[source]['y'][split_indexes[source]:],
         domains[target]['x'][split_indexes[target]:], **fit_params)
+    record_fit(f'{source}->{target}', len(domains[source]['x']) - split_indexes[source],
+               fit_params.get('epochs', 1), time.perf_counter() - start)
 
     # evaluate
     x = domains[target]['x'][:split_indexes[target]]
     y = domains[target]['y'][:split_indexes[target]]
     y_pred = model.predict(x)
-    acc = accuracy_score(y, y_pred > 0.5)
+    acc = _accuracy(y, y_pred)
 
     return acc
 
 
+def _accuracy(y, y_pred) -> float:
+    """Accuracy of predicted probabilities, thresholded at 0.5. sklearn is only imported once evaluating."""
+    from sklearn.metrics import accuracy_score
+    return accuracy_score(y, y_pred > 0.5)
+
+
+def _make_domains(dataset) -> dict:
+    """Group the dataset per domain, converted once to the compute dtype so fitting does not cast it again."""
+    xg, yg, xs, ys, xt, yt = dataset
+    return {
+        's': {'x': as_compute(xs), 'y': as_compute(ys)},
+        'g': {'x': as_compute(xg), 'y': as_compute(yg)},
+        't': {'x': as_compute(xt), 'y': as_compute(yt)},
+    }
+
+
+def _workload(loop: str, model_builder, fit_params: dict) -> str:
+    """Name of the workload of the folds, to tune their packing separately per model and size of the fits."""
+    builder = next(iter(model_builder.values())) if type(model_builder) is dict else model_builder
+    model = getattr(builder, 'func', builder)
+    return f"{loop}:{getattr(model, '__name__', type(model).__name__)}:" \
+           f"{fit_params.get('epochs', 1)}x{fit_params.get('batch_size', 32)}"
+
+
+def _map_folds(task, splits: list, args: tuple, workload: str, parallel: bool, verbose: bool = False) -> list:
+    """Results of task(split, *args) for every fold, in order. Runs in worker processes if parallel and the arguments
+    can be pickled, inside a worker of a batch the scheduler runs them in this process.
+    The splits are the bounds of the folds, the task builds the rows of its fold from the data set in args."""
+    if parallel and is_picklable(task, args):
+        tasks = Scheduler(workload).map(task, splits, *args)
+    else:
+        tasks = ((split, task(split, *args)) for split in splits)
+    return [result for _, result in tqdm(tasks, total=len(splits), desc="Evaluating folds", disable=not verbose)]
+
+
+def _fold_summary(results: list[dict]) -> dict:
+    """Mean of every metric over the folds, with its standard deviation as '<metric>-std'."""
+    metrics = dict(folds=len(results))
+    for key in results[0]:
+        values = np.array([result[key] for result in results], dtype=np.float64)
+        metrics[key] = float(values.mean())
+        metrics[f'{key}-std'] = float(values.std(ddof=1))
+    return metrics
+
+
 def _calculate_distance(domains: dict, fit_params, model_builder, verbose) -> dict:
     """
     Compute a classifier-dependent distance between domains.
@@ -180,14 +360,14 @@ def _calculate_distance(domains: dict, fit_params, model_builder, verbose) -> di
         x = np.concatenate(
             [domains[domain_a]['x'],
              domains[domain_b]['x']])
-        y = np.concatenate([np.full(domains[domain_a]['x'].shape[0], 0),
-                            np.full(domains[domain_b]['x'].shape[0], 1)])
+        y = np.concatenate([np.full(domains[domain_a]['x'].shape[0], 0, dtype=COMPUTE_DTYPE),
+                            np.full(domains[domain_b]['x'].shape[0], 1, dtype=COMPUTE_DTYPE)])
         p = np.random.permutation(x.shape[0])
         x, y = x[p], y[p]
 
         model = model_builder().fit(x, y, x, **fit_params)
         y_pred = model.predict(x)
-        acc = accuracy_score(y, y_pred > 0.5)
+        acc = _accuracy(y, y_pred)
         metrics[name] = 2 * acc - 1  # equiv to 0.5 * a_dist = 0.5 * 2*(1-2*err)
         pbar.set_description("Estimated distance")
     return metrics
@@ -0,0 +1,131 @@
+"""Kernel two-sample statistics between the global, source and target sets, with permutation p-values.
+A cheap indication of how far the domains are from each other, without training a model.
+
+The maximum mean discrepancy (MMD, Gretton et al., 2007) with a Gaussian kernel, and the energy distance
+(Szekely & Rizzo, 2004), are both quadratic forms w^T M w of a pairwise matrix of the pooled samples, with weights
+1/n_a for the samples of one set and -1/n_b for the other. A permutation of the set labels only changes the weights,
+so every permutation of every pair of sets is a column of one weight matrix, and a single pass over blocks of the
+pairwise distances of the pooled samples computes all of them at once. Memory stays within a block of distances,
+besides the weights. For three sets of 1000 samples this takes under a second."""
+
+import numpy as np
+
+# pairs of sets that are compared, like the proxy A-distance of evaluate_deep
+PAIRS = [('s', 'g'), ('s', 't'), ('g', 't')]
+N_PERMUTATIONS = 100
+# rows and columns of the blocks of pairwise distances
+BLOCK_SIZE = 1024
+# samples used to choose the kernel bandwidth
+BANDWIDTH_SAMPLES = 1000
+
+
+def median_bandwidth(x: np.ndarray, max_samples: int = BANDWIDTH_SAMPLES, seed: int = 0) -> float:
+    """Median squared distance between samples, the usual bandwidth of a Gaussian kernel, from a random subset."""
+    rng = np.random.default_rng(seed)
+    if len(x) > max_samples:
+        x = x[rng.choice(len(x), max_samples, replace=False)]
+    sq = _squared_distances(x, x, np.sum(x ** 2, axis=1), np.sum(x ** 2, axis=1))
+    sq = sq[np.triu_indices(len(x), k=1)]
+    median = np.median(sq[sq > 0]) if np.any(sq > 0) else 1.
+    return float(median)
+
+
+def _squared_distances(x: np.ndarray, y: np.ndarray, x_sq: np.ndarray, y_sq: np.ndarray) -> np.ndarray:
+    return np.maximum(x_sq[:, np.newaxis] + y_sq[np.newaxis, :] - 2 * x @ y.T, 0.)
+
+
+def permutation_weights(labels: np.ndarray, pairs: list[tuple], n_permutations: int = N_PERMUTATIONS,
+                        seed: int = 0) -> np.ndarray:
+    """Weights of the quadratic forms of every pair of sets, observed and with permuted labels.
+    :param labels: set of every pooled sample
+    :param pairs: pairs (a, b) of set labels
+    :returns: (samples, pairs * (n_permutations + 1)) matrix, per pair the observed weights followed by the
+    permutations. Samples of other sets have weight 0.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((len(labels), len(pairs) * (n_permutations + 1)))
+    for i, (a, b) in enumerate(pairs):
+        index = np.flatnonzero((labels == a) | (labels == b))
+        n_a = np.sum(labels == a)
+        base = np.where(labels[index] == a, 1. / n_a, -1. / (len(index) - n_a))
+        # every row a permutation of the observed weights, drawn at once
+        permuted = rng.permuted(np.tile(base, (n_permutations, 1)), axis=1)
+        weights[index, i * (n_permutations + 1)] = base
+        weights[index, i * (n_permutations + 1) + 1:(i + 1) * (n_permutations + 1)] = permuted.T
+    return weights
+
+
+def quadratic_forms(x: np.ndarray, labels: np.ndarray, pairs: list[tuple], weights: np.ndarray, bandwidth: float,
+                    block_size: int = BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """w^T K w and w^T D w for every column w of the weights, with K the Gaussian kernel and D the Euclidean distance
+    between the samples. Every block of distances is computed once, used for both triangles of the matrices and for
+    every pair of sets the block belongs to. Blocks between sets that no pair compares are skipped.
+    :param x: (samples, features) pooled samples, the samples of every set contiguous
+    :param labels: set of every sample
+    :param pairs: pairs (a, b) of set labels
+    :param weights: (samples, columns) weights of every pair, see `permutation_weights`
+    :param bandwidth: squared distance at which the kernel is exp(-1/2)
+    :returns: the kernel and distance forms, per column
+    """
+    x = np.asarray(x, dtype=np.float64)
+    sq = np.sum(x ** 2, axis=1)
+    group = weights.shape[1] // len(pairs)
+    # blocks of rows within a single set, as (set, rows)
+    blocks = []
+    for name in dict.fromkeys(labels):
+        index = np.flatnonzero(labels == name)
+        if np.any(np.diff(index) != 1):
+            raise ValueError(f"Samples of set '{name}' are not contiguous")
+        for start in range(index[0], index[-1] + 1, block_size):
+            blocks.append((name, slice(start, min(start + block_size, index[-1] + 1))))
+
+    kernel_w = np.zeros_like(weights)
+    distance_w = np.zeros_like(weights)
+    for i, (row_set, rows) in enumerate(blocks):
+        for col_set, cols in blocks[i:]:
+            # columns of the pairs that compare sets including both blocks
+            groups = [slice(k * group, (k + 1) * group) for k, pair in enumerate(pairs)
+                      if row_set in pair and col_set in pair]
+            if not groups:
+                continue
+            sq_dist = _squared_distances(x[rows], x[cols], sq[rows], sq[cols])
+            kernel = np.exp(-sq_dist / (2 * bandwidth))
+            distance = np.sqrt(sq_dist)
+            for columns in groups:
+                kernel_w[rows, columns] += kernel @ weights[cols, columns]
+                distance_w[rows, columns] += distance @ weights[cols, columns]
+                if cols != rows:
+                    kernel_w[cols, columns] += kernel.T @ weights[rows, columns]
+                    distance_w[cols, columns] += distance.T @ weights[rows, columns]
+    return np.sum(weights * kernel_w, axis=0), np.sum(weights * distance_w, axis=0)
+
+
+def two_sample_stats(sets: dict, pairs: list[tuple] = None, n_permutations: int = N_PERMUTATIONS,
+                     block_size: int = BLOCK_SIZE, seed: int = 0) -> dict:
+    """MMD and energy distance between pairs of sets, with permutation p-values.
+    The kernel bandwidth is the median squared distance of the pooled samples, the same for every pair.
+    :param sets: samples of every set by name, like {'g': xg, 's': xs, 't': xt}
+    :param pairs: pairs of set names to compare, default PAIRS
+    :param n_permutations: permutations of the set labels per pair, the smallest p-value is 1 / (n_permutations + 1)
+    :returns: per pair like 's-g', the squared MMD as 'mmd-s-g', the energy distance as 'energy-s-g', and their
+    p-values as 'mmd-pvalue-s-g' and 'energy-pvalue-s-g'
+    """
+    pairs = PAIRS if pairs is None else pairs
+    names = list(sets)
+    x = np.concatenate([np.asarray(sets[name], dtype=np.float64).reshape(len(sets[name]), -1) for name in names])
+    labels = np.repeat(np.array(names), [len(sets[name]) for name in names])
+
+    weights = permutation_weights(labels, pairs, n_permutations, seed)
+    mmd, energy = quadratic_forms(x, labels, pairs, weights, median_bandwidth(x, seed=seed), block_size)
+    # the energy distance is 2 E|a - b| - E|a - a'| - E|b - b'|, which is -w^T D w
+    energy = -energy
+
+    res = dict()
+    for i, (a, b) in enumerate(pairs):
+        columns = slice(i * (n_permutations + 1), (i + 1) * (n_permutations + 1))
+        for name, values in (('mmd', mmd[columns]), ('energy', energy[columns])):
+            observed, null = values[0], values[1:]
+            # the observed labels are one of the permutations, so the p-value is never 0
+            res[f'{name}-{a}-{b}'] = float(observed)
+            res[f'{name}-pvalue-{a}-{b}'] = float((np.sum(null >= observed - 1e-12) + 1) / (n_permutations + 1))
+    return res
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from experiment.presets.bias import bias_types
+from models.autoencoder import Autoencoder
+from util.batch import batch_generate, batch_eval, batch_load_eval
+
+PREFIX = "dtype"
+NUM = 5
+TOLERANCE = 0.02
+
+FIT_PARAMS = dict(epochs=20,
+                  batch_size=16,
+                  verbose=0)
+
+# (feature dtype during generation, feature dtype on disk)
+DTYPES = [('float64', 'float64'), ('float32', 'float32'), ('float32', 'float16')]
+
+
+def run(bias, gen_dtype: str, storage_dtype: str) -> np.ndarray:
+    """Generate and evaluate a batch with a fixed seed, returns the target accuracy per configuration."""
+    batch_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias.__name__}_{gen_dtype}_{storage_dtype}")
+    builder = bias()
+    builder.dtype = gen_dtype
+
+    np.random.seed(0)
+    tf.random.set_seed(0)
+    # in this process, so the seeds above apply
+    batch_generate(builder, NUM, batch_path, storage_dtype=storage_dtype, parallel=False)
+    batch_eval(batch_path, Autoencoder, dict(input_dim=5, encoder_dim=3), FIT_PARAMS, train_split=.7, parallel=False)
+
+    results = batch_load_eval(batch_path).sort_values('dataset')
+    return results.loc[:, results.columns.str.endswith('-acc-on-t')].mean()
+
+
+if __name__ == "__main__":
+    """Check that generating, storing and feeding float32 (or float16 on disk) keeps the mean target accuracies
+    within TOLERANCE of the float64 data path, for every bias type."""
+
+    failed = False
+    for bias in bias_types:
+        reference = run(bias, *DTYPES[0])
+        for gen_dtype, storage_dtype in DTYPES[1:]:
+            diff = (run(bias, gen_dtype, storage_dtype) - reference).abs()
+            ok = (diff <= TOLERANCE).all()
+            failed |= not ok
+            print(f"{bias.__name__} {gen_dtype}/{storage_dtype}: max abs diff {diff.max():.3f} "
+                  + ('(OK)' if ok else '(EXCEEDS TOLERANCE)'))
+
+    if failed:
+        raise SystemExit(1)
@@ -1,18 +1,33 @@
 import os
 
 from util.batch import batch_generate
-from experiment.presets.bias import bias_types
+from experiment.presets.bias import bias_types, bias_names
 
 PREFIX = "v6"
+N_TRAIN = 10
+N_VAL = 50
+# arrays of every version are stored once per unique content, see storage/blobs.py
+BLOB_PATH = os.path.join(os.getcwd(), '../results', '.blobs')
 
 
 def gen(builder, num, name):
     batch_path = os.path.join(os.getcwd(), '../results', PREFIX, name)
-    batch_generate(builder, num, batch_path)
+    batch_generate(builder, num, batch_path, blob_path=BLOB_PATH)
+
+
+def gen_bias(bias_name: str, validation: bool = False):
+    """Generate the train batch of a bias type, or the validation batch with the '_val' postfix."""
+    bias = bias_types[bias_names.index(bias_name)]
+    if validation:
+        gen(bias(), N_VAL, f"{bias_name}_val")
+    else:
+        gen(bias(), N_TRAIN, bias_name)
 
 
 if __name__ == "__main__":
-    """Generates one train and one validation dataset batch per bias type. Stored in the <PREFIX> subdirectory."""
-    for bias in bias_types:
-        gen(bias(), 10, bias.__name__)
-        gen(bias(), 50, f"{bias.__name__}_val")
+    """Generates one train and one validation dataset batch per bias type. Stored in the <PREFIX> subdirectory,
+    with the arrays in the blob store shared by every PREFIX. Remove the arrays of deleted batches with
+    python -m storage.blobs gc ../results/.blobs ../results"""
+    for bias_name in bias_names:
+        gen_bias(bias_name)
+        gen_bias(bias_name, validation=True)
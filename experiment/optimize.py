@@ -1,63 +1,220 @@
+import multiprocessing
 import os
+from functools import partial
 
 import numpy as np
-import optuna
-from adapt.feature_based import DANN
 
 from experiment.presets.bias import bias_names
 from experiment.presets.param import auto_param_gen, dann_param_gen
+from experiment.validate import FIT_PARAMS as VALIDATE_FIT_PARAMS
 from models.autoencoder import Autoencoder
-from util.batch import batch_eval_single
+from storage.preload import PreloadedBatch
+from util.batch import batch_eval_single, batch_eval_fidelity
+from util.isolate import clear_session
+from util.lazy import lazy_import
+from util.schedule import available_cores, core_slices, pin, limit_threads
+
+optuna = lazy_import('optuna')
 
 PREFIX = "v6"
 STORAGE = "sqlite:///../db.sqlite3"
 FIT_PARAMS = dict(epochs=20,
                   batch_size=16,
                   verbose=0)
+N_JOBS = 4
+N_TRIALS = 15
+# studies of every bias type, as (model, source, target), see `optimize_bias`
+STUDIES = [('DANN', 's', 't'), ('DANN', 's', 'g'), ('Autoencoder', 's', 't'), ('Autoencoder', 's', 'g'),
+           ('Autoencoder', 't', 't')]
+
+# multi-fidelity search, the last rung trains with the same budget as validation, on all data sets of the batch
+FIDELITY = True
+FIDELITY_DATASETS = 10
+FIDELITY_ETA = 3
+
+# running mean accuracy is reported after every data set, only prune after a few data sets are evaluated
+PRUNERS = {
+    'median': lambda: optuna.pruners.MedianPruner(n_startup_trials=3, n_warmup_steps=2),
+    'halving': lambda: optuna.pruners.SuccessiveHalvingPruner(min_resource=2, reduction_factor=3),
+    'none': lambda: optuna.pruners.NopPruner(),
+}
+
+
+def fidelity_schedule(max_epochs: int, max_datasets: int, eta: int = FIDELITY_ETA,
+                      min_epochs: int = 5) -> list[tuple[int, int]]:
+    """Rungs of (epochs, data sets), where the budget epochs * data sets grows roughly by a factor eta per rung.
+    Epochs and data sets are both scaled by sqrt(eta), the first rung has at least min_epochs and 2 data sets."""
+    scale = np.sqrt(eta)
+    n_rungs = 1 + max(0, int(np.floor(np.log(max_epochs / min_epochs) / np.log(scale))))
+    schedule = []
+    for k in reversed(range(n_rungs)):
+        epochs = int(round(max_epochs / scale ** k))
+        n_datasets = max(2, int(round(max_datasets / scale ** k)))
+        schedule.append((epochs, min(n_datasets, max_datasets)))
+    return schedule
+
+
+def fidelity_steps(schedule, eta: int = FIDELITY_ETA) -> list[int]:
+    """Steps to report per rung, so that the rungs of successive halving line up with those of the schedule."""
+    return [eta ** rung for rung in range(len(schedule))]
+
+
+def fidelity_pruner(eta: int = FIDELITY_ETA):
+    """Asynchronous successive halving over the rungs of the schedule, reported as in `fidelity_steps`."""
+    return optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=eta)
 
 
 def objective(path, model_cls, param_opt, source_domain, target_domain):
     """Generate an objective function for the current study.
     Requires a param_opt function that returns a model_params dict, using trial.suggest..."""
+    def _objective(trial):
+        # suggest the parameters here, and create them again from the suggested values where the models are trained,
+        # Keras objects like optimizers cannot be sent to the worker processes of batch_eval_single
+        param_opt(trial)
+        model_params = partial(param_opt, optuna.trial.FixedTrial(trial.params))
+        try:
+            acc = batch_eval_single(path, model_cls, model_params, FIT_PARAMS, source_domain, target_domain,
+                                    trial=trial)
+        finally:
+            # the models of the trial are no longer used, release them before the next trial of this worker
+            clear_session()
+        return np.mean(acc)
+
+    return _objective
+
+
+def objective_fidelity(path, model_cls, param_opt, source_domain, target_domain, schedule):
+    """Like `objective`, but evaluates the trial with increasing fidelity, see `batch_eval_fidelity`."""
     def _objective(trial):
         model_params = param_opt(trial)
-        acc = batch_eval_single(path, model_cls, model_params, FIT_PARAMS, source_domain, target_domain)
+        try:
+            acc = batch_eval_fidelity(path, model_cls, model_params, VALIDATE_FIT_PARAMS,
+                                      source_domain, target_domain, schedule, trial=trial,
+                                      steps=fidelity_steps(schedule))
+        finally:
+            clear_session()
         return np.mean(acc)
 
     return _objective
 
 
-def opt(model, param_generator, bias: str, source: str, target: str, n_trials: int = 15):
+def _make_objective(store_path, model, param_generator, source, target, schedule):
+    if schedule is None:
+        return objective(store_path, model, param_generator, source, target)
+    return objective_fidelity(store_path, model, param_generator, source, target, schedule)
+
+
+def _worker(study_name, store_path, model, param_generator, source, target, n_trials, schedule, cores):
+    """Run trials in a separate process, until the study has n_trials in total over all workers.
+    The batch is memory-mapped from the cache written by the parent process, shared between all workers.
+    The worker runs on its own cores, and evaluates the data sets of a trial in parallel on those,
+    see util/schedule.py."""
+    pin(cores)
+    limit_threads(len(cores))
+    study = optuna.load_study(study_name=study_name, storage=STORAGE)
+    batch = PreloadedBatch.load(store_path, mmap=True)
+    obj = _make_objective(batch, model, param_generator, source, target, schedule)
+    study.optimize(obj, n_trials=n_trials,
+                   callbacks=[optuna.study.MaxTrialsCallback(n_trials, states=None)])
+
+
+def study_name(bias: str, model_name: str, source: str, target: str) -> str:
+    """Name of the study of a model and configuration on the train batch of a bias type."""
+    adapt_name = f'{source}-only' if source == target else f'{source}->{target}'
+    return f"{PREFIX}-{bias}-{model_name}-{adapt_name}"
+
+
+def study_exists(name: str) -> bool:
+    """Whether the database holds a study with this name."""
+    return name in [s.study_name for s in optuna.study.get_all_study_summaries(storage=STORAGE)]
+
+
+def compute_summary(study) -> tuple[int, int]:
+    """Number of epochs trained over all data sets and trials of a study,
+    and the number if every trial was trained on the full budget."""
+    trials = study.get_trials(deepcopy=False)
+    cost = sum(t.user_attrs.get('cost', 0) for t in trials)
+    full_cost = max([t.user_attrs.get('cost', 0) for t in trials
+                     if t.state == optuna.trial.TrialState.COMPLETE], default=0)
+    return cost, full_cost * len(trials)
+
+
+def opt(model, param_generator, bias: str, source: str, target: str, n_trials: int = N_TRIALS,
+        n_jobs: int = N_JOBS, pruner: str = 'median', fidelity: bool = FIDELITY, overwrite: bool = False,
+        cores: list[int] = None):
     """Run hyperparameter optimization for a given configuration.
-       Stores result in Optuna database, with PREFIX and identifier in study name."""
+       Stores result in Optuna database, with PREFIX and identifier in study name.
+       Trials run in n_jobs processes that share the database. The param_generator has to be picklable,
+       so use functools.partial instead of a lambda to fix arguments.
+       With fidelity, trials follow `fidelity_schedule` up to the validation budget, and are pruned with
+       successive halving between rungs, instead of the given pruner.
+       With overwrite, an existing study with the same name is deleted first, otherwise it is skipped.
+       The workers divide the given cores between them, by default every core this process may run on, e.g. the
+       share of a pipeline stage, and there are at most as many workers as cores."""
     store_path = os.path.join(os.getcwd(), '../results', PREFIX, bias)
-    adapt_name = f'{source}-only' if source == target else f'{source}->{target}'
-    study_name = f"{PREFIX}-{bias}-{model.__name__}-{adapt_name}"
+    name = study_name(bias, model.__name__, source, target)
 
     # check if it exists already
-    summaries = optuna.study.get_all_study_summaries(storage=STORAGE)
-    if study_name in [s.study_name for s in summaries]:
-        print(f"Skipping {study_name} because it already exists.")
-        return
+    if study_exists(name):
+        if not overwrite:
+            print(f"Skipping {name} because it already exists.")
+            return
+        optuna.delete_study(study_name=name, storage=STORAGE)
+
+    schedule = None
+    if fidelity:
+        schedule = fidelity_schedule(VALIDATE_FIT_PARAMS['epochs'], FIDELITY_DATASETS)
 
-    obj = objective(store_path, model, param_generator, source, target)
     study = optuna.create_study(
         storage=STORAGE,
-        study_name=study_name,
+        study_name=name,
         direction='maximize',
+        pruner=fidelity_pruner() if fidelity else PRUNERS[pruner](),
         load_if_exists=False)
-    study.optimize(obj, n_trials=n_trials)
 
+    cores = cores or available_cores()
+    n_jobs = min(n_jobs, len(cores))
 
-if __name__ == "__main__":
+    # read the batch once for all trials, instead of once per trial
+    if n_jobs == 1:
+        pin(cores)
+        limit_threads(len(cores))
+        batch = PreloadedBatch.load(store_path)
+        obj = _make_objective(batch, model, param_generator, source, target, schedule)
+        study.optimize(obj, n_trials=n_trials)
+    else:
+        # separate processes instead of threads, tensorflow does not train multiple models well in one process
+        PreloadedBatch.load(store_path, mmap=True)
+        ctx = multiprocessing.get_context('spawn')
+        workers = [ctx.Process(target=_worker,
+                               args=(name, store_path, model, param_generator, source, target, n_trials,
+                                     schedule, worker_cores))
+                   for worker_cores in core_slices(n_jobs, cores)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
 
-    for bias_name in bias_names:
+    cost, full_cost = compute_summary(study)
+    print(f"{name}: trained {cost} of {full_cost} epochs over all data sets "
+          f"({1 - cost / max(full_cost, 1):.0%} saved by pruning)")
+
+
+def optimize_bias(bias_name: str, overwrite: bool = False, cores: list[int] = None):
+    """Run every study of STUDIES for a bias type, see `opt`.
+    :param cores: cores of the workers of every study, default every core this process may run on"""
+    from adapt.feature_based import DANN
 
-        # adaptation
-        opt(DANN, dann_param_gen, bias_name, 's', 't')
-        opt(DANN, dann_param_gen, bias_name, 's', 'g')
-        opt(Autoencoder, auto_param_gen, bias_name, 's', 't')
-        opt(Autoencoder, auto_param_gen, bias_name, 's', 'g')
+    models = {'DANN': (DANN, dann_param_gen), 'Autoencoder': (Autoencoder, auto_param_gen)}
+    for model_name, source, target in STUDIES:
+        model, param_generator = models[model_name]
+        if source == target:
+            # supervised, zero adaptation parameter, only Autoencoder has params left to optimize
+            param_generator = partial(param_generator, mmd_weight=0)
+        opt(model, param_generator, bias_name, source, target, overwrite=overwrite, cores=cores)
 
-        # supervised, zero adaptation parameter, only Autoencoder has params left to optimize
-        opt(Autoencoder, lambda trial: auto_param_gen(trial, mmd_weight=0), bias_name, 't', 't')
+
+if __name__ == "__main__":
+
+    for bias_name in bias_names:
+        optimize_bias(bias_name)
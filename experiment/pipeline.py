@@ -0,0 +1,264 @@
+"""Dependency-aware runner for the experiment stages: generate -> optimize -> validate -> plot.
+Every stage declares its inputs, outputs and configuration. A stage is only rebuilt when the hash of its
+configuration and inputs changed since its last successful run, or when one of its outputs is missing: a batch,
+a study, an evaluation file or a plot. The configuration includes the source of the search spaces in
+presets/param.py, so changing them reruns the optimization and everything after it.
+Stages that do not depend on each other, like those of different bias types, run concurrently, each on its own share
+of the cores, which the parallel workers of the stage divide between them."""
+
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+from experiment import generate, optimize, validate, validateextra
+from experiment.presets import param
+from experiment.presets.bias import bias_types, bias_names
+from storage.storage import EVAL_FILE
+from util.batch import batch_store_names
+from util.schedule import core_slices, pin, limit_threads
+
+PREFIX = "v6"
+STATE_DIR = '.pipeline'
+N_WORKERS = 4
+# identifiers of the evaluations of validate, validateextra appends '$', one plot is saved per identifier
+IDENTIFIERS = ['DANN', 'Autoencoder']
+
+
+class Stage:
+    def __init__(self, name: str, func: str, args: tuple, config: dict,
+                 inputs: list[str] = (), outputs: list = ()):
+        """
+        A single step of the pipeline, run in a worker process.
+        :param name: unique name of the stage
+        :param func: function to run, formatted as 'module:function'. Imported in the worker process.
+        :param args: arguments for the function
+        :param config: everything besides the inputs that determines the result, changing it rebuilds the stage
+        :param inputs: names of the stages whose outputs are used by this stage
+        :param outputs: paths of files or directories created by the stage, or functions that return whether an
+        output that is not a file exists, like a study in the database. The stage is rebuilt if one is missing.
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.config = config
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def compute_key(self, input_keys: dict) -> str:
+        """Hash of the stage and of its inputs' hashes, so a change propagates to every stage downstream."""
+        content = dict(name=self.name, func=self.func, args=self.args, config=self.config,
+                       inputs={name: input_keys[name] for name in self.inputs})
+        data = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def missing_outputs(self) -> bool:
+        """Whether any output of the stage does not exist."""
+        return not all(output() if callable(output) else os.path.exists(output) for output in self.outputs)
+
+
+def source_hash(module) -> str:
+    """Hash of the source file of a module, so that editing it rebuilds the stages that depend on it."""
+    with open(module.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _eval_files(batch_path: str, num: int, identifiers: list[str]) -> list[str]:
+    return [os.path.join(batch_path, name, f'{EVAL_FILE}_{identifier}.json')
+            for name in batch_store_names(num) for identifier in identifiers]
+
+
+def build_stages() -> list[Stage]:
+    """All stages of the experiments in the paper, for every bias type."""
+    results = os.path.join(os.getcwd(), '../results', PREFIX)
+    schedule = optimize.fidelity_schedule(optimize.VALIDATE_FIT_PARAMS['epochs'], optimize.FIDELITY_DATASETS) \
+        if optimize.FIDELITY else None
+    # with fidelity, trials train with the validation parameters, on the rungs of the schedule
+    opt_fit_params = optimize.VALIDATE_FIT_PARAMS if optimize.FIDELITY else optimize.FIT_PARAMS
+    params = source_hash(param)
+    opt_config = dict(fit_params=opt_fit_params, n_trials=optimize.N_TRIALS, schedule=schedule, params=params)
+
+    stages = []
+    for bias, bias_name in zip(bias_types, bias_names):
+        builder = bias().to_json()
+        val_path = os.path.join(results, f'{bias_name}_val')
+        stages += [
+            Stage(f'generate/{bias_name}', 'experiment.generate:gen_bias', (bias_name, False),
+                  dict(builder=builder, num=generate.N_TRAIN),
+                  outputs=[os.path.join(results, bias_name)]),
+            Stage(f'generate/{bias_name}_val', 'experiment.generate:gen_bias', (bias_name, True),
+                  dict(builder=builder, num=generate.N_VAL),
+                  outputs=[os.path.join(results, f'{bias_name}_val')]),
+            Stage(f'optimize/{bias_name}', 'experiment.optimize:optimize_bias', (bias_name, True),
+                  opt_config, inputs=[f'generate/{bias_name}'],
+                  outputs=[partial(optimize.study_exists, optimize.study_name(bias_name, *study))
+                           for study in optimize.STUDIES]),
+            Stage(f'validate/{bias_name}', 'experiment.validate:validate_bias', (bias_name,),
+                  dict(fit_params=validate.FIT_PARAMS, params=params),
+                  inputs=[f'optimize/{bias_name}', f'generate/{bias_name}_val'],
+                  outputs=_eval_files(val_path, generate.N_VAL, IDENTIFIERS)),
+        ]
+        identifiers = list(IDENTIFIERS)
+
+        plot_inputs = [f'validate/{bias_name}']
+        if 'cov' in bias_name:
+            reference = validateextra.REFERENCE
+            stages.append(Stage(f'validateextra/{bias_name}', 'experiment.validateextra:validate_extra_bias',
+                                (bias_name, reference), dict(fit_params=validateextra.FIT_PARAMS, params=params),
+                                inputs=[f'optimize/{reference}', f'generate/{bias_name}_val'],
+                                outputs=_eval_files(val_path, generate.N_VAL,
+                                                    [f'{identifier}$' for identifier in IDENTIFIERS])))
+            plot_inputs.append(f'validateextra/{bias_name}')
+            identifiers += [f'{identifier}$' for identifier in IDENTIFIERS]
+
+        # saved as png, the default format of matplotlib
+        stages.append(Stage(f'plot/{bias_name}', 'experiment.plot:plot_bias', (bias_name,), dict(),
+                            inputs=plot_inputs,
+                            outputs=[os.path.join(results, f'{bias_name}_{identifier}.png')
+                                     for identifier in identifiers]))
+    return stages
+
+
+def _record_path(name: str) -> str:
+    return os.path.join(os.getcwd(), '../results', PREFIX, STATE_DIR, f"{name.replace('/', '.')}.json")
+
+
+def _read_key(name: str):
+    path = _record_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)['key']
+
+
+def _write_record(name: str, key: str, duration: float) -> None:
+    path = _record_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(key=key, duration=duration, finished=time.strftime("%Y-%m-%d_%H-%M-%S")), f, indent=4)
+
+
+def _run_stage(func: str, args: tuple, cores: list[int]) -> float:
+    """Run a stage in a worker process, on the given cores, returns the duration in seconds.
+    Processes started by the stage inherit the cores, and schedulers divide only those, see util/schedule.py."""
+    pin(cores)
+    limit_threads(len(cores))
+    start = time.time()
+    module, name = func.split(':')
+    getattr(importlib.import_module(module), name)(*args)
+    return time.time() - start
+
+
+def topological_order(stages: list[Stage]) -> list[Stage]:
+    """Order stages so that every stage comes after its inputs. Raises ValueError on cycles or unknown inputs."""
+    by_name = {stage.name: stage for stage in stages}
+    order, visiting, visited = [], set(), set()
+
+    def visit(stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Cycle in pipeline at stage '{stage.name}'")
+        visiting.add(stage.name)
+        for name in stage.inputs:
+            if name not in by_name:
+                raise ValueError(f"Stage '{stage.name}' has unknown input '{name}'")
+            visit(by_name[name])
+        visiting.remove(stage.name)
+        visited.add(stage.name)
+        order.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return order
+
+
+def find_stale(stages: list[Stage], force: list[str] = ()) -> tuple[list[Stage], dict]:
+    """Stages that need to run, in topological order, and the key of every stage.
+    A stage is stale if forced, if its key changed, if an output is missing, or if one of its inputs is stale."""
+    keys, stale = dict(), []
+    stale_names = set()
+    for stage in topological_order(stages):
+        keys[stage.name] = stage.compute_key(keys)
+        if (stage.name in force
+                or _read_key(stage.name) != keys[stage.name]
+                or stage.missing_outputs()
+                or any(name in stale_names for name in stage.inputs)):
+            stale.append(stage)
+            stale_names.add(stage.name)
+    return stale, keys
+
+
+def run(stages: list[Stage], n_workers: int = N_WORKERS, force: list[str] = (), dry_run: bool = False) -> bool:
+    """Run all stale stages on a pool of worker processes, as soon as their inputs are up-to-date.
+    If a stage fails, the stages depending on it are skipped, independent stages continue.
+    The cores are divided into n_workers shares, every running stage uses one of them.
+    :returns: True if every stale stage ran successfully
+    """
+    stale, keys = find_stale(stages, force)
+    print(f"{len(stale)} of {len(stages)} stages are stale")
+    for stage in stale:
+        print(f"  {stage.name}")
+    if dry_run or not stale:
+        return True
+
+    pending = {stage.name: stage for stage in stale}
+    done = {stage.name for stage in stages} - set(pending)
+    failed = set()
+    running = dict()
+    shares = core_slices(n_workers)
+    # at most n_workers stages run at once, so a share is free for every stage that starts
+    free_shares = list(range(n_workers))
+
+    # tensorflow does not survive fork, and plots must not block on a headless worker
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(dep in failed for dep in stage.inputs):
+                    print(f"Skipping {name}, because an input failed")
+                    failed.add(name)
+                    del pending[name]
+                elif all(dep in done for dep in stage.inputs):
+                    print(f"Starting {name}")
+                    share = free_shares.pop()
+                    running[pool.submit(_run_stage, stage.func, stage.args, shares[share])] = (stage, share)
+                    del pending[name]
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, share = running.pop(future)
+                free_shares.append(share)
+                try:
+                    duration = future.result()
+                except Exception as e:
+                    print(f"Failed {stage.name}: {e!r}")
+                    failed.add(stage.name)
+                    continue
+                _write_record(stage.name, keys[stage.name], duration)
+                done.add(stage.name)
+                print(f"Finished {stage.name} in {duration:.0f}s")
+
+    return not failed
+
+
+if __name__ == "__main__":
+    """Run every stale stage of the experiments, in dependency order. Run from the experiment directory,
+    like the separate scripts. Changing a preset in presets/bias.py only reruns the stages of that bias type."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=N_WORKERS, help="number of stages to run concurrently")
+    parser.add_argument('--force', nargs='*', default=[], help="names of stages to rerun, even if up-to-date")
+    parser.add_argument('--dry-run', action='store_true', help="only list the stale stages")
+    cli_args = parser.parse_args()
+
+    ok = run(build_stages(), cli_args.workers, cli_args.force, cli_args.dry_run)
+    if not ok:
+        raise SystemExit(1)
@@ -25,34 +25,41 @@ _init_classification = dict(n_samples=N_INITIAL,
                             n_clusters_per_class=4)
 
 
-def concept_weak() -> ConceptShiftDataBuilder:
-    shifter = Shifter(n_domains=CONCEPT_N_DOMAINS, rot=0, trans=CONCEPT_TRANS_WEAK, scale=0)
+def concept_builder(trans: float = 0, rot: float = 0, scale: float = 0,
+                    n_domains: int = CONCEPT_N_DOMAINS) -> ConceptShiftDataBuilder:
+    """Concept shift preset with custom shift parameters, see Shifter."""
+    shifter = Shifter(n_domains=n_domains, rot=rot, trans=trans, scale=scale)
     selector = DomainSelector(n_global=N_GLOBAL, n_source=N_SOURCE, n_target=N_TARGET,
                               n_domains_source=1, n_domains_target=1)
     return ConceptShiftDataBuilder(_init_classification, shifter, selector)
 
 
+def covariate_builder(bias_dist: float, source_scale: float, target_scale: float = None) -> CovShiftBuilder:
+    """Covariate shift preset with custom bias parameters, see FeatureSelector. Uses source_scale for the target
+    if target_scale is None."""
+    if target_scale is None:
+        target_scale = source_scale
+    selector = FeatureSelector(n_global=N_GLOBAL, n_source=N_SOURCE, n_target=N_TARGET,
+                               source_scale=source_scale,
+                               target_scale=target_scale,
+                               bias_dist=bias_dist)
+    return CovShiftBuilder(_init_classification, selector)
+
+
+def concept_weak() -> ConceptShiftDataBuilder:
+    return concept_builder(trans=CONCEPT_TRANS_WEAK)
+
+
 def concept_strong() -> ConceptShiftDataBuilder:
-    shifter = Shifter(n_domains=CONCEPT_N_DOMAINS, rot=0, trans=CONCEPT_TRANS_STRONG, scale=0)
-    selector = DomainSelector(n_global=N_GLOBAL, n_source=N_SOURCE, n_target=N_TARGET,
-                              n_domains_source=1, n_domains_target=1)
-    return ConceptShiftDataBuilder(_init_classification, shifter, selector)
+    return concept_builder(trans=CONCEPT_TRANS_STRONG)
 
 
 def covariate_weak() -> CovShiftBuilder:
-    selector = FeatureSelector(n_global=N_GLOBAL, n_source=N_SOURCE, n_target=N_TARGET,
-                               source_scale=COV_SCALE_WEAK,
-                               target_scale=COV_SCALE_WEAK,
-                               bias_dist=COV_DIST_WEAK)
-    return CovShiftBuilder(_init_classification, selector)
+    return covariate_builder(bias_dist=COV_DIST_WEAK, source_scale=COV_SCALE_WEAK)
 
 
 def covariate_strong() -> CovShiftBuilder:
-    selector = FeatureSelector(n_global=N_GLOBAL, n_source=N_SOURCE, n_target=N_TARGET,
-                               source_scale=COV_SCALE_STRONG,
-                               target_scale=COV_SCALE_STRONG,
-                               bias_dist=COV_DIST_STRONG)
-    return CovShiftBuilder(_init_classification, selector)
+    return covariate_builder(bias_dist=COV_DIST_STRONG, source_scale=COV_SCALE_STRONG)
 
 
 bias_types = [concept_weak, concept_strong, covariate_weak, covariate_strong]
@@ -1,4 +1,3 @@
-from tensorflow.keras.optimizers.legacy import Adam
 from models.autoencoder import default_classifier
 
 
@@ -20,6 +19,8 @@ def dann_param_gen(trial, lambda_=None):
     or Optuna study.best_trial to reuse best params.
     :param lambda_: fixed mmd_weight to use. if None, included in HPO."""
 
+    from tensorflow.keras.optimizers.legacy import Adam
+
     if lambda_ is None:
         lambda_ = trial.suggest_float('lambda_', 0.0, 10.0)
     return dict(loss="bce",
@@ -28,3 +29,14 @@ def dann_param_gen(trial, lambda_=None):
                 metrics=["acc"],
                 task=default_classifier(),
                 random_state=0)
+
+
+def dann_multi_param_gen(trials: dict) -> dict:
+    """Generates parameters for every configuration, for batch evaluation with multi_param.
+    Pass it as a function of the trials, e.g. with functools.partial, so the Keras objects are created in the process
+    that trains the models, see util/schedule.py.
+    :param trials: for every configuration, like 's->t', the Optuna trial with the parameters to reuse,
+    or None to train without adaptation (lambda_=0)."""
+
+    return {config: dann_param_gen(None, lambda_=0.0) if trial is None else dann_param_gen(trial)
+            for config, trial in trials.items()}
@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from experiment.presets.bias import bias_names
+from util.batch import batch_load_eval
+from util.plot import plot_target_acc_box, plot_adaptation, plot_relative_adaptation
+from util.schedule import available_cores
+
+PREFIX = "v6"
+MANIFEST_FILE = '.report.json'
+
+# figure kind -> plot function, every function is called as func(results, title, save=..., show=False)
+PLOTS = {
+    'box': plot_target_acc_box,
+    'adaptation': plot_adaptation,
+    'relative': plot_relative_adaptation,
+}
+
+
+def load_results(biases: list[str]) -> pd.DataFrame:
+    """Results of every method on the validation batch of every bias type, as one table with a 'bias' column."""
+    frames = []
+    for bias in biases:
+        store_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias}_val")
+        frames.append(batch_load_eval(store_path).assign(bias=bias))
+    return pd.concat(frames, ignore_index=True)
+
+
+def figure_jobs(results: pd.DataFrame, out_path: str) -> list[tuple[str, pd.DataFrame, str, str]]:
+    """Every figure of the report, as (kind, data, title, path) for each bias type and method."""
+    jobs = []
+    for (bias, model), data in results.groupby(['bias', 'identifier']):
+        bias_formatted = ' '.join([w.capitalize() for w in bias.split('_')])
+        model_formatted = str(model).replace("$", "$^\\ast$")
+        title = f"{bias_formatted} - {model_formatted}"
+        # only the accuracy columns are plotted, so other columns do not change the hash
+        data = data.sort_values('dataset').loc[:, data.columns.str.endswith('-acc-on-t')].reset_index(drop=True)
+        for kind in PLOTS:
+            jobs.append((kind, data, title, os.path.join(out_path, f"{bias}_{model}_{kind}.png")))
+    return jobs
+
+
+def figure_hash(kind: str, data: pd.DataFrame, title: str) -> str:
+    """Hash of everything a figure depends on: its data, title, kind and the source of the plot functions."""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    digest.update(','.join(data.columns).encode())
+    digest.update(f'{kind}|{title}'.encode())
+    with open(PLOTS[kind].__code__.co_filename, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _init_worker() -> None:
+    # render to files only, so the report also works without a display
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(kind: str, data: pd.DataFrame, title: str, path: str) -> str:
+    PLOTS[kind](data, title, save=path, show=False)
+    return path
+
+
+def build_report(biases: list[str] = None, out_path: str = None, n_jobs: int = None, force: bool = False) -> list[str]:
+    """Render the figures of every bias type and method, in parallel processes without a display.
+    Figures whose data did not change since the last report are skipped, see `figure_hash`.
+    :param biases: names of the bias types, default all
+    :param out_path: directory of the figures, default results/<PREFIX>/report
+    :param n_jobs: number of processes, default one per available core
+    :param force: render every figure, also the unchanged ones
+    :returns: paths of the rendered figures
+    """
+    out_path = out_path or os.path.join(os.getcwd(), '../results', PREFIX, 'report')
+    os.makedirs(out_path, exist_ok=True)
+    manifest_path = os.path.join(out_path, MANIFEST_FILE)
+    # figure file name -> hash of the figure when it was rendered
+    manifest = dict()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    jobs = []
+    hashes = dict()
+    for kind, data, title, path in figure_jobs(load_results(biases or bias_names), out_path):
+        name = os.path.basename(path)
+        hashes[name] = figure_hash(kind, data, title)
+        if force or manifest.get(name) != hashes[name] or not os.path.exists(path):
+            jobs.append((kind, data, title, path))
+    print(f"Rendering {len(jobs)} of {len(hashes)} figures, the others did not change")
+
+    n_jobs = min(n_jobs or len(available_cores()), len(jobs))
+    if n_jobs <= 1:
+        _init_worker()
+        rendered = [_render(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker) as pool:
+            rendered = list(pool.map(_render, *zip(*jobs)))
+
+    # only written after every figure was rendered, so figures of an interrupted report are rendered again
+    manifest.update(hashes)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return rendered
+
+
+if __name__ == "__main__":
+    """Render the box, adaptation and relative adaptation plots of every bias type and method to results/<PREFIX>/report,
+    from the results of all validation batches, loaded once. Unchanged figures are skipped."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bias', nargs='*', default=bias_names, help="names of the bias types to plot")
+    parser.add_argument('--jobs', type=int, default=None, help="number of processes, default one per core")
+    parser.add_argument('--force', action='store_true', help="also render figures whose data did not change")
+    cli_args = parser.parse_args()
+
+    build_report(cli_args.bias, n_jobs=cli_args.jobs, force=cli_args.force)
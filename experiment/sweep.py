@@ -0,0 +1,204 @@
+"""Sweep dataset generation parameters, like the shift strength of the presets, and map the accuracy over them.
+Every point of the sweep generates a batch of datasets with its own builder and evaluates a model on it.
+Points run in a pool of worker processes, and each result is appended to a single JSON-lines table on completion.
+Points that fail are appended to a separate table with their error, and retried when the sweep is resumed.
+Instead of refining the whole grid, refinement adds points where the gap between s->t and s->g changes fastest."""
+
+import hashlib
+import itertools
+import json
+import multiprocessing
+import numbers
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from experiment.presets.bias import concept_builder
+from models.autoencoder import Autoencoder
+from util.batch import batch_generate, batch_eval, batch_load_eval
+from util.schedule import core_slices, pin_share
+
+PREFIX = "v6"
+TABLE_FILE = 'sweep.jsonl'
+FAILED_FILE = 'failed.jsonl'
+POINTS_DIR = 'points'
+
+# the metrics whose difference guides the refinement
+GAP_METRICS = ('s->t-acc-on-t', 's->g-acc-on-t')
+
+
+def expand_grid(ranges: dict) -> list[dict]:
+    """Every combination of the parameter values, as a list of keyword arguments for the builder function."""
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*(ranges[name] for name in names))]
+
+
+def point_id(params: dict) -> str:
+    """Short stable identifier of a point, used as directory name and to skip points that were already evaluated.
+    Numbers are hashed as floats, so 1 and 1.0, e.g. from a grid and from refinement, are the same point."""
+    params = {key: float(value) if isinstance(value, numbers.Real) and not isinstance(value, bool) else value
+              for key, value in params.items()}
+    data = json.dumps(params, sort_keys=True, default=float)
+    return hashlib.sha1(data.encode()).hexdigest()[:12]
+
+
+def run_point(make_builder, params: dict, num: int, out_path: str, model, model_params, fit_params: dict,
+              train_split: float) -> dict:
+    """Generate and evaluate the datasets of a single point, returns a row of the results table.
+    :param model_params: parameters for the model, or a function returning them if they are not picklable,
+    e.g. functools.partial(dann_param_gen, None, lambda_=1.0)
+    """
+    if callable(model_params):
+        model_params = model_params()
+
+    batch_path = os.path.join(out_path, POINTS_DIR, point_id(params))
+    batch_generate(make_builder(**params), num, batch_path)
+    batch_eval(batch_path, model, model_params, fit_params, train_split)
+
+    results = batch_load_eval(batch_path)
+    metrics = results.loc[:, results.columns.str.startswith('metrics.')]
+    row = dict(params)
+    row['point'] = point_id(params)
+    row['n_datasets'] = len(results)
+    for col in metrics:
+        name = col.split('metrics.')[1]
+        row[f'{name}-mean'] = float(metrics[col].mean())
+        row[f'{name}-std'] = float(metrics[col].std())
+    return row
+
+
+def load_sweep(out_path: str) -> pd.DataFrame:
+    """Load the results table of a sweep, one row per evaluated point."""
+    path = os.path.join(out_path, TABLE_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    # point identifiers of only digits would be read as numbers
+    return pd.read_json(path, lines=True, dtype={'point': str})
+
+
+def refine(table: pd.DataFrame, param_names: list[str], n_points: int) -> list[dict]:
+    """New points halfway between neighbours where the s->t vs s->g gap changes the most.
+    Neighbours differ in a single parameter, and are adjacent in it. The change of the gap is divided by the distance,
+    relative to the range of that parameter, so every parameter is treated equally.
+    Parameters with integer values in the table stay integers, their midpoints are rounded."""
+    gap = table[f'{GAP_METRICS[0]}-mean'] - table[f'{GAP_METRICS[1]}-mean']
+    table = table.assign(_gap=gap)
+    existing = {point_id(params) for params in table[param_names].to_dict('records')}
+
+    candidates = []
+    for name in param_names:
+        others = [other for other in param_names if other != name]
+        span = table[name].max() - table[name].min()
+        if span == 0:
+            continue
+        integer = pd.api.types.is_integer_dtype(table[name])
+        groups = table.groupby(others) if others else [(None, table)]
+        for _, group in groups:
+            group = group.sort_values(name)
+            values = group[name].to_numpy(dtype=float)
+            gaps = group['_gap'].to_numpy()
+            for i in range(len(group) - 1):
+                dist = (values[i + 1] - values[i]) / span
+                if dist <= 0:
+                    continue
+                # per column, a row of mixed types would turn integers into floats
+                params = {key: _item(group[key].iloc[i]) for key in param_names}
+                middle = (values[i] + values[i + 1]) / 2
+                params[name] = int(round(middle)) if integer else float(middle)
+                candidates.append((abs(gaps[i + 1] - gaps[i]) / dist, params))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    res = []
+    for _, params in candidates:
+        if point_id(params) not in existing:
+            existing.add(point_id(params))
+            res.append(params)
+        if len(res) >= n_points:
+            break
+    return res
+
+
+def _item(value):
+    """Plain Python value of a table cell, like an int instead of np.int64, as passed to make_builder."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def sweep(make_builder, ranges: dict, out_path: str, model, model_params, fit_params: dict,
+          num: int = 5, train_split: float = .7, n_workers: int = 4,
+          refine_rounds: int = 0, refine_points: int = 4) -> pd.DataFrame:
+    """Evaluate a model over a grid of builder parameters, then optionally refine it adaptively.
+    Points that are already in the table of out_path are skipped, so an interrupted sweep can be resumed.
+    A point that fails does not stop the sweep, it is recorded in FAILED_FILE with its error instead,
+    and retried when the sweep is run again.
+    :param make_builder: picklable function that returns a dataset builder, given the parameters of a point.
+    For example `concept_builder` or `covariate_builder` from presets/bias.py
+    :param ranges: for each keyword argument of make_builder, the values of the initial grid
+    :param out_path: directory for the results table and the datasets of every point
+    :param model: class of the adaptation model
+    :param model_params: parameters for the model, see `run_point`
+    :param fit_params: parameters for the model class's fit
+    :param num: number of datasets per point
+    :param train_split: proportion to use for training data, use rest for test.
+    :param n_workers: number of points evaluated concurrently, each in its own process, on its own share of the cores
+    :param refine_rounds: number of rounds of adaptive refinement after the initial grid
+    :param refine_points: number of points added per round of refinement
+    :returns: the results table, one row per point
+    """
+    os.makedirs(out_path, exist_ok=True)
+    table_path = os.path.join(out_path, TABLE_FILE)
+    param_names = list(ranges)
+
+    ctx = multiprocessing.get_context('spawn')
+    # the data sets of a point run in parallel within the share of its worker, see util/schedule.py
+    slots = ctx.Queue()
+    for cores in core_slices(n_workers):
+        slots.put(cores)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=pin_share,
+                             initargs=(slots,)) as pool:
+        points = expand_grid(ranges)
+        for round_ in range(refine_rounds + 1):
+            done = set(load_sweep(out_path).get('point', []))
+            futures = {pool.submit(run_point, make_builder, params, num, out_path, model, model_params,
+                                   fit_params, train_split): params
+                       for params in points if point_id(params) not in done}
+
+            # stream every result into the table as soon as it completes
+            for future in as_completed(futures):
+                params = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    failure = dict(params, point=point_id(params), round=round_, error=repr(e),
+                                   traceback=''.join(traceback.format_exception(e)))
+                    with open(os.path.join(out_path, FAILED_FILE), 'a') as f:
+                        f.write(json.dumps(failure, default=float) + '\n')
+                    print(f"Failed point {failure['point']}: {params}: {e!r}")
+                    continue
+                row['round'] = round_
+                with open(table_path, 'a') as f:
+                    f.write(json.dumps(row) + '\n')
+                print(f"Finished point {row['point']}: {({name: row[name] for name in param_names})}")
+
+            if round_ < refine_rounds:
+                table = load_sweep(out_path)
+                if table.empty:
+                    # every point failed, nothing to refine
+                    break
+                points = refine(table, param_names, refine_points)
+                if not points:
+                    break
+
+    return load_sweep(out_path)
+
+
+if __name__ == "__main__":
+    """Map the accuracy of the Autoencoder over the translation and rotation of concept shift."""
+    sweep(concept_builder,
+          dict(trans=np.linspace(0, 4, 5).tolist(), rot=np.linspace(0, 1, 3).tolist()),
+          os.path.join(os.getcwd(), '../results', PREFIX, 'sweep_concept'),
+          Autoencoder, dict(input_dim=5, encoder_dim=3),
+          dict(epochs=30, batch_size=16, verbose=0),
+          refine_rounds=3)
@@ -1,12 +1,15 @@
+import argparse
 import os
+from functools import partial
 
-import optuna
-from adapt.feature_based import DANN
-
-from experiment.presets.bias import bias_names
-from experiment.presets.param import auto_param_gen, dann_param_gen
+from experiment.generate import N_VAL
+from experiment.presets.bias import bias_names, bias_types
+from experiment.presets.param import auto_param_gen, dann_multi_param_gen
 from models.autoencoder import Autoencoder
-from util.batch import batch_eval
+from util.batch import batch_eval, batch_eval_sequential
+from util.lazy import lazy_import
+
+optuna = lazy_import('optuna')
 
 PREFIX = "v6"
 
@@ -20,30 +23,58 @@ def load_best_trial(bias, model, adapt_name):
     return optuna.load_study(study_name=study_name, storage="sqlite:///../db.sqlite3").best_trial
 
 
+def validate_bias(bias_name: str, queue: bool = False, tolerance: float = None):
+    """Run the evaluation framework for every model and configuration on the validation batch of a bias type.
+    Using optimized parameters, loaded from the Optuna database. Reuses t-only for s-only.
+    :param queue: share the data sets with other workers validating the same batch, see util/jobqueue.py
+    :param tolerance: evaluate, and generate, data sets until the intervals of the target accuracies and of the
+    gains over s-only are narrower than this, at most N_VAL, see `batch_eval_sequential`"""
+    from adapt.feature_based import DANN
+
+    store_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias_name}_val")
+
+    # created per data set, in the worker process that trains the models
+    dann_params = partial(dann_multi_param_gen, {
+        's-only': None,
+        's->t': load_best_trial(bias_name, DANN, 's->t'),
+        's->g': load_best_trial(bias_name, DANN, 's->g'),
+        't-only': None
+    })
+
+    auto_params = {
+        's-only': auto_param_gen(load_best_trial(bias_name, Autoencoder, 't-only'), mmd_weight=0.0),
+        's->t': auto_param_gen(load_best_trial(bias_name, Autoencoder, 's->t')),
+        's->g': auto_param_gen(load_best_trial(bias_name, Autoencoder, 's->g')),
+        't-only': auto_param_gen(load_best_trial(bias_name, Autoencoder, 't-only'), mmd_weight=0.0),
+    }
+
+    print(f"Evaluating with {bias_name}")
+    if tolerance is not None:
+        builder = bias_types[bias_names.index(bias_name)]()
+        for model, params in ((DANN, dann_params), (Autoencoder, auto_params)):
+            batch_eval_sequential(store_path, model, params, FIT_PARAMS, .7, tolerance,
+                                  differences=[('s->g', 's-only'), ('s->t', 's-only')], builder=builder,
+                                  max_datasets=N_VAL, multi_param=True, identifier=model.__name__)
+        return
+
+    batch_eval(store_path, DANN, dann_params, FIT_PARAMS,
+               train_split=.7, multi_param=True, identifier=DANN.__name__, queue=queue)
+    batch_eval(store_path, Autoencoder, auto_params, FIT_PARAMS,
+               train_split=.7, multi_param=True, identifier=Autoencoder.__name__, queue=queue)
+
+
 if __name__ == "__main__":
     """Run the evaluation framework for every model and bias type, for every configuration. Using optimized parameters.
     Loads parameters from Optuna database, based on PREFIX and identifier in study name. Reuses t-only for s-only.
-    Runs on the validation data sets."""
-
-    for bias_name in bias_names:
-        store_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias_name}_val")
-
-        dann_params = {
-            's-only': dann_param_gen(None, lambda_=0.0),
-            's->t': dann_param_gen(load_best_trial(bias_name, DANN, 's->t')),
-            's->g': dann_param_gen(load_best_trial(bias_name, DANN, 's->g')),
-            't-only': dann_param_gen(None, lambda_=0.0)
-        }
-
-        auto_params = {
-            's-only': auto_param_gen(load_best_trial(bias_name, Autoencoder, 't-only'), mmd_weight=0.0),
-            's->t': auto_param_gen(load_best_trial(bias_name, Autoencoder, 's->t')),
-            's->g': auto_param_gen(load_best_trial(bias_name, Autoencoder, 's->g')),
-            't-only': auto_param_gen(load_best_trial(bias_name, Autoencoder, 't-only'), mmd_weight=0.0),
-        }
-
-        print(f"Evaluating with {bias_name}")
-        batch_eval(store_path, DANN, dann_params, FIT_PARAMS,
-                   train_split=.7, multi_param=True, identifier=DANN.__name__)
-        batch_eval(store_path, Autoencoder, auto_params, FIT_PARAMS,
-                   train_split=.7, multi_param=True, identifier=Autoencoder.__name__)
+    Runs on the validation data sets. With --queue, start this script on any number of machines that share the
+    results directory, and they divide the data sets between them. With --tolerance, data sets are generated and
+    evaluated in rounds, until the gains of s->g and s->t over s-only are precise enough."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue', action='store_true', help="claim data sets through the job queue of each batch")
+    parser.add_argument('--bias', nargs='*', default=bias_names, help="names of the bias types to validate")
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help="stop once every 95%% interval of the gains over s-only is narrower than this")
+    cli_args = parser.parse_args()
+
+    for bias_name in cli_args.bias:
+        validate_bias(bias_name, cli_args.queue, cli_args.tolerance)
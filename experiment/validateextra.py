@@ -1,12 +1,13 @@
 import os
-
-import optuna
-from adapt.feature_based import DANN
+from functools import partial
 
 from experiment.presets.bias import bias_names
-from experiment.presets.param import auto_param_gen, dann_param_gen
+from experiment.presets.param import auto_param_gen, dann_multi_param_gen
 from models.autoencoder import Autoencoder
 from util.batch import batch_eval
+from util.lazy import lazy_import
+
+optuna = lazy_import('optuna')
 
 PREFIX = "v6"
 
@@ -14,12 +15,44 @@ FIT_PARAMS = dict(epochs=30,
                   batch_size=16,
                   verbose=0)
 
+# bias type whose optimized parameters are reused
+REFERENCE = "concept_strong"
+
 
 def load_best_trial(bias, model, adapt_name):
     study_name = f"{PREFIX}-{bias}-{model.__name__}-{adapt_name}"
     return optuna.load_study(study_name=study_name, storage="sqlite:///../db.sqlite3").best_trial
 
 
+def validate_extra_bias(bias_name: str, reference: str = REFERENCE):
+    """Run the evaluation framework on the validation batch of a bias type,
+    using the optimized parameters of the reference bias type instead of its own."""
+    from adapt.feature_based import DANN
+
+    store_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias_name}_val")
+
+    # created per data set, in the worker process that trains the models
+    dann_params = partial(dann_multi_param_gen, {
+        's-only': None,
+        's->t': load_best_trial(reference, DANN, 's->t'),
+        's->g': load_best_trial(reference, DANN, 's->g'),
+        't-only': None
+    })
+
+    auto_params = {
+        's-only': auto_param_gen(load_best_trial(reference, Autoencoder, 't-only'), mmd_weight=0.0),
+        's->t': auto_param_gen(load_best_trial(reference, Autoencoder, 's->t')),
+        's->g': auto_param_gen(load_best_trial(reference, Autoencoder, 's->g')),
+        't-only': auto_param_gen(load_best_trial(reference, Autoencoder, 't-only'), mmd_weight=0.0),
+    }
+
+    print(f"Evaluating with {bias_name}")
+    batch_eval(store_path, DANN, dann_params, FIT_PARAMS,
+               train_split=.7, multi_param=True, identifier=DANN.__name__+'$')
+    batch_eval(store_path, Autoencoder, auto_params, FIT_PARAMS,
+               train_split=.7, multi_param=True, identifier=Autoencoder.__name__+'$')
+
+
 if __name__ == "__main__":
     """Run the evaluation framework for covariate shift, 
     fixing the parameters to those that worked for concept strong."""
@@ -27,24 +60,4 @@ if __name__ == "__main__":
     for bias_name in bias_names:
         if 'cov' not in bias_name:
             continue
-        store_path = os.path.join(os.getcwd(), '../results', PREFIX, f"{bias_name}_val")
-
-        dann_params = {
-            's-only': dann_param_gen(None, lambda_=0.0),
-            's->t': dann_param_gen(load_best_trial("concept_strong", DANN, 's->t')),
-            's->g': dann_param_gen(load_best_trial("concept_strong", DANN, 's->g')),
-            't-only': dann_param_gen(None, lambda_=0.0)
-        }
-
-        auto_params = {
-            's-only': auto_param_gen(load_best_trial("concept_strong", Autoencoder, 't-only'), mmd_weight=0.0),
-            's->t': auto_param_gen(load_best_trial("concept_strong", Autoencoder, 's->t')),
-            's->g': auto_param_gen(load_best_trial("concept_strong", Autoencoder, 's->g')),
-            't-only': auto_param_gen(load_best_trial("concept_strong", Autoencoder, 't-only'), mmd_weight=0.0),
-        }
-
-        print(f"Evaluating with {bias_name}")
-        batch_eval(store_path, DANN, dann_params, FIT_PARAMS,
-                   train_split=.7, multi_param=True, identifier=DANN.__name__+'$')
-        batch_eval(store_path, Autoencoder, auto_params, FIT_PARAMS,
-                   train_split=.7, multi_param=True, identifier=Autoencoder.__name__+'$')
+        validate_extra_bias(bias_name)
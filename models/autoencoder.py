@@ -10,31 +10,33 @@ for neural networks via moment alignment," arXiv preprint arXiv:1711.06114, 2017
 """
 
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import Model, Sequential
 from models.mmd import mmd
+from util.lazy import lazy_import
+from util.instrument import stage
 
+# imported on first use, so importing the model classes is fast
+tf = lazy_import('tensorflow')
 
-def default_encoder(dim) -> keras.layers.Dense:
-    return keras.layers.Dense(dim, activation='linear')
+
+def default_encoder(dim) -> 'tf.keras.layers.Dense':
+    return tf.keras.layers.Dense(dim, activation='linear')
 
 
 def default_classifier():
-    model = Sequential()
-    model.add(keras.layers.Dense(10, activation='relu'))
-    model.add(keras.layers.Dense(10, activation='relu'))
-    model.add(keras.layers.Dense(1, activation='sigmoid'))
+    model = tf.keras.Sequential()
+    model.add(tf.keras.layers.Dense(10, activation='relu'))
+    model.add(tf.keras.layers.Dense(10, activation='relu'))
+    model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
     return model
 
 
 def default_transfer():
-    return keras.layers.Dense(10, activation='relu')
+    return tf.keras.layers.Dense(10, activation='relu')
 
 
-def default_decoder(dim) -> keras.layers.Dense:
-    model = Sequential()
-    model.add(keras.layers.Dense(dim, activation='linear'))
+def default_decoder(dim) -> 'tf.keras.layers.Dense':
+    model = tf.keras.Sequential()
+    model.add(tf.keras.layers.Dense(dim, activation='linear'))
     return model
 
 
@@ -46,6 +48,9 @@ def transfer_stage_loss(y_true, y_pred):
 
 
 class Autoencoder:
+    # fitting again pretrains the encoder again, under the trained transfer network, instead of continuing training
+    resumable = False
+
     def __init__(self, input_dim: int, encoder_dim: int, encoder=None, decoder=None, transfer=None, classifier=None,
                  aux_classifier_weight: float = 1.0, mmd_weight: float = 1.0, target_decode_weight: float = 1.0):
         """Create an autoencoder-based UDA model. Used encoder, decoder and auxiliary classifier in pretraining.
@@ -57,16 +62,23 @@ class Autoencoder:
         self.aux_classifier_weight = aux_classifier_weight
         self.mmd_weight = mmd_weight
         self.history_ = None
+        # set with restored weights, whose encoder was already pretrained
+        self.pretrained_ = False
 
         self.encoder_model = None
         self.pretrain_model = None
         self.transfer_model = None
+
+        # networks of the inference path, encoder -> transfer -> classifier
+        self.encoder = None
+        self.transfer = None
+        self.classifier = None
         self._build_pretrain_models(encoder, decoder, classifier)
         self._build_transfer_model(transfer, classifier)
 
     def _build_pretrain_models(self, encoder, decoder, classifier):
-        input_s = keras.layers.Input(shape=(self.input_dim,), name='source_input')
-        input_t = keras.layers.Input(shape=(self.input_dim,), name='target_input')
+        input_s = tf.keras.layers.Input(shape=(self.input_dim,), name='source_input')
+        input_t = tf.keras.layers.Input(shape=(self.input_dim,), name='target_input')
 
         # encoder used for both stages
         if not encoder:
@@ -87,16 +99,17 @@ class Autoencoder:
             aux_classifier = classifier.copy_model()
         aux_classified_s = aux_classifier(decoded_s)
 
-        self.encoder_model = Model(inputs=[input_s, input_t], outputs=[encoded_s, encoded_t])
-        self.pretrain_model = Model(inputs=[input_s, input_t],
-                                    outputs=[decoded_s, decoded_t, aux_classified_s])
+        self.encoder = encoder
+        self.encoder_model = tf.keras.Model(inputs=[input_s, input_t], outputs=[encoded_s, encoded_t])
+        self.pretrain_model = tf.keras.Model(inputs=[input_s, input_t],
+                                             outputs=[decoded_s, decoded_t, aux_classified_s])
         self.pretrain_model.compile(loss=['mean_squared_error', 'mean_squared_error', 'binary_crossentropy'],
                                     loss_weights=[1.0, 1.0, self.aux_classifier_weight])
 
     def _build_transfer_model(self, transfer, classifier):
         # set input layers, which will be encoded data
-        input_s = keras.layers.Input(shape=(self.encoder_dim,), name='source_input')
-        input_t = keras.layers.Input(shape=(self.encoder_dim,), name='target_input')
+        input_s = tf.keras.layers.Input(shape=(self.encoder_dim,), name='source_input')
+        input_t = tf.keras.layers.Input(shape=(self.encoder_dim,), name='target_input')
 
         if not transfer:
             transfer = default_transfer()
@@ -107,23 +120,44 @@ class Autoencoder:
             classifier = default_classifier()
         classified_s = classifier(transferred_s)
 
+        self.transfer = transfer
+        self.classifier = classifier
         transferred_concat = tf.keras.backend.concatenate([transferred_s, transferred_t])
-        self.transfer_model = Model(inputs=[input_s, input_t],
-                                    outputs=[transferred_concat, classified_s])
+        self.transfer_model = tf.keras.Model(inputs=[input_s, input_t],
+                                             outputs=[transferred_concat, classified_s])
         self.transfer_model.compile(loss=[transfer_stage_loss, 'binary_crossentropy'],
                                     loss_weights=[self.mmd_weight, 1.0])
 
     def fit(self, xs, ys, xt, **fit_params):
+        """Pretrain the encoder, then train the transfer network and classifier on the encodings.
+        After `set_weights`, e.g. when warm starting from the 's-only' model, the restored encoder is kept and only
+        the transfer stage is trained. The encoder then stays fit to the source domain, adapting to the target is
+        left to the transfer network, which saves the pretraining of every warm started model."""
 
         # pretrain autoencoder with auxiliary classifier
-        self.pretrain_model.fit([xs, xt], [xs, xt, ys], **fit_params)
+        if not self.pretrained_:
+            with stage('pretrain'):
+                self.pretrain_model.fit([xs, xt], [xs, xt, ys], **fit_params)
 
         # use fixed encodings for final classification, while minimizing MDD halfway
-        enc_s, enc_t = self.encoder_model.predict([xs, xt], verbose=0)
-        hist = self.transfer_model.fit([enc_s, enc_t], [ys, ys], **fit_params)
+        with stage('encode'):
+            enc_s, enc_t = self.encoder_model.predict([xs, xt], verbose=0)
+        with stage('transfer'):
+            hist = self.transfer_model.fit([enc_s, enc_t], [ys, ys], **fit_params)
         self.history_ = hist.history
         return self
 
+    def get_weights(self) -> list[np.ndarray]:
+        """Weights of all submodels, shared layers like the encoder are included once."""
+        return self.pretrain_model.get_weights() + self.transfer_model.get_weights()
+
+    def set_weights(self, weights: list[np.ndarray]) -> None:
+        """Set weights of all submodels, in the order returned by `get_weights`. Later fits skip the pretraining."""
+        n_pretrain = len(self.pretrain_model.weights)
+        self.pretrain_model.set_weights(weights[:n_pretrain])
+        self.transfer_model.set_weights(weights[n_pretrain:])
+        self.pretrained_ = True
+
     def predict(self, x, verbose=0):
         # some redundancy because networks were compiled expecting two data sets
         enc, _, = self.encoder_model.predict([x, x], verbose=verbose)
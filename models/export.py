@@ -0,0 +1,54 @@
+"""Export the inference path of trained models to a compact file of weights, for scoring with `models.npscore`.
+Only dense feed-forward networks are supported, which covers the default networks of the Autoencoder and adapt."""
+
+import numpy as np
+
+# layers that do not change 2D input, and can be left out of the exported inference path
+_PASSTHROUGH_LAYERS = ('InputLayer', 'Flatten', 'Dropout')
+
+
+def _flatten_dense(network) -> list:
+    """Collect (kernel, bias, activation) for each dense layer of a layer or (nested) Sequential network."""
+    if hasattr(network, 'layers'):
+        res = []
+        for layer in network.layers:
+            res += _flatten_dense(layer)
+        return res
+
+    class_name = network.__class__.__name__
+    if class_name in _PASSTHROUGH_LAYERS:
+        return []
+    if class_name != 'Dense':
+        raise ValueError(f"Cannot export layer '{network.name}' of type '{class_name}', only Dense layers are supported")
+
+    weights = network.get_weights()
+    kernel = weights[0]
+    bias = weights[1] if network.use_bias else np.zeros(kernel.shape[1], dtype=kernel.dtype)
+    activation = network.get_config()['activation']
+    return [(kernel, bias, activation)]
+
+
+def inference_networks(model) -> list:
+    """Networks that make up the inference path of a trained model, in order of application.
+    Supports the Autoencoder (encoder -> transfer -> classifier) and adapt models with an encoder and task network."""
+    if hasattr(model, 'transfer') and hasattr(model, 'classifier'):
+        return [model.encoder, model.transfer, model.classifier]
+    if hasattr(model, 'encoder_') and hasattr(model, 'task_'):
+        return [model.encoder_, model.task_]
+    raise ValueError(f"Unsupported model type '{model.__class__.__name__}' for export")
+
+
+def export_inference(model, path: str) -> None:
+    """Write the weights and activations of the inference path of a trained model to a .npz file.
+    :param model: trained Autoencoder, or adapt model like DANN
+    :param path: file to write, '.npz' is appended by numpy if missing
+    """
+    layers = []
+    for network in inference_networks(model):
+        layers += _flatten_dense(network)
+
+    arrays = dict(activations=np.array([activation for _, _, activation in layers]))
+    for i, (kernel, bias, _) in enumerate(layers):
+        arrays[f'kernel_{i}'] = kernel.astype(np.float32)
+        arrays[f'bias_{i}'] = bias.astype(np.float32)
+    np.savez(path, **arrays)
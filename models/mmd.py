@@ -5,7 +5,9 @@ Maximum Mean Discrepancy (MMD)
 - Gretton, Arthur, et al. "A kernel method for the two-sample-problem."
 Advances in neural information processing systems. 2007.
 """
-import tensorflow as tf
+from util.lazy import lazy_import
+
+tf = lazy_import('tensorflow')
 
 
 def compute_kernel(x, y):
@@ -21,7 +23,7 @@ def compute_kernel(x, y):
         tf.reshape(y, tf.stack([1, y_size, dim])), tf.stack([x_size, 1, 1])
     )
     return tf.exp(
-        -tf.reduce_mean(tf.square(tiled_x - tiled_y), axis=2) / tf.cast(dim, tf.float32)
+        -tf.reduce_mean(tf.square(tiled_x - tiled_y), axis=2) / tf.cast(dim, x.dtype)
     )
 
 
@@ -0,0 +1,78 @@
+"""Pure NumPy forward passes for models exported with `models.export`, without importing tensorflow.
+Intended for analysis and batch scoring, where starting tensorflow costs more than the scoring itself."""
+
+import numpy as np
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # equivalent to 1 / (1 + exp(-x)), but does not overflow for large negative x
+    np.multiply(x, 0.5, out=x)
+    np.tanh(x, out=x)
+    np.add(x, 1, out=x)
+    np.multiply(x, 0.5, out=x)
+    return x
+
+
+def _relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0, out=x)
+
+
+def _tanh(x: np.ndarray) -> np.ndarray:
+    return np.tanh(x, out=x)
+
+
+def _linear(x: np.ndarray) -> np.ndarray:
+    return x
+
+
+# activations are applied in place, on the freshly allocated output of the matrix product
+ACTIVATIONS = {
+    'linear': _linear,
+    'relu': _relu,
+    'sigmoid': _sigmoid,
+    'tanh': _tanh,
+}
+
+
+class NumpyScorer:
+    """Feed-forward network of dense layers, evaluated with NumPy."""
+
+    def __init__(self, layers: list[tuple[np.ndarray, np.ndarray, str]]):
+        """
+        :param layers: list of (kernel, bias, activation) with kernel in shape (in, out) and bias in shape (out,)
+        """
+        for _, _, activation in layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation '{activation}', expected one of {list(ACTIVATIONS)}")
+        self.layers = layers
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a scorer from a file written by `models.export.export_inference`."""
+        loaded = np.load(path)
+        activations = loaded['activations']
+        layers = [(loaded[f'kernel_{i}'], loaded[f'bias_{i}'], str(activation))
+                  for i, activation in enumerate(activations)]
+        return cls(layers)
+
+    @property
+    def input_dim(self) -> int:
+        return self.layers[0][0].shape[0]
+
+    def predict(self, x: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """Compute the output of the network, in batches to bound the memory of intermediate activations.
+        :param x: features in shape (N, input_dim)
+        :param batch_size: number of rows per forward pass
+        :returns: predictions in shape (N, output_dim), as float32
+        """
+        x = np.asarray(x, dtype=np.float32)
+        out_dim = self.layers[-1][0].shape[1]
+        res = np.empty((x.shape[0], out_dim), dtype=np.float32)
+        for start in range(0, x.shape[0], batch_size):
+            h = x[start:start + batch_size]
+            for kernel, bias, activation in self.layers:
+                h = h @ kernel
+                h += bias
+                h = ACTIVATIONS[activation](h)
+            res[start:start + batch_size] = h
+        return res
@@ -0,0 +1,78 @@
+"""Framework independent helpers for transferring trained weights between models.
+Works with the Autoencoder and with adapt's deep models, without importing tensorflow."""
+
+from importlib import metadata
+
+import numpy as np
+
+# adapt versions whose lazy network initialization in BaseAdaptDeep.fit is mirrored by `restore_weights`
+ADAPT_VERSIONS = ('0.4.',)
+
+
+def restore_weights(model, weights: list[np.ndarray], input_shape: tuple) -> None:
+    """Set the weights of a newly created model, building its networks first if they are created lazily.
+    Adapt models only create their networks on the first call to fit, this initializes them the same way,
+    so a later fit continues training from the given weights instead of reinitializing.
+    :param model: model with `set_weights`, e.g. Autoencoder or adapt's BaseAdaptDeep
+    :param weights: list of weights as returned by `get_weights` of a model with the same architecture
+    :param input_shape: shape of a single sample, without batch dimension
+    """
+    if hasattr(model, '_initialize_networks') and not hasattr(model, '_is_fitted'):
+        # adapt has no public way to build the networks without training, so this uses its private methods
+        version = metadata.version('adapt')
+        if not version.startswith(ADAPT_VERSIONS):
+            raise RuntimeError(f"Restoring weights of adapt models is only supported for adapt versions "
+                               f"{ADAPT_VERSIONS}, found {version}")
+        model._is_fitted = True
+        model._initialize_networks()
+        model._initialize_weights(tuple(input_shape))
+    model.set_weights(weights)
+
+
+class LazyModel:
+    """Model placeholder that creates the model and restores stored weights on first use.
+    Retrieving the weights, or the stored training history, does not create the model,
+    so warm starting other models stays cheap."""
+
+    def __init__(self, model_builder, path: str):
+        """
+        :param model_builder: function that returns a new model with the same architecture as the stored one
+        :param path: path to the weights file, as written by `Store.save_model`
+        """
+        self._model_builder = model_builder
+        self._path = path
+        self._weights = None
+        self._input_shape = None
+        self._history = None
+        self._model = None
+
+    def _load(self):
+        if self._weights is None:
+            loaded = np.load(self._path)
+            n_weights = len([key for key in loaded.files if key.startswith('weight_')])
+            self._weights = [loaded[f'weight_{i}'] for i in range(n_weights)]
+            self._input_shape = tuple(loaded['input_shape'])
+            # accuracy per epoch, if the model had a history when it was saved
+            self._history = {'acc': loaded['history_acc'].tolist()} if 'history_acc' in loaded.files else dict()
+
+    def get_weights(self) -> list[np.ndarray]:
+        self._load()
+        return self._weights
+
+    @property
+    def history_(self) -> dict:
+        """Training history stored with the weights, as {'acc': [...]}, empty if none was stored."""
+        self._load()
+        return self._history
+
+    def __getattr__(self, item):
+        # only called for attributes not found on the placeholder itself, which are delegated to the model.
+        # Private attributes are never delegated, they are missing if the placeholder is not initialized,
+        # e.g. while unpickling, and looking them up here would recurse
+        if item.startswith('_'):
+            raise AttributeError(item)
+        if self._model is None:
+            self._load()
+            self._model = self._model_builder()
+            restore_weights(self._model, self._weights, self._input_shape)
+        return getattr(self._model, item)
@@ -0,0 +1,169 @@
+"""Content-addressed storage of arrays, shared by the stores of any number of batches.
+Every array is stored once, as objects/<hash[:2]>/<hash>.npy, named by the SHA-256 of its dtype, shape and contents.
+A store references its arrays by hash in a manifest, so identical data sets, like reruns with the same seeds or
+copies between versions of a batch, take the space of one, and saving an unchanged data set writes no arrays.
+
+Blobs are never changed once written. Blobs that no manifest references anymore are removed by `collect_garbage`:
+python -m storage.blobs gc <blob directory> <results directory> [...]"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+OBJECTS_DIR = 'objects'
+# file in a store that references its arrays, instead of the data file
+MANIFEST_FILE = 'data.json'
+# blobs written or reused more recently are never collected, a writer may not have written its manifest yet
+GRACE_SECONDS = 3600
+
+
+def array_hash(array: np.ndarray) -> str:
+    """SHA-256 of the dtype, shape and contents of an array, so equal values of another type or shape differ."""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256()
+    digest.update(f'{array.dtype.str}|{array.shape}'.encode())
+    digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, path: str):
+        """
+        Reference a directory of blobs, created on the first write.
+        :param path: directory of the blobs, e.g. results/.blobs to share the blobs of every batch
+        """
+        self.path = os.path.abspath(path)
+
+    def blob_path(self, key: str) -> str:
+        """Path of the blob with the given hash."""
+        return os.path.join(self.path, OBJECTS_DIR, key[:2], f'{key}.npy')
+
+    def put(self, array: np.ndarray) -> str:
+        """Store an array, if no blob with the same contents exists yet.
+        :returns: hash of the array, to reference it in a manifest
+        """
+        key = array_hash(array)
+        path = self.blob_path(key)
+        if os.path.exists(path):
+            # reused blobs count as new for the grace period of the garbage collection
+            os.utime(path)
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp, path)
+        return key
+
+    def get(self, key: str, mmap: bool = False) -> np.ndarray:
+        """Read the blob with the given hash.
+        :param mmap: memory-map the blob read-only, instead of reading it
+        """
+        path = self.blob_path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Blob '{key}' does not exist in '{self.path}', was it garbage collected?")
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+    def keys(self) -> list[str]:
+        """Hashes of every stored blob."""
+        objects = os.path.join(self.path, OBJECTS_DIR)
+        if not os.path.isdir(objects):
+            return []
+        return sorted(entry.name[:-len('.npy')] for prefix in os.scandir(objects) if prefix.is_dir()
+                      for entry in os.scandir(prefix.path) if entry.name.endswith('.npy'))
+
+
+def write_manifest(path: str, arrays: dict, blobs: BlobStore) -> bool:
+    """Store the arrays as blobs, and reference them by hash in a manifest.
+    The manifest is only rewritten if its contents change, so saving an unchanged data set writes nothing.
+    :param path: path of the manifest file
+    :param arrays: arrays by name, like 'xg'
+    :param blobs: blob store that holds the arrays
+    :returns: whether the manifest was written
+    """
+    manifest = dict(blobs=os.path.relpath(blobs.path, os.path.dirname(os.path.abspath(path))),
+                    arrays={name: blobs.put(array) for name, array in arrays.items()})
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if json.load(f) == manifest:
+                return False
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, path)
+    return True
+
+
+def read_manifest(path: str) -> tuple[BlobStore, dict]:
+    """Blob store and hash of every array referenced by a manifest written with `write_manifest`."""
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    blobs = BlobStore(os.path.join(os.path.dirname(os.path.abspath(path)), manifest['blobs']))
+    return blobs, manifest['arrays']
+
+
+def referenced(blobs: BlobStore, roots: list[str], manifest_name: str = MANIFEST_FILE) -> set[str]:
+    """Hashes of the blobs referenced by any manifest below the root directories."""
+    keys = set()
+    for root in roots:
+        for directory, subdirectories, files in os.walk(root):
+            # hidden directories hold caches, queues and blobs, never stores
+            subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+            if manifest_name not in files:
+                continue
+            manifest_blobs, arrays = read_manifest(os.path.join(directory, manifest_name))
+            if manifest_blobs.path == blobs.path:
+                keys.update(arrays.values())
+    return keys
+
+
+def collect_garbage(blob_path: str, roots: list[str], grace_seconds: float = GRACE_SECONDS,
+                    dry_run: bool = False) -> list[str]:
+    """Remove the blobs that no store references anymore.
+    :param blob_path: directory of the blobs
+    :param roots: directories searched for stores that reference the blobs, every store that uses them must be below
+    one of these, or its arrays are removed
+    :param grace_seconds: keep blobs written or reused within this time, of stores that are still being saved
+    :param dry_run: only return the blobs that would be removed
+    :returns: hashes of the removed blobs
+    """
+    blobs = BlobStore(blob_path)
+    keep = referenced(blobs, roots)
+    now = time.time()
+    removed = []
+    for key in blobs.keys():
+        path = blobs.blob_path(key)
+        if key in keep or now - os.path.getmtime(path) < grace_seconds:
+            continue
+        if not dry_run:
+            os.remove(path)
+        removed.append(key)
+    return removed
+
+
+if __name__ == "__main__":
+    """Remove unreferenced blobs: python -m storage.blobs gc <blob directory> <results directory> [...]
+    Every directory with stores that use the blobs must be given, use --dry-run to only list the blobs."""
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    gc_parser = subparsers.add_parser('gc', help="remove blobs that no store references")
+    gc_parser.add_argument('blob_path', help="directory of the blobs")
+    gc_parser.add_argument('roots', nargs='+', help="directories with the stores that use the blobs")
+    gc_parser.add_argument('--grace', type=float, default=GRACE_SECONDS,
+                           help="keep blobs written within this many seconds")
+    gc_parser.add_argument('--dry-run', action='store_true', help="only list the blobs that would be removed")
+    cli_args = parser.parse_args()
+
+    blob_store = BlobStore(cli_args.blob_path)
+    sizes = {key: os.path.getsize(blob_store.blob_path(key)) for key in blob_store.keys()}
+    removed_keys = collect_garbage(cli_args.blob_path, cli_args.roots, cli_args.grace, cli_args.dry_run)
+    freed = sum(sizes[key] for key in removed_keys) / 2 ** 20
+    action = "Would remove" if cli_args.dry_run else "Removed"
+    print(f"{action} {len(removed_keys)} of {len(sizes)} blobs, {freed:.1f} MB")
@@ -0,0 +1,170 @@
+"""Chunked, compressed storage of the arrays of a data set in a single file, with random access.
+Every array is divided into chunks of rows, per column, and each chunk is compressed separately with zlib or lzma
+from the standard library. An index of the chunks at the end of the file lets readers decompress only the chunks
+of a range of rows, or of some features, instead of the whole file.
+
+Floating point chunks can be byte-shuffled before compression: the first bytes of every value are stored together,
+then the second bytes, etc. Neighbouring values share their sign, exponent and leading mantissa bytes, so the shuffled
+bytes compress much better than the raw values.
+
+Layout: MAGIC, the compressed chunks, the JSON index, the length of the index as 8 byte little-endian integer, MAGIC."""
+
+import json
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'GDACHNK1'
+# compression of every chunk, by codec name, as (compress, decompress)
+COMPRESSORS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    'none': (lambda data, level: data, lambda data: data),
+}
+# higher zlib levels shrink float features by about 1% more, but write 2 to 3 times slower
+DEFAULT_LEVELS = {'zlib': 1, 'lzma': 6, 'none': None}
+# uncompressed size of a chunk, large enough to compress well, small enough to read little more than needed
+CHUNK_BYTES = 2 ** 16
+
+
+def shuffle_bytes(data: np.ndarray) -> bytes:
+    """Bytes of the values, grouped by their position within a value."""
+    return np.ascontiguousarray(data).view(np.uint8).reshape(-1, data.dtype.itemsize).T.tobytes()
+
+
+def unshuffle_bytes(data: bytes, dtype: np.dtype) -> np.ndarray:
+    """Inverse of `shuffle_bytes`."""
+    dtype = np.dtype(dtype)
+    grouped = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(grouped.T).view(dtype).ravel()
+
+
+def _columns(array: np.ndarray) -> np.ndarray:
+    """Array as (rows, columns), a vector as a single column, higher dimensions flattened into the columns."""
+    return array.reshape(len(array), int(np.prod(array.shape[1:])))
+
+
+def write_chunked(path: str, arrays: dict, codec: str = 'zlib', shuffle: bool = True, level: int = None,
+                  chunk_bytes: int = CHUNK_BYTES) -> None:
+    """Write arrays to a chunked file, replacing it at once so readers never see a partial file.
+    :param path: path of the file
+    :param arrays: arrays by name, like 'xg', with the rows along the first axis
+    :param codec: 'zlib', 'lzma', or 'none' to not compress
+    :param shuffle: byte-shuffle chunks of floating point arrays before compressing them
+    :param level: compression level of zlib (0-9) or preset of lzma (0-9), default DEFAULT_LEVELS
+    :param chunk_bytes: uncompressed size of a chunk
+    """
+    if codec not in COMPRESSORS:
+        raise ValueError(f"Unknown codec '{codec}', use one of {list(COMPRESSORS)}")
+    compress = COMPRESSORS[codec][0]
+    level = DEFAULT_LEVELS[codec] if level is None else level
+
+    index = dict(codec=codec, arrays=dict())
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            # columns contiguous, so every chunk is a slice without gathering
+            columns = np.ascontiguousarray(_columns(array).T)
+            shuffled = shuffle and array.dtype.kind == 'f' and array.dtype.itemsize > 1
+            rows = max(1, chunk_bytes // max(array.dtype.itemsize, 1))
+            chunks = []
+            # row blocks in order, the columns of every block next to each other
+            for start in range(0, max(len(array), 1), rows):
+                for column in columns:
+                    block = column[start:start + rows]
+                    data = compress(shuffle_bytes(block) if shuffled else block.tobytes(), level)
+                    chunks.append([f.tell(), len(data)])
+                    f.write(data)
+            index['arrays'][name] = dict(dtype=array.dtype.str, shape=list(array.shape), rows_per_chunk=rows,
+                                         shuffle=shuffled, chunks=chunks)
+
+        data = json.dumps(index).encode()
+        f.write(data)
+        f.write(struct.pack('<Q', len(data)))
+        f.write(MAGIC)
+    os.replace(tmp, path)
+
+
+class ChunkedFile:
+    def __init__(self, path: str):
+        """
+        Open a file written with `write_chunked`, reading only its index. Use as context manager, or call close.
+        :param path: path of the file
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._file.seek(-len(MAGIC) - 8, os.SEEK_END)
+            length, magic = struct.unpack('<Q', self._file.read(8)), self._file.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' is not a chunked data file, or it is truncated")
+            self._file.seek(-len(MAGIC) - 8 - length[0], os.SEEK_END)
+            self.index = json.loads(self._file.read(length[0]))
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self._decompress = COMPRESSORS[self.index['codec']][1]
+
+    def keys(self) -> list[str]:
+        """Names of the arrays in the file."""
+        return list(self.index['arrays'])
+
+    def shape(self, name: str) -> tuple:
+        """Shape of an array, without reading it."""
+        return tuple(self.index['arrays'][name]['shape'])
+
+    def read(self, name: str, rows: slice = None, columns=None) -> np.ndarray:
+        """Read an array, or part of it. Only the chunks that hold the selected rows and columns are decompressed.
+        :param name: name of the array
+        :param rows: range of rows, with a step of 1, default every row
+        :param columns: index, list of indices or slice of the columns (features) of a two-dimensional array,
+        default every column
+        :returns: the selected part of the array, a new array
+        """
+        entry = self.index['arrays'][name]
+        dtype, shape = np.dtype(entry['dtype']), tuple(entry['shape'])
+        n_rows = shape[0]
+        n_columns = int(np.prod(shape[1:])) if len(shape) > 1 else 1
+        start, stop, step = (rows or slice(None)).indices(n_rows)
+        if step != 1:
+            raise ValueError("Only ranges of rows with a step of 1 can be read")
+        selected = np.arange(n_columns)
+        if columns is not None:
+            if len(shape) != 2:
+                raise ValueError(f"Columns can only be selected from two-dimensional arrays, "
+                                 f"'{name}' has shape {shape}")
+            selected = np.atleast_1d(selected[columns])
+
+        per_chunk = entry['rows_per_chunk']
+        stop = max(start, stop)
+        out = np.empty((len(selected), stop - start), dtype=dtype)
+        for block in range(start // per_chunk, (stop - 1) // per_chunk + 1 if stop > start else 0):
+            block_start = block * per_chunk
+            # rows of this block that were selected, relative to the block and to the output
+            low, high = max(start, block_start) - block_start, min(stop, block_start + per_chunk) - block_start
+            for i, column in enumerate(selected):
+                offset, size = entry['chunks'][block * n_columns + column]
+                self._file.seek(offset)
+                data = self._decompress(self._file.read(size))
+                values = unshuffle_bytes(data, dtype) if entry['shuffle'] else np.frombuffer(data, dtype=dtype)
+                out[i, block_start + low - start:block_start + high - start] = values[low:high]
+
+        out = np.ascontiguousarray(out.T)
+        if columns is None:
+            return out.reshape((stop - start,) + shape[1:])
+        # a single column index selects a vector, like indexing a NumPy array does
+        return out[:, 0] if not isinstance(columns, slice) and np.ndim(columns) == 0 else out
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
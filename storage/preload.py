@@ -0,0 +1,113 @@
+"""Read all datasets of a batch directory once, to share them between repeated evaluations without further I/O."""
+
+import json
+import os
+
+import numpy as np
+
+from storage.storage import Store
+
+# hidden directory inside the batch directory, skipped when scanning for stores
+CACHE_DIR = '.preload'
+KEYS = ('xg', 'yg', 'xs', 'ys', 'xt', 'yt')
+
+
+def store_names(store_path: str) -> list[str]:
+    """Sorted names of all stores in a batch directory, skipping hidden directories like caches."""
+    return sorted(entry.name for entry in os.scandir(store_path)
+                  if entry.is_dir() and not entry.name.startswith('.'))
+
+
+def _fingerprint(store_path: str, names: list[str]) -> list:
+    """Fingerprint of the data set of every store, to detect if a cache is outdated, see `Store.data_fingerprint`."""
+    return [Store(name, store_path).data_fingerprint() for name in names]
+
+
+class PreloadedBatch:
+    """All datasets of a batch, concatenated per array into one read-only contiguous array.
+    Can be passed to the batch evaluation functions in place of the path of the batch."""
+
+    def __init__(self, store_path: str, names: list[str], arrays: dict, offsets: dict):
+        """Use `PreloadedBatch.load` instead.
+        :param store_path: path to the batch directory
+        :param names: names of the stores, in order of concatenation
+        :param arrays: for each key in KEYS, the concatenated arrays of all stores
+        :param offsets: for each key in KEYS, array of len(names) + 1 row offsets into the concatenated array
+        """
+        self.store_path = store_path
+        self.names = names
+        self.arrays = arrays
+        self.offsets = offsets
+        self._index = {name: i for i, name in enumerate(names)}
+        for array in arrays.values():
+            if array.flags.writeable:
+                array.flags.writeable = False
+
+    @classmethod
+    def load(cls, store_path: str, mmap: bool = False):
+        """Read every store in the batch directory.
+        :param store_path: path to the batch directory
+        :param mmap: write the concatenated arrays to a cache in the batch directory once, and memory-map them.
+        Processes that map the same cache share the memory, through the page cache of the operating system.
+        The cache is rebuilt when a data file was changed since.
+        :returns: the preloaded batch
+        """
+        if not os.path.exists(store_path):
+            raise FileNotFoundError(
+                f"Directory with stores for batch evaluation was not found in {os.path.abspath(store_path)}")
+
+        names = store_names(store_path)
+        if not mmap:
+            return cls._read(store_path, names)
+
+        cache_path = os.path.join(store_path, CACHE_DIR)
+        index_path = os.path.join(cache_path, 'index.json')
+        fingerprint = _fingerprint(store_path, names)
+        index = None
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+        if index is None or index['fingerprint'] != fingerprint:
+            cls._read(store_path, names)._write_cache(cache_path, fingerprint)
+
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        arrays = {key: np.load(os.path.join(cache_path, f'{key}.npy'), mmap_mode='r') for key in KEYS}
+        offsets = {key: np.array(index['offsets'][key]) for key in KEYS}
+        return cls(store_path, index['names'], arrays, offsets)
+
+    @classmethod
+    def _read(cls, store_path: str, names: list[str]):
+        datasets = [Store(name, store_path).load_data() for name in names]
+        arrays, offsets = dict(), dict()
+        for i, key in enumerate(KEYS):
+            parts = [data[i] for data in datasets]
+            arrays[key] = np.concatenate(parts) if parts else np.empty(0)
+            offsets[key] = np.concatenate([[0], np.cumsum([len(part) for part in parts])]).astype(np.int64)
+        return cls(store_path, names, arrays, offsets)
+
+    def _write_cache(self, cache_path: str, fingerprint: list) -> None:
+        """Write arrays and index to temporary files first, so concurrent readers never see a partial cache."""
+        os.makedirs(cache_path, exist_ok=True)
+        postfix = f'.{os.getpid()}.tmp'
+        for key in KEYS:
+            tmp = os.path.join(cache_path, f'{key}.npy{postfix}')
+            with open(tmp, 'wb') as f:
+                np.save(f, self.arrays[key])
+            os.replace(tmp, os.path.join(cache_path, f'{key}.npy'))
+
+        index = dict(names=self.names, fingerprint=fingerprint,
+                     offsets={key: self.offsets[key].tolist() for key in KEYS})
+        tmp = os.path.join(cache_path, f'index.json{postfix}')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(cache_path, 'index.json'))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def load_data(self, name: str) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Dataset of a store as the tuple (xg, yg, xs, ys, xt, yt), like `Store.load_data`.
+        Returns read-only views, without copying."""
+        i = self._index[name]
+        return tuple(self.arrays[key][self.offsets[key][i]:self.offsets[key][i + 1]] for key in KEYS)
@@ -7,11 +7,24 @@ import numpy as np
 import json
 from types import FunctionType
 
+from models.weights import LazyModel
+from storage.blobs import BlobStore, MANIFEST_FILE, write_manifest, read_manifest
+from storage.codec import ChunkedFile, write_chunked
+from util.dtype import DEFAULT_STORAGE_DTYPE, as_compute, as_storage
+from util.instrument import timed
+
 # names of files inside the store folder
 DATA_FILE = 'data'
 CFG_FILE = 'config'
 STATS_FILE = 'stats'
 EVAL_FILE = 'eval'
+MODEL_DIR = 'models'
+
+# format of the data file: 'npz', or a chunked compressed file, see storage/codec.py, with the compressor like 'zlib'
+# and optionally '-shuffle' to byte-shuffle the features, like 'zlib-shuffle'
+DEFAULT_CODEC = 'npz'
+CODECS = ('npz', 'none') + tuple(f'{name}{shuffle}' for name in ('zlib', 'lzma') for shuffle in ('', '-shuffle'))
+CHUNKED_EXT = 'chunks'
 
 
 def serialize_soft(obj):
@@ -23,36 +36,61 @@ def serialize_soft(obj):
         return f"<unserializable object of type '{obj.__class__.__name__}'>"
 
 
+def _model_file_name(config: str, identifier: str = None) -> str:
+    """File name for the weights of a configuration like 's->t', without characters that are invalid in paths."""
+    config = config.replace('->', '-to-')
+    return f'{identifier}_{config}.npz' if identifier else f'{config}.npz'
+
+
 class Store:
     """Reference to a directory on disk, for storing a dataset for later retrieval, along with metadata."""
 
-    def __init__(self, name: str, store_path: str = None):
+    def __init__(self, name: str, store_path: str = None, storage_dtype: str = DEFAULT_STORAGE_DTYPE,
+                 blob_path: str = None, codec: str = DEFAULT_CODEC):
         """
         Create an object referencing the storage folder on disk of a dataset, including metadata and other files.
         Does not create directory on disk. Use `Store.new` instead.
 
         :param name: Name of this dataset folder.
         :param store_path: Path to folder containing all stores. If None, uses '<root>/results'.
+        :param storage_dtype: floating point type of features on disk, 'float16' halves the size of 'float32'.
+        Features are always loaded in the compute dtype (float32), regardless of the type on disk.
+        :param blob_path: directory of a blob store, see storage/blobs.py. If given, the arrays of the data set are
+        saved there once per unique content and referenced by hash, instead of written into this store.
+        Loading uses whatever the store contains, regardless of this parameter.
+        :param codec: format of the data file, one of CODECS. Chunked codecs like 'zlib-shuffle' compress the data set,
+        and allow reading parts of it with `load_array`. Loading uses whatever the store contains, like blob_path.
         """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', use one of {CODECS}")
+        if blob_path is not None and codec != 'npz':
+            raise ValueError("A blob store keeps arrays as .npy files, use codec='npz' with a blob_path")
 
         if store_path is None:
             store_path = os.path.join(os.getcwd(), 'results')
 
         self.name = name
         self.path_full = os.path.join(store_path, name)
+        self.storage_dtype = storage_dtype
+        self.blob_path = blob_path
+        self.codec = codec
 
         if not os.path.exists(self.path_full) or not os.path.isdir(self.path_full):
             raise FileNotFoundError(
                 f"Store object references non-existent path. Expected directory in '{self.path_full}'")
 
     @classmethod
-    def new(cls, name: str = None, store_path: str = None, overwrite: bool = False):
+    def new(cls, name: str = None, store_path: str = None, overwrite: bool = False,
+            storage_dtype: str = DEFAULT_STORAGE_DTYPE, blob_path: str = None, codec: str = DEFAULT_CODEC):
         """
         Create a storage folder on disk for a dataset, including metadata and other files.
 
         :param name: Name of this dataset folder. If None, uses timestamp, adding a postfix for duplicate timestamps
         :param store_path: Path to folder containing all stores. If None, uses '<cwd>/results'.
         :param overwrite: if False, raises exception if directory already exists, if True, deletes existing
+        :param storage_dtype: floating point type of features on disk, see `Store.__init__`
+        :param blob_path: directory of a blob store to save the arrays in, see `Store.__init__`
+        :param codec: format of the data file, see `Store.__init__`
         :returns: Store object, after creating directory.
         """
 
@@ -79,12 +117,29 @@ class Store:
                     + "Use overwrite=True if intended.")
         os.makedirs(path_full)
 
-        return Store(name, store_path)
+        return Store(name, store_path, storage_dtype, blob_path, codec)
 
+    @timed()
     def save_data(self, xg, yg, xs, ys, xt, yt) -> None:
-        """Store three sets of features and labels in this store"""
-        np.savez(os.path.join(self.path_full, f'{DATA_FILE}.npz'),
-                 xg=xg, yg=yg, xs=xs, ys=ys, xt=xt, yt=yt)
+        """Store three sets of features and labels in this store. Features are converted to the storage dtype.
+        With a blob store, arrays that are already stored are not written again, see storage/blobs.py."""
+        xg, xs, xt = (as_storage(x, self.storage_dtype) for x in (xg, xs, xt))
+        arrays = dict(xg=xg, yg=yg, xs=xs, ys=ys, xt=xt, yt=yt)
+        if self.blob_path is not None:
+            path = os.path.join(self.path_full, MANIFEST_FILE)
+            write_manifest(path, arrays, BlobStore(self.blob_path))
+        elif self.codec == 'npz':
+            path = os.path.join(self.path_full, f'{DATA_FILE}.npz')
+            np.savez(path, **arrays)
+        else:
+            path = os.path.join(self.path_full, f'{DATA_FILE}.{CHUNKED_EXT}')
+            compressor, _, shuffle = self.codec.partition('-')
+            write_chunked(path, arrays, compressor, shuffle=bool(shuffle))
+
+        # data files of another format are outdated now
+        for other in self._data_paths():
+            if other != path and os.path.exists(other):
+                os.remove(other)
 
     def save_config(self, builder) -> None:
         """Save a JSON file describing the dataset builder configuration."""
@@ -100,7 +155,8 @@ class Store:
         with open(path, 'w') as f:
             f.write(json_data)
 
-    def save_eval(self, metrics: dict, model_type: str, model_params: dict, fit_params: dict, identifier: str = None):
+    def save_eval(self, metrics: dict, model_type: str, model_params: dict, fit_params: dict, identifier: str = None,
+                  timing: dict = None):
         """Store metrics from evaluating a DA model on the dataset. Stores model configuration for future reference.
         :param metrics: results of the evaluation
         :param model_type: name of model, e.g. 'DANN' or 'MDD'
@@ -108,22 +164,106 @@ class Store:
         :param fit_params: parameters of fitting, like epochs, batch size etc.
         :param identifier: appended to filename, change the identifier to prevent
          overwriting if intending to save multiple configuration's results. leave None to ignore.
+        :param timing: recorded stages of the evaluation, see util/instrument.py. Not stored if None.
         """
         data = dict(model_type=model_type,
                     metrics=metrics,
                     model_params=model_params,
                     fit_params=fit_params)
+        if timing is not None:
+            data['timing'] = timing
         json_data = json.dumps(data, sort_keys=True, indent=4, default=serialize_soft)
         filename = f'{EVAL_FILE}_{identifier}.json' if identifier else f'{EVAL_FILE}.json'
         path = os.path.join(self.path_full, filename)
         with open(path, 'w') as f:
             f.write(json_data)
 
+    def save_model(self, model, config: str, input_shape: tuple, identifier: str = None) -> None:
+        """Store the trained weights of a model, to restore it later without retraining.
+        :param model: trained model with `get_weights`, e.g. Autoencoder or an adapt model like DANN
+        :param config: training configuration of the model, like 's-only' or 's->t'
+        :param input_shape: shape of a single input sample, required to rebuild adapt models before restoring
+        :param identifier: identifier of the evaluation, as used in `save_eval`
+        """
+        path = os.path.join(self.path_full, MODEL_DIR)
+        os.makedirs(path, exist_ok=True)
+        weights = {f'weight_{i}': w for i, w in enumerate(model.get_weights())}
+        # the accuracy per epoch, to compute the convergence metric of a restored model
+        history = getattr(model, 'history_', None) or dict()
+        if 'acc' in history:
+            weights['history_acc'] = np.asarray(history['acc'])
+        np.savez(os.path.join(path, _model_file_name(config, identifier)),
+                 input_shape=np.array(input_shape), **weights)
+
+    def has_model(self, config: str, identifier: str = None) -> bool:
+        """Check if weights were stored for a configuration and evaluation identifier."""
+        return os.path.exists(os.path.join(self.path_full, MODEL_DIR, _model_file_name(config, identifier)))
+
+    def load_model(self, config: str, model_builder, identifier: str = None) -> LazyModel:
+        """Load a model stored with `save_model`. The weights are only read, and the model only created,
+        on first use. Raises FileNotFoundError if no weights were stored for the given configuration.
+        :param config: training configuration of the model, like 's-only' or 's->t'
+        :param model_builder: function that returns a new model, with the same architecture as the stored one
+        :param identifier: identifier of the evaluation, as used in `save_eval`
+        :returns: placeholder that behaves like the restored model
+        """
+        path = os.path.join(self.path_full, MODEL_DIR, _model_file_name(config, identifier))
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No stored weights for configuration '{config}' in '{path}'")
+        return LazyModel(model_builder, path)
+
+    @timed()
     def load_data(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """Load a dataset from this store, as the tuple (xg, yg, xs, ys, xt, yt),
-        where g=global, s=source, t=target, x=features, y=label."""
-        path = os.path.join(self.path_full, f'{DATA_FILE}.npz')
-        loaded = np.load(path)
-        return (loaded['xg'], loaded['yg'],
-                loaded['xs'], loaded['ys'],
-                loaded['xt'], loaded['yt'])
+        where g=global, s=source, t=target, x=features, y=label. Features are returned in the compute dtype."""
+        manifest_path, chunked_path, npz_path = self._data_paths()
+        if os.path.exists(manifest_path):
+            blobs, keys = read_manifest(manifest_path)
+            loaded = {name: blobs.get(key) for name, key in keys.items()}
+        elif os.path.exists(chunked_path):
+            with ChunkedFile(chunked_path) as f:
+                loaded = {name: f.read(name) for name in f.keys()}
+        else:
+            loaded = np.load(npz_path)
+        return (as_compute(loaded['xg']), loaded['yg'],
+                as_compute(loaded['xs']), loaded['ys'],
+                as_compute(loaded['xt']), loaded['yt'])
+
+    def data_fingerprint(self) -> list:
+        """Changes whenever the data set of this store changes, e.g. to detect outdated caches.
+        The hashes of the arrays for stores with a blob store, otherwise the size and modification time of the file."""
+        manifest_path, chunked_path, npz_path = self._data_paths()
+        if os.path.exists(manifest_path):
+            return [self.name, read_manifest(manifest_path)[1]]
+        stat = os.stat(chunked_path if os.path.exists(chunked_path) else npz_path)
+        return [self.name, stat.st_size, stat.st_mtime_ns]
+
+    def load_array(self, key: str, rows: slice = None, columns=None) -> np.ndarray:
+        """Load one array of the data set, or a range of its rows and some of its features.
+        Chunked stores only decompress the chunks that hold them, other formats read the whole array.
+        :param key: name of the array, like 'xs' or 'ys'
+        :param rows: range of rows, with a step of 1, default every row
+        :param columns: index, list or slice of the features, default every feature
+        :returns: the selected values, features in the compute dtype
+        """
+        manifest_path, chunked_path, npz_path = self._data_paths()
+        if os.path.exists(chunked_path):
+            with ChunkedFile(chunked_path) as f:
+                array = f.read(key, rows, columns)
+        else:
+            if os.path.exists(manifest_path):
+                blobs, keys = read_manifest(manifest_path)
+                array = blobs.get(keys[key], mmap=True)
+            else:
+                array = np.load(npz_path)[key]
+            array = array[rows if rows is not None else slice(None)]
+            if columns is not None:
+                array = array[:, columns]
+            array = np.array(array)
+        return as_compute(array) if key.startswith('x') else array
+
+    def _data_paths(self) -> tuple[str, str, str]:
+        """Paths of the blob manifest, the chunked file and the npz file, a store holds one of them."""
+        return (os.path.join(self.path_full, MANIFEST_FILE),
+                os.path.join(self.path_full, f'{DATA_FILE}.{CHUNKED_EXT}'),
+                os.path.join(self.path_full, f'{DATA_FILE}.npz'))
@@ -0,0 +1,44 @@
+"""Highest correlations of tables with too few columns to form a pair: empty results instead of errors."""
+
+import numpy as np
+import pandas as pd
+
+from util.corr import get_corr_mat, highest_corr, print_highest_corr
+
+
+def test_single_column(capsys):
+    df = pd.DataFrame(dict(acc=np.linspace(0., 1., 10), name=[f'run{i}' for i in range(10)]))
+    assert highest_corr(df).empty
+    assert highest_corr(df, method='spearman', absolute=True).empty
+
+    matrix = get_corr_mat(df)
+    assert matrix.shape == (1, 1)
+    print_highest_corr(matrix)
+    assert capsys.readouterr().out == ''
+
+
+def test_no_numeric_columns(capsys):
+    df = pd.DataFrame(dict(name=[f'run{i}' for i in range(10)], model=['DANN'] * 10))
+    assert highest_corr(df).empty
+    assert list(highest_corr(df).columns) == ['var1', 'var2', 'corr']
+
+    matrix = get_corr_mat(df)
+    assert matrix.empty
+    print_highest_corr(matrix)
+    assert capsys.readouterr().out == ''
+
+
+def test_pairs_are_found():
+    x = np.linspace(0., 1., 10)
+    df = pd.DataFrame(dict(a=x, b=2 * x, c=-x, name=[f'run{i}' for i in range(10)]))
+    pairs = highest_corr(df, num=1)
+    assert list(pairs[['var1', 'var2']].iloc[0]) == ['a', 'b']
+    assert np.isclose(pairs['corr'].iloc[0], 1.)
+
+
+def test_no_pairs_requested(capsys):
+    x = np.linspace(0., 1., 10)
+    df = pd.DataFrame(dict(a=x, b=x ** 2))
+    assert highest_corr(df, num=0).empty
+    print_highest_corr(get_corr_mat(df), num=0)
+    assert capsys.readouterr().out == ''
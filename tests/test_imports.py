@@ -0,0 +1,41 @@
+"""Modules used by helper scripts and workers import fast, without loading the heavy dependencies, see
+benchmark/imports.py. Every import runs in a fresh interpreter, so earlier imports do not hide the cost."""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmark.imports import BUDGET_SECONDS
+
+# never executed by these imports, lazy modules that were not accessed are not executed either
+HEAVY = ('tensorflow', 'matplotlib', 'sklearn')
+
+_PROBE = """
+import json, sys
+{statement}
+loaded = [name for name in {heavy!r}
+          if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule']
+print(json.dumps(loaded))
+"""
+
+
+def _import(statement: str) -> tuple[float, list[str]]:
+    """Seconds spent importing, from -X importtime, and the heavy modules that were executed."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(statement=statement, heavy=HEAVY)],
+                         capture_output=True, text=True, check=True)
+    # lines like 'import time: self [us] | cumulative | name', nested imports have an indented name
+    micros = 0
+    for line in out.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and len(fields) == 3 and not fields[2].startswith('  '):
+            micros += int(fields[1]) if fields[1].strip().isdigit() else 0
+    return micros / 1e6, json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('statement', ['import storage.storage', 'from util.batch import batch_load_eval'])
+def test_import_is_light(statement):
+    seconds, loaded = _import(statement)
+    assert loaded == []
+    assert 0 < seconds < BUDGET_SECONDS
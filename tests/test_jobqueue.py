@@ -0,0 +1,124 @@
+"""Several local processes draining one job queue: every job runs exactly once, also when a lease expires."""
+
+import json
+import multiprocessing
+import os
+import time
+
+from util.jobqueue import JobQueue
+
+N_WORKERS = 4
+N_JOBS = 40
+
+
+def _run(batch_path: str, job: str) -> str:
+    # appends of a single short line are atomic, so concurrent workers never interleave
+    with open(os.path.join(batch_path, 'runs.txt'), 'a') as f:
+        f.write(job + '\n')
+    time.sleep(0.01)
+    return job
+
+
+def _drain(batch_path: str, jobs: list[str], start) -> None:
+    start.wait()
+    queue = JobQueue(batch_path, 'test', lease_seconds=5, heartbeat_seconds=0.5)
+    queue.drain(jobs, lambda job: _run(batch_path, job), poll_seconds=0.05)
+
+
+def _reclaim(batch_path: str, job: str, claimed, start) -> None:
+    queue = JobQueue(batch_path, 'test', lease_seconds=5, heartbeat_seconds=60)
+    start.wait()
+    if queue.claim([job]) == job:
+        claimed.put(queue.worker_id)
+    time.sleep(0.5)
+    queue._stop.set()
+
+
+def _start(target, *args) -> None:
+    """Run the target in N_WORKERS processes, started at once by the event passed as last argument."""
+    start = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=target, args=args + (start,)) for _ in range(N_WORKERS)]
+    for process in processes:
+        process.start()
+    start.set()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+
+def _expire(queue: JobQueue, job: str) -> None:
+    old = time.time() - 2 * queue.lease_seconds
+    os.utime(queue._lock_file(job), (old, old))
+
+
+def test_every_job_runs_once(tmp_path):
+    jobs = [f'job{i}' for i in range(N_JOBS)]
+    _start(_drain, str(tmp_path), jobs)
+
+    with open(tmp_path / 'runs.txt') as f:
+        runs = f.read().split()
+    assert sorted(runs) == sorted(jobs)
+    queue = JobQueue(str(tmp_path), 'test')
+    assert all(queue.is_done(job) for job in jobs)
+    assert queue.status(jobs) == dict(done=N_JOBS, leased=0, open=0)
+    assert os.listdir(queue.lock_path) == []
+    with open(queue.manifest_path) as f:
+        assert sorted(json.loads(line)['job'] for line in f) == sorted(jobs)
+
+
+def test_expired_lease_is_taken_over_once(tmp_path):
+    stalled = JobQueue(str(tmp_path), 'test', lease_seconds=5, heartbeat_seconds=60)
+    assert stalled.claim(['job']) == 'job'
+    token = stalled._held['job']
+    _expire(stalled, 'job')
+
+    claimed = multiprocessing.Queue()
+    _start(_reclaim, str(tmp_path), 'job', claimed)
+    winners = []
+    while not claimed.empty():
+        winners.append(claimed.get())
+    assert len(winners) == 1
+
+    # the stalled worker lost its lease: it neither renews nor removes the lock of the new owner
+    new_token = stalled._read_token('job')
+    assert new_token not in (None, token)
+    assert not stalled._renew('job', token)
+    stalled.release('job')
+    assert stalled._read_token('job') == new_token
+    assert not any(name.endswith('.claim') for name in os.listdir(stalled.lock_path))
+
+
+def test_drain_retries_expired_job(tmp_path):
+    jobs = [f'job{i}' for i in range(N_JOBS)]
+    stalled = JobQueue(str(tmp_path), 'test', lease_seconds=5, heartbeat_seconds=60)
+    assert stalled.claim(jobs) == 'job0'
+    _expire(stalled, 'job0')
+
+    _start(_drain, str(tmp_path), jobs)
+    with open(tmp_path / 'runs.txt') as f:
+        assert sorted(f.read().split()) == sorted(jobs)
+    # completing late records the job again, but leaves no lock of another worker behind
+    stalled.complete('job0')
+    assert os.listdir(stalled.lock_path) == []
+
+
+def test_drain_recovers_from_crashed_workers(tmp_path):
+    jobs = [f'job{i}' for i in range(N_JOBS)]
+    crashed = JobQueue(str(tmp_path), 'test', lease_seconds=5, heartbeat_seconds=60)
+    old = time.time() - 2 * crashed.lease_seconds
+    # crashed after creating the lock of job0, before writing its token
+    open(crashed._lock_file('job0'), 'w').close()
+    os.utime(crashed._lock_file('job0'), (old, old))
+    # crashed while reclaiming the expired lease of job1, holding the claim marker of its token
+    assert crashed.claim(['job1']) == 'job1'
+    crashed._stop.set()
+    _expire(crashed, 'job1')
+    for token in ('', crashed._held['job1']):
+        marker = crashed._marker_file('job1' if token else 'job0', token)
+        open(marker, 'w').close()
+        os.utime(marker, (old, old))
+
+    _start(_drain, str(tmp_path), jobs)
+    with open(tmp_path / 'runs.txt') as f:
+        assert sorted(f.read().split()) == sorted(jobs)
+    assert os.listdir(crashed.lock_path) == []
@@ -1,44 +1,82 @@
 import json
 import os
 import shutil
+import warnings
+from functools import partial
 
-import pandas as pd
-from tqdm import tqdm, trange
+import numpy as np
+from tqdm import tqdm
 
-from storage.storage import Store
+from storage.preload import PreloadedBatch, store_names
+from storage.storage import Store, STATS_FILE, DEFAULT_CODEC
 from util.run import run_generate, run_eval
-from evaluate.evaluate import evaluate_single
+from evaluate.evaluate import evaluate_single, fit_single
+from util.dtype import DEFAULT_STORAGE_DTYPE
+from util.prefetch import prefetch, AsyncWriter
+from util.jobqueue import JobQueue, LEASE_SECONDS
+from util.isolate import IsolatedRunner
+from util.metrics import progress
+from util.schedule import Scheduler, is_picklable
+from util.stats import interval_widths, CONFIDENCE
+from util.lazy import lazy_import
 
+# only needed to collect results, not to generate or evaluate data sets
+pd = lazy_import('pandas')
 
-def batch_generate(builder, num: int, store_path: str) -> list[tuple[Store, dict]]:
+
+def batch_store_names(num: int) -> list[str]:
+    """Names of the stores of a batch of num data sets, zero-padded so they sort in order."""
+    padding = len(str(num - 1))
+    return [f"{i:0{padding}}" for i in range(num)]
+
+
+def batch_generate(builder, num: int, store_path: str, storage_dtype: str = DEFAULT_STORAGE_DTYPE,
+                   queue: bool = False, lease_seconds: float = LEASE_SECONDS,
+                   parallel: bool = True, blob_path: str = None,
+                   codec: str = DEFAULT_CODEC) -> list[tuple[Store, dict]]:
     """
     Generate a batch of data sets with the given builder.
     Will overwrite the previous contents of the store_path, or create the directory if it doesn't exist.
     :param builder: Dataset builder, from datagen.covshift or datagen.conceptshift
     :param num: amount of data sets to generate
     :param store_path: path to the directory containing runs
-    :returns for each data set, the store referencing it, and basic set statistics
+    :param storage_dtype: floating point type of the features on disk, e.g. 'float16' to halve the size
+    :param queue: share the work with other workers that generate the same batch, through a job queue in the
+    batch directory, see util/jobqueue.py. Keeps previous contents, data sets that are already done are skipped.
+    :param lease_seconds: time after which data sets of an unresponsive worker are generated by another worker
+    :param parallel: generate in parallel worker processes, see util/schedule.py. Workers do not share the random
+    state of this process, so use False to reproduce a batch with np.random.seed.
+    :param blob_path: directory of a blob store shared between batches, see storage/blobs.py. Arrays are stored
+    once per unique content, so regenerating an unchanged batch writes no arrays.
+    :param codec: format of the data files, e.g. 'zlib-shuffle' to compress them, see `Store.__init__`
+    :returns for each data set generated by this worker, the store referencing it, and basic set statistics
     """
 
+    names = batch_store_names(num)
+
+    if queue:
+        # other workers may be generating into the same directory, so it is never cleared
+        os.makedirs(store_path, exist_ok=True)
+        job_queue = JobQueue(store_path, 'generate', lease_seconds)
+        return job_queue.drain(
+            names, lambda name: run_generate(builder, name, store_path, storage_dtype, blob_path, codec))
+
     if os.path.exists(store_path):
         shutil.rmtree(store_path)
     else:
         os.makedirs(store_path)
 
-    res = []
-    padding = len(str(num - 1))
-    pbar = trange(num)
-    for i in pbar:
-        pbar.set_description("Generating dataset...")
-        store, stats = run_generate(builder, f"{i:0{padding}}", store_path)
-        res.append((store, stats))
-        pbar.set_description("Finished generating dataset")
-    return res
+    return _generate(builder, names, store_path, storage_dtype, parallel, blob_path, codec)
 
 
-def batch_eval(store_path: str, model, model_params: dict, fit_params: dict, train_split: float, multi_param=False, identifier: str = None) -> list[dict]:
+def batch_eval(store_path: str, model, model_params: dict, fit_params: dict, train_split: float, multi_param=False, identifier: str = None,
+               save_models: bool = False, warm_start: bool = False, warm_start_fit_params: dict = None,
+               prefetch_depth: int = 2, max_pending_writes: int = 4,
+               queue: bool = False, lease_seconds: float = LEASE_SECONDS,
+               runner: IsolatedRunner = None, parallel: bool = True, folds: int = None,
+               names: list[str] = None) -> list[dict]:
     """Load all dataset stores in a directory and evaluate a model's performance on it, then store results.
-    :param store_path: path to the directory containing runs
+    :param store_path: path to the directory containing runs, or a PreloadedBatch of it
     :param model: class of the adaptation model, such as adapt DANN, ADDA, MDD etc.
     :param model_params: parameters for the model class's __init__.
     If multi_param is True, instead a dictionary with a nested dictionaries of values for each configuration.
@@ -48,58 +86,372 @@ def batch_eval(store_path: str, model, model_params: dict, fit_params: dict, tra
     :param multi_param: use different parameters for different source/target configurations. See 'model_params'.
     :param identifier: appended to the results file name if not None
     Use to prevent overwriting when evaluating multiple models on the same dataset.
-    :returns: resulting dictionaries from evaluation
+    :param save_models: store the weights of every trained model, see `run_eval`
+    :param warm_start: start training 's->t' and 's->g' from the 's-only' weights, see `run_eval`
+    :param warm_start_fit_params: fit parameters for the warm started models, if None uses fit_params
+    :param prefetch_depth: number of datasets loaded in the background while training, 0 to load on demand.
+    Only in a single process, not with parallel workers.
+    :param max_pending_writes: number of results that can wait to be written, before training blocks on writing.
+    Only in a single process, not with parallel workers.
+    :param queue: share the work with other workers that evaluate the same batch and identifier, possibly on other
+    machines, through a job queue in the batch directory, see util/jobqueue.py. Data sets that are already done
+    are skipped, so an interrupted evaluation can be resumed. Results are written before a data set is marked done.
+    :param lease_seconds: time after which data sets of an unresponsive worker are evaluated by another worker
+    :param runner: IsolatedRunner to bound the memory of long evaluations, by clearing the Keras session after every
+    data set, and optionally evaluating in a recycled child process. The peak memory per data set is in runner.stats.
+    :param parallel: evaluate data sets in parallel worker processes, with a packing of processes and threads that is
+    tuned for the machine, see util/schedule.py. Requires picklable model parameters, pass a function returning them
+    if they contain Keras objects. Ignored in queue mode and with a runner. Every worker loads its data sets and
+    writes its results synchronously, without prefetching or background writes, while the other workers train.
+    Use parallel=False to overlap loading and writing with the training of a single process instead.
+    :param folds: cross-validate every data set with this many folds instead of a single split, see `evaluate_deep`.
+    Gives tighter estimates per data set, the spread over the folds is stored as '<metric>-std'. The folds of a data
+    set are trained in parallel too, in worker processes of their own if they are not already in a parallel worker.
+    :param names: only evaluate these data sets of the batch, in sorted order, default all
+    :returns: resulting dictionaries from evaluation, in queue mode only of the data sets evaluated by this worker
     """
 
-    if not os.path.exists(store_path):
-        raise FileNotFoundError(
-            f"Directory with stores for batch evaluation was not found in {os.path.abspath(store_path)}")
+    batch = store_path
+    store_path, all_names, load = _open_batch(store_path)
+    if names is not None:
+        missing = set(names) - set(all_names)
+        if missing:
+            raise KeyError(f"Data sets {sorted(missing)} do not exist in {store_path}")
+        names = sorted(names)
+    else:
+        names = all_names
+    args = (model, model_params, fit_params, train_split, multi_param, identifier, store_path, save_models,
+            warm_start, warm_start_fit_params, folds, True)  # folds in parallel, if not in a parallel worker already
+    isolated = runner is not None and runner.isolate
+    if isolated:
+        # the child process loads each data set itself, instead of receiving a copy through a pipe
+        load, prefetch_depth = lambda name: None, 0
+
+    def _eval(name, data, writer=None):
+        if runner is None:
+            return run_eval(name, *args, data=data, writer=writer)
+        if isolated:
+            return runner.run(run_eval, name, *args)
+        return runner.run(run_eval, name, *args, data=data, writer=writer)
+
+    if queue:
+        job_queue = JobQueue(store_path, f'eval_{identifier}' if identifier else 'eval', lease_seconds)
+        return job_queue.drain(names, lambda name: _eval(name, load(name)))
 
-    names = []
-    for entry in os.scandir(store_path):
-        if entry.is_dir():
-            names.append(entry.name)
+    tasks = None
+    if parallel and runner is None:
+        tasks = _parallel(_eval_task, names, (args,), _workload('batch_eval', model, fit_params), batch=batch)
 
     res = []
-    pbar = tqdm(names)
-    for name in pbar:
-        pbar.set_description(f"Evaluating on dataset {name}")
-        metrics = run_eval(name, model, model_params, fit_params, train_split, multi_param, identifier, store_path)
-        res.append(metrics)
-        pbar.set_description("Finished evaluating model")
+    pbar = tqdm(total=len(names))
+    tracker = progress('batch_eval', len(names), batch=os.path.basename(store_path), identifier=identifier or '')
+    try:
+        if tasks is not None:
+            # results are written by the workers
+            pbar.set_description("Evaluating on datasets")
+            for name, result in tasks:
+                res.append(result)
+                pbar.update()
+                tracker.update(dataset=name)
+            return res
+
+        with AsyncWriter(max_pending_writes) as writer:
+            for name, data in prefetch(names, load, prefetch_depth):
+                pbar.set_description(f"Evaluating on dataset {name}")
+                res.append(_eval(name, data, writer))
+                if runner is not None:
+                    pbar.set_postfix(peak_mb=f"{runner.stats[-1]['peak_mb']:.0f}")
+                pbar.update()
+                pbar.set_description("Finished evaluating model")
+                tracker.update(dataset=name)
+    finally:
+        pbar.close()
+        tracker.close()
 
     return res
 
 
-def batch_eval_single(store_path, model, model_params: dict, fit_params: dict, source: str, target: str) -> list[float]:
+def batch_eval_single(store_path, model, model_params: dict, fit_params: dict, source: str, target: str,
+                      trial=None, parallel: bool = True) -> list[float]:
     """Evaluate only a single configuration and record only a single accuracy value for each data set in the batch.
-    Does not save results to disk. Only intended for fast hyperparameter tuning, not for final results."""
+    Does not save results to disk. Only intended for fast hyperparameter tuning, not for final results.
+    :param trial: Optuna trial, if given the running mean accuracy is reported after each data set,
+    and optuna.TrialPruned is raised when the study's pruner decides to stop the trial early.
+    Data sets are evaluated in sorted order, so the intermediate values of different trials are comparable.
+    :param store_path: path to the directory containing runs, or a PreloadedBatch to prevent reading it every trial.
+    :param model_params: parameters for the model class's __init__, or a function returning them
+    :param parallel: evaluate data sets in parallel worker processes, see util/schedule.py. Results are still
+    reported to the trial in order. Requires picklable model parameters, see `batch_eval`."""
+
+    path, names, load = _open_batch(store_path)
+    args = (model, model_params, fit_params, source, target)
+    tasks = None
+    if parallel:
+        tasks = _parallel(_eval_single_task, names, args, _workload('batch_eval_single', model, fit_params),
+                          batch=store_path)
+    if tasks is None:
+        tasks = ((name, _eval_single_task(name, load, *args)) for name in names)
+
+    res = []
+    pbar = tqdm(total=len(names), desc="Evaluating on datasets")
+    tracker = progress('batch_eval_single', len(names), batch=os.path.basename(path), config=f'{source}->{target}')
+    try:
+        for step, (name, acc) in enumerate(tasks):
+            res.append(acc)
+            pbar.update()
+            tracker.update(dataset=name, acc=acc)
+
+            if trial is not None:
+                trial.set_user_attr('n_datasets', step + 1)
+                trial.set_user_attr('cost', (step + 1) * fit_params['epochs'])
+                trial.report(float(np.mean(res)), step)
+                if trial.should_prune():
+                    # cancels the data sets that did not start yet
+                    tasks.close()
+                    import optuna
+                    raise optuna.TrialPruned()
+    finally:
+        pbar.close()
+        tracker.close()
+    return res
+
+
+def batch_eval_fidelity(store_path, model, model_params: dict, fit_params: dict, source: str, target: str,
+                        schedule: list[tuple[int, int]], trial=None, steps: list[int] = None) -> list[float]:
+    """Like `batch_eval_single`, but with a schedule of increasing fidelity, as in successive halving.
+    Each rung of the schedule trains for more epochs, on more data sets. Models of previous rungs are kept,
+    and continue training for the remaining epochs, instead of starting over. Models whose class sets
+    `resumable = False`, like the Autoencoder, cannot continue training, and are trained from scratch every rung.
+    :param store_path: path to the directory containing runs, or a PreloadedBatch of it
+    :param schedule: list of (epochs, number of data sets) per rung, both non-decreasing.
+    The epochs in fit_params are ignored.
+    :param trial: Optuna trial, the mean accuracy of each rung is reported after the rung.
+    Raises optuna.TrialPruned when the pruner stops the trial before the last rung.
+    :param steps: step to report to the trial for each rung, if None uses the budget of the rung (epochs * data sets)
+    :returns accuracy for each data set of the last rung
+    """
+
+    path, names, load = _open_batch(store_path)
+    if schedule[-1][1] > len(names):
+        raise ValueError(f"Schedule requires {schedule[-1][1]} data sets, but only {len(names)} exist in {store_path}")
+
+    models = dict()
+    trained_epochs = dict()
+    cost = 0
+    res = []
+    tracker = progress('batch_eval_fidelity', sum(n for _, n in schedule), batch=os.path.basename(path),
+                       config=f'{source}->{target}')
+    try:
+        for rung, (epochs, n_datasets) in enumerate(schedule):
+            res = []
+            with tqdm(names[:n_datasets]) as pbar:
+                for name in pbar:
+                    pbar.set_description(f"Rung {rung}: evaluating on dataset {name}")
+                    if name not in models or not getattr(model, 'resumable', True):
+                        models[name] = model(**model_params)
+                        trained_epochs[name] = 0
+
+                    params = dict(fit_params, epochs=epochs - trained_epochs[name])
+                    res.append(fit_single(load(name), models[name], params, source, target))
+                    cost += params['epochs']
+                    trained_epochs[name] = epochs
+                    pbar.set_description("Finished evaluating model")
+                    tracker.update(dataset=name, rung=rung)
+
+            if trial is not None:
+                trial.set_user_attr('n_datasets', n_datasets)
+                trial.set_user_attr('cost', cost)
+                step = steps[rung] if steps is not None else epochs * n_datasets
+                trial.report(float(np.mean(res)), step)
+                if rung < len(schedule) - 1 and trial.should_prune():
+                    import optuna
+                    raise optuna.TrialPruned()
+    finally:
+        tracker.close()
+    return res
+
+
+def batch_eval_sequential(store_path: str, model, model_params, fit_params: dict, train_split: float,
+                          tolerance: float, configs: list[str] = None, differences: list[tuple[str, str]] = None,
+                          builder=None, max_datasets: int = 50, min_datasets: int = 10, round_size: int = 5,
+                          confidence: float = CONFIDENCE, storage_dtype: str = DEFAULT_STORAGE_DTYPE,
+                          **eval_params) -> tuple[list[dict], dict]:
+    """Evaluate data sets of a batch in rounds, until the results are precise enough, instead of a fixed number.
+    Stops as soon as the bootstrap interval of the mean target accuracy of every configuration, and of every difference,
+    is narrower than the tolerance, or when max_datasets were evaluated. Easy bias types stop after a few data sets.
+    :param store_path: path to the directory containing runs, created if a builder is given
+    :param tolerance: maximum width of every interval, e.g. 0.02 for a 95% interval of +-1% accuracy
+    :param configs: configurations whose target accuracy must be precise, like 's->g'.
+    Default every configuration, unless differences are given.
+    :param differences: pairs (a, b) whose difference in target accuracy a - b must be precise, like ('s->g', 's-only')
+    :param builder: Dataset builder, generates data sets when the existing data sets of the batch run out.
+    If None, at most the existing data sets are evaluated.
+    :param max_datasets: cap on the number of data sets evaluated
+    :param min_datasets: data sets evaluated in the first round
+    :param round_size: minimum number of data sets added per round. More are added if the intervals are far too wide,
+    estimated from the width shrinking with the square root of the number of data sets, at most doubling per round.
+    :param confidence: probability that an interval covers the mean
+    :param storage_dtype: floating point type of generated data sets on disk
+    :param eval_params: other parameters of `batch_eval`, like multi_param, identifier or folds
+    :returns: the results of every evaluated data set, in order, and a summary with 'n_datasets', 'widths' of every
+    interval and whether they 'converged' below the tolerance
+    """
+    if min_datasets < 2:
+        raise ValueError(f"Intervals need at least 2 data sets, got min_datasets={min_datasets}")
+    if 'queue' in eval_params or 'names' in eval_params:
+        raise ValueError("Sequential evaluation chooses the data sets itself, and does not support a job queue")
+    if configs is None and differences is None:
+        configs = ['s-only', 't-only', 's->t', 's->g']
+
+    existing = store_names(store_path) if os.path.exists(store_path) else []
+    if builder is None:
+        if not existing:
+            raise FileNotFoundError(f"No data sets in {os.path.abspath(store_path)}, and no builder to generate them")
+        names = existing
+    else:
+        # existing data sets first, then new ones named like `batch_generate` does
+        os.makedirs(store_path, exist_ok=True)
+        names = existing + [name for name in batch_store_names(max_datasets) if name not in existing]
+    names = names[:max_datasets]
+    columns = list(dict.fromkeys(list(configs or []) + [name for pair in differences or [] for name in pair]))
+
+    res = []
+    n_target = min(min_datasets, len(names))
+    # data sets evaluated so far out of the cap, with the widest interval after every round
+    pbar = tqdm(total=len(names), desc="Sequential evaluation")
+    try:
+        while True:
+            round_names = names[len(res):n_target]
+            new = [name for name in round_names if name not in existing]
+            if new:
+                _generate(builder, new, store_path, storage_dtype, eval_params.get('parallel', True))
+            res += batch_eval(store_path, model, model_params, fit_params, train_split, names=round_names,
+                              **eval_params)
+
+            acc = np.array([[result[f'{column}-acc-on-t'] for column in columns] for result in res])
+            widths = interval_widths(acc, columns, configs, differences, confidence=confidence)
+            widest = max(widths, key=widths.get)
+            converged = widths[widest] <= tolerance
+            pbar.update(len(round_names))
+            pbar.set_postfix(widest=widest, width=f"{widths[widest]:.4f}", tolerance=tolerance)
+            if converged or len(res) >= len(names):
+                break
+            projected = int(np.ceil(len(res) * (widths[widest] / tolerance) ** 2))
+            n_target = min(len(names), max(len(res) + round_size, min(projected, 2 * len(res))))
+    finally:
+        pbar.close()
+
+    if not converged:
+        warnings.warn(f"Stopped at the cap of {len(res)} data sets, before every interval was narrower than "
+                      f"{tolerance}. The widest is '{widest}' at {widths[widest]:.4f}")
+    return res, dict(n_datasets=len(res), widths=widths, converged=converged)
+
+
+def _open_batch(store_path) -> tuple:
+    """Directory, sorted store names and a function that loads a dataset by name, for a path or PreloadedBatch."""
+    if isinstance(store_path, PreloadedBatch):
+        return store_path.store_path, store_path.names, store_path.load_data
 
     if not os.path.exists(store_path):
         raise FileNotFoundError(
             f"Directory with stores for batch evaluation was not found in {os.path.abspath(store_path)}")
+    return store_path, store_names(store_path), lambda name: Store(name, store_path).load_data()
 
-    names = []
-    for entry in os.scandir(store_path):
-        if entry.is_dir():
-            names.append(entry.name)
 
-    res = []
-    pbar = tqdm(names)
-    for name in pbar:
-        pbar.set_description(f"Evaluating on dataset {name}")
-        store = Store(name, store_path)
-        data = store.load_data()
-        acc = evaluate_single(data, lambda: model(**model_params), fit_params, source, target)
-        res.append(acc)
-        pbar.set_description("Finished evaluating model")
+def _generate(builder, names: list[str], store_path: str, storage_dtype: str, parallel: bool,
+              blob_path: str = None, codec: str = DEFAULT_CODEC) -> list[tuple[Store, dict]]:
+    """Generate the data sets with the given names into an existing batch directory, see `batch_generate`."""
+    args = (builder, store_path, storage_dtype, blob_path, codec)
+    tasks = None
+    if parallel:
+        tasks = _parallel(_generate_task, names, args, f'batch_generate:{type(builder).__name__}', clear=False)
+    if tasks is None:
+        tasks = ((name, _generate_task(name, *args)) for name in names)
 
+    res = []
+    pbar = tqdm(total=len(names), desc="Generating datasets")
+    tracker = progress('batch_generate', len(names), batch=os.path.basename(store_path))
+    try:
+        for name, (store, stats) in tasks:
+            res.append((store, stats))
+            pbar.update()
+            tracker.update(dataset=name)
+    finally:
+        pbar.close()
+        tracker.close()
     return res
 
 
-def batch_load_eval(store_path: str) -> pd.DataFrame:
+def _generate_task(name: str, builder, store_path: str, storage_dtype: str, blob_path: str,
+                   codec: str) -> tuple[Store, dict]:
+    return run_generate(builder, name, store_path, storage_dtype, blob_path, codec)
+
+
+def _eval_task(name: str, load, args: tuple) -> dict:
+    return run_eval(name, *args, data=load(name))
+
+
+def _eval_single_task(name: str, load, model, model_params, fit_params: dict, source: str, target: str) -> float:
+    if callable(model_params):
+        model_params = model_params()
+    return evaluate_single(load(name), lambda: model(**model_params), fit_params, source, target)
+
+
+def _workload(loop: str, model, fit_params: dict) -> str:
+    """Name of an evaluation workload, the best packing depends on the model and the size of the fits."""
+    return f"{loop}:{model.__name__}:{fit_params.get('epochs', 1)}x{fit_params.get('batch_size', 32)}"
+
+
+def _parallel(task, names: list[str], args: tuple, workload: str, clear: bool = True, batch=None):
+    """Iterate over (name, task(name, *args)) in worker processes, see util/schedule.py.
+    :param batch: path or PreloadedBatch of the data sets, if given the task is called as task(name, load, *args),
+    with a function that loads a data set by name in the worker
+    :returns: the iterator, or None if the tasks should run in the loop of the caller instead, because the arguments
+    cannot be sent to worker processes, or there is only one core
+    """
+    if not is_picklable(task, args):
+        warnings.warn(f"Running {workload} in a single process, because its arguments cannot be pickled. "
+                      f"Pass Keras objects in the model parameters as a function returning them instead.")
+        return None
+    scheduler = Scheduler(workload, clear=clear)
+    packing, measure = scheduler.choose(len(names))
+    if packing[0] == 1 and not measure:
+        # a single core, or inside a worker process, the callers run the tasks in their own loop
+        return None
+    if batch is not None:
+        args = (_worker_loader(batch), *args)
+    return scheduler.map(task, names, *args)
+
+
+# batches memory-mapped by this worker process, by path
+_shared_batches = dict()
+
+
+def _load_shared(store_path: str, name: str) -> tuple:
+    if store_path not in _shared_batches:
+        _shared_batches[store_path] = PreloadedBatch.load(store_path, mmap=True)
+    return _shared_batches[store_path].load_data(name)
+
+
+def _load_store(store_path: str, name: str) -> tuple:
+    return Store(name, store_path).load_data()
+
+
+def _worker_loader(store_path):
+    """Picklable function that loads a data set by name in a worker process, for a path or PreloadedBatch.
+    Workers share a preloaded batch by memory-mapping its cache, which is written here if it does not exist."""
+    if isinstance(store_path, PreloadedBatch):
+        PreloadedBatch.load(store_path.store_path, mmap=True)
+        return partial(_load_shared, store_path.store_path)
+    return partial(_load_store, store_path)
+
+
+def batch_load_eval(store_path: str, stats: bool = False) -> 'pd.DataFrame':
     """
     Load *all* evaluation results from all runs in a path with stores into a pandas frame.:param store_path:
+    Recorded stages of the evaluation are in the columns 'timing.<stage>.<wall|cpu|peak_mb|calls>', if any.
+    :param stats: also add the statistics of each data set, in the columns 'stats.<name>',
+    including the recorded stages of generating it.
     :return: pandas dataframe, one row for each eval file, for each data set.
     """
 
@@ -107,7 +459,13 @@ def batch_load_eval(store_path: str) -> pd.DataFrame:
     data = []
 
     for directory in os.scandir(store_path):
-        if directory.is_dir():
+        if directory.is_dir() and not directory.name.startswith('.'):
+            data_stats = None
+            stats_path = os.path.join(directory.path, f'{STATS_FILE}.json')
+            if stats and os.path.exists(stats_path):
+                with open(stats_path, "r") as stats_file:
+                    data_stats = json.load(stats_file)
+
             for file in os.scandir(directory):
                 if file.name.startswith("eval"):
                     eval_json_path = file.path
@@ -118,6 +476,8 @@ def batch_load_eval(store_path: str) -> pd.DataFrame:
                         eval_data["dataset"] = directory.name  # Add directory name to the data
                         eval_data["identifier"] = file.name.split("_")[1].split(".")[
                             0] if "_" in file.name else ""  # Extract the identifier
+                        if data_stats is not None:
+                            eval_data["stats"] = data_stats
                         data.append(eval_data)
 
     # return the flattened JSON structure as dataframe
@@ -0,0 +1,21 @@
+"""Floating point precision policy for the data path, shared by datagen, storage and evaluate.
+Keras computes in float32, so data is generated, stored and fed in float32 to prevent a conversion copy on every
+fit or predict call. Features can optionally be stored as float16 on disk, they are still loaded as float32."""
+
+import numpy as np
+
+COMPUTE_DTYPE = np.float32
+STORAGE_DTYPES = ('float16', 'float32', 'float64')
+DEFAULT_STORAGE_DTYPE = 'float32'
+
+
+def as_compute(x: np.ndarray) -> np.ndarray:
+    """Convert an array to the compute dtype. Does not copy if it already has that dtype."""
+    return np.asarray(x, dtype=COMPUTE_DTYPE)
+
+
+def as_storage(x: np.ndarray, dtype: str = DEFAULT_STORAGE_DTYPE) -> np.ndarray:
+    """Convert features to the dtype used on disk. Does not copy if it already has that dtype."""
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported storage dtype '{dtype}', expected one of {STORAGE_DTYPES}")
+    return np.asarray(x, dtype=dtype)
@@ -0,0 +1,166 @@
+"""Record where the time goes in generating and evaluating data sets. Stages are marked with the `stage` context manager
+or the `timed` decorator, and are recorded inside a `recording` block, with wall time, CPU time and peak memory.
+Stages nest: a stage started inside another one is recorded as 'outer/inner', e.g. 's->t/fit/pretrain'.
+
+Recording is disabled by default, then marking a stage costs a single check. Enable it with `enable()`,
+or by setting the environment variable INSTRUMENT=1, which is inherited by worker processes."""
+
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from util.isolate import rss_mb
+
+ENV_VAR = 'INSTRUMENT'
+
+_enabled = os.environ.get(ENV_VAR) == '1'
+_recorder = None
+_NULL = nullcontext()
+
+
+def enable() -> None:
+    """Record stages in every following `recording` block, also in worker processes started afterwards."""
+    global _enabled
+    _enabled = True
+    os.environ[ENV_VAR] = '1'
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+    os.environ.pop(ENV_VAR, None)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class Recorder:
+    def __init__(self, interval: float = 0.01):
+        """
+        Collects the stages of a `recording` block. Use `recording` instead of creating it directly.
+        :param interval: seconds between samples of the resident memory, while stages are running
+        """
+        self.interval = interval
+        # per stage: number of calls, total wall and CPU time in seconds, peak resident memory in MB
+        self.records = dict()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='instrument-memory', daemon=True)
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = rss_mb()
+            with self._lock:
+                for running in self._running:
+                    running.peak_mb = max(running.peak_mb, rss)
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _enter(self, running) -> None:
+        stack = self._stack()
+        stack.append(running.name)
+        running.path = '/'.join(stack)
+        with self._lock:
+            self._running.add(running)
+
+    def _exit(self, running, wall: float, cpu: float) -> None:
+        self._stack().pop()
+        with self._lock:
+            self._running.discard(running)
+            record = self.records.setdefault(running.path, dict(calls=0, wall=0., cpu=0., peak_mb=0.))
+            record['calls'] += 1
+            record['wall'] += wall
+            record['cpu'] += cpu
+            record['peak_mb'] = max(record['peak_mb'], running.peak_mb)
+
+    def summary(self) -> dict:
+        """Copy of the records of all stages, by nested stage name."""
+        with self._lock:
+            return {path: dict(record) for path, record in self.records.items()}
+
+
+class _Stage:
+    __slots__ = ('name', 'recorder', 'path', 'peak_mb', '_wall', '_cpu')
+
+    def __init__(self, name: str, recorder: Recorder):
+        self.name = name
+        self.recorder = recorder
+        self.path = name
+        self.peak_mb = 0.
+
+    def __enter__(self):
+        self.peak_mb = rss_mb()
+        self.recorder._enter(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self.peak_mb = max(self.peak_mb, rss_mb())
+        self.recorder._exit(self, wall, cpu)
+
+
+def stage(name: str):
+    """Context manager that records the enclosed code as a stage of the active recording, if any.
+    CPU time is that of the whole process, so it includes other threads, like those of Tensorflow."""
+    recorder = _recorder
+    if recorder is None:
+        return _NULL
+    return _Stage(name, recorder)
+
+
+def timed(name: str = None):
+    """Decorator that records every call of the function as a stage, see `stage`.
+    :param name: name of the stage, defaults to the name of the function
+    """
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Stage(label, recorder):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def recording():
+    """Record the stages inside this block, if instrumentation is enabled.
+    Stages in background threads, like prefetching the next data set, count towards the active recording.
+    :returns: the Recorder, or None if disabled
+    """
+    global _recorder
+    if not _enabled:
+        yield None
+        return
+
+    previous = _recorder
+    recorder = Recorder()
+    recorder.start()
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        recorder.stop()
@@ -0,0 +1,169 @@
+"""Bound the memory of long evaluations. Every model adds to the global Keras state, so a long running process
+keeps growing and building models gets slower. The runner clears that state after every task, and can run tasks in a
+child process that is replaced after a number of tasks, or when it exceeds a memory threshold."""
+
+import gc
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import traceback
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process in MB. Falls back to the peak if the current value is unavailable."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def clear_session() -> None:
+    """Release the global Keras state of previously built models. Only call when those models are no longer used."""
+    import tensorflow as tf
+    tf.keras.backend.clear_session()
+    gc.collect()
+
+
+class MemoryMonitor:
+    """Context manager that samples the resident memory in a background thread, and records the peak in MB."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_mb = 0.
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def __enter__(self):
+        self.peak_mb = rss_mb()
+        self._thread = threading.Thread(target=self._sample, name='memory-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+
+
+def _run_task(func, args: tuple, kwargs: dict, clear: bool, capture: bool = True) -> tuple:
+    """Run a task, returns its result, the formatted exception if captured, and statistics about the task."""
+    result, error = None, None
+    start = time.time()
+    with MemoryMonitor() as monitor:
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            if not capture:
+                raise
+            error = traceback.format_exc()
+        finally:
+            if clear:
+                clear_session()
+    stats = dict(pid=os.getpid(), wall=time.time() - start, peak_mb=monitor.peak_mb, rss_mb=rss_mb())
+    return result, error, stats
+
+
+def _child_loop(conn, clear: bool) -> None:
+    """Run tasks received over the connection until receiving None."""
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        conn.send(_run_task(*task, clear))
+    conn.close()
+
+
+class IsolatedRunner:
+    def __init__(self, isolate: bool = False, max_tasks_per_child: int = None, max_memory_mb: float = None,
+                 clear: bool = True):
+        """
+        Runs tasks one by one, with the Keras state cleared after every task, and records the peak memory of each.
+        :param isolate: run the tasks in a child process. Functions and arguments must be picklable,
+        so pass parameters that contain Keras objects, like optimizers, as a function returning them.
+        :param max_tasks_per_child: replace the child process after this many tasks, None to keep it
+        :param max_memory_mb: replace the child process when its resident memory exceeds this after a task
+        :param clear: clear the Keras session after every task
+        """
+        self.isolate = isolate
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_memory_mb = max_memory_mb
+        self.clear = clear
+        # statistics of every task: process id, wall time in seconds, peak and final resident memory in MB
+        self.stats = []
+
+        self._process = None
+        self._conn = None
+        self._tasks_in_child = 0
+
+    def _start_child(self) -> None:
+        # tensorflow does not survive fork
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_child_loop, args=(child_conn, self.clear), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._tasks_in_child = 0
+
+    def _stop_child(self) -> None:
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(timeout=30)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._conn.close()
+        self._process, self._conn = None, None
+
+    def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs), in the child process if isolated.
+        Exceptions of isolated tasks are raised as RuntimeError, with the original traceback in the message.
+        :returns: result of the task. Statistics of the task are appended to `stats`.
+        """
+        if not self.isolate:
+            result, error, stats = _run_task(func, args, kwargs, self.clear, capture=False)
+        else:
+            if self._process is None:
+                self._start_child()
+            try:
+                self._conn.send((func, args, kwargs))
+                result, error, stats = self._conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                # most likely killed for running out of memory, the next task starts a new child
+                self._process.join(timeout=5)
+                exitcode = self._process.exitcode
+                self._stop_child()
+                raise RuntimeError(f"Worker process died during the task, with exit code {exitcode}")
+
+            self._tasks_in_child += 1
+            if ((self.max_tasks_per_child is not None and self._tasks_in_child >= self.max_tasks_per_child)
+                    or (self.max_memory_mb is not None and stats['rss_mb'] >= self.max_memory_mb)):
+                self._stop_child()
+
+        self.stats.append(stats)
+        if error is not None:
+            raise RuntimeError(f"Task failed in process {stats['pid']}:\n{error}")
+        return result
+
+    def close(self) -> None:
+        """Stop the child process, if any."""
+        self._stop_child()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,279 @@
+"""File-based job queue, for draining a batch with any number of workers on machines that share a filesystem.
+No service is needed, workers coordinate only through files in a hidden directory of the batch:
+
+- locks/<job>.lock: created exclusively by the worker that claims a job, with a random token of the claim. The lease
+  expires when the file was not touched for lease_seconds, a background thread of the owner touches it every
+  heartbeat_seconds, as long as the lock still holds its token.
+- locks/<job>.<token>.<n>.claim: created exclusively, and removed right after, by the single worker that removes the
+  lock with that token, either its owner releasing it or another worker reclaiming an expired lease. A marker that is
+  older than lease_seconds was left by a crashed worker, and is skipped by creating the marker with the next n.
+- done/<job>.json: written when a job completes, completed jobs are never claimed again.
+- manifest.jsonl: one line per completed job, with the worker and duration.
+
+Expired leases are reclaimed by other workers, so jobs of crashed workers are retried.
+Jobs are executed at least once: a worker that stalls longer than its lease may run a job twice, so jobs
+should be idempotent, like generating or evaluating a store by name."""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import warnings
+
+QUEUE_DIR = '.queue'
+LEASE_SECONDS = 600
+HEARTBEAT_SECONDS = 60
+# names the claim markers of a lock without a token
+EMPTY_TOKEN = 'empty'
+
+
+class JobQueue:
+    def __init__(self, batch_path: str, queue_name: str, lease_seconds: float = LEASE_SECONDS,
+                 heartbeat_seconds: float = HEARTBEAT_SECONDS, worker_id: str = None):
+        """
+        Attach to a queue in a batch directory, creating its directories if necessary.
+        :param batch_path: directory of the batch, shared by all workers
+        :param queue_name: name of the queue, e.g. 'generate' or 'eval_DANN', separate queues track jobs separately
+        :param lease_seconds: time after the last heartbeat, after which a claimed job may be reclaimed
+        :param heartbeat_seconds: interval of renewing the leases of claimed jobs, should be well below lease_seconds
+        :param worker_id: name of this worker in locks and the manifest, defaults to host, pid and a random postfix
+        """
+        self.path = os.path.join(batch_path, QUEUE_DIR, queue_name)
+        self.lock_path = os.path.join(self.path, 'locks')
+        self.done_path = os.path.join(self.path, 'done')
+        self.manifest_path = os.path.join(self.path, 'manifest.jsonl')
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        os.makedirs(self.lock_path, exist_ok=True)
+        os.makedirs(self.done_path, exist_ok=True)
+
+        self._held = dict()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _lock_file(self, job: str) -> str:
+        return os.path.join(self.lock_path, f'{job}.lock')
+
+    def _done_file(self, job: str) -> str:
+        return os.path.join(self.done_path, f'{job}.json')
+
+    def is_done(self, job: str) -> bool:
+        return os.path.exists(self._done_file(job))
+
+    def _marker_file(self, job: str, token: str, attempt: int = 0) -> str:
+        return os.path.join(self.lock_path, f'{job}.{token or EMPTY_TOKEN}.{attempt}.claim')
+
+    def _expired(self, path: str) -> bool:
+        """Whether a lock or marker was not touched for lease_seconds, False if it does not exist."""
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def _read_token(self, job: str):
+        """Token of the current lock of a job, None if it is not locked, or an empty string if the lock has no token,
+        because it is still being written or its worker crashed before writing it."""
+        try:
+            with open(self._lock_file(job), 'r') as f:
+                return json.load(f).get('token') or ''
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return ''
+
+    def _try_lock(self, job: str) -> bool:
+        """Create the lock file exclusively, which is atomic, also on network filesystems like NFSv3+."""
+        try:
+            fd = os.open(self._lock_file(job), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        token = uuid.uuid4().hex
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(worker=self.worker_id, token=token, claimed=time.time()), f)
+        with self._held_lock:
+            self._held[job] = token
+        return True
+
+    def _take(self, job: str, token: str):
+        """Get the exclusive right to remove the lock with the given token, by creating a claim marker for that
+        token exclusively. Only the holder of the marker removes a lock, so the lock cannot change between checking
+        its token and removing it, and at most one worker ever removes it: its owner or a single reclaiming worker.
+        Expired markers of crashed workers are skipped, the next marker is again created by only one worker.
+        The markers are removed again with `_drop`.
+        :returns: the attempt of the created marker, or None if another worker holds the lock or it changed
+        """
+        attempt = 0
+        while True:
+            try:
+                os.close(os.open(self._marker_file(job, token, attempt), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                if not self._expired(self._marker_file(job, token, attempt)):
+                    return None
+            attempt += 1
+        if self._read_token(job) != token:
+            # removed by the marker holder before, possibly locked again since
+            self._remove_markers(job, token, attempt)
+            return None
+        return attempt
+
+    def _remove_markers(self, job: str, token: str, attempt: int) -> None:
+        """Remove the marker of the given attempt, and the expired markers before it."""
+        for i in range(attempt, -1, -1):
+            try:
+                os.remove(self._marker_file(job, token, i))
+            except FileNotFoundError:
+                pass
+
+    def _drop(self, job: str, token: str, attempt: int) -> None:
+        """Remove the lock with the given token, and then the markers, while holding the marker of the attempt."""
+        os.remove(self._lock_file(job))
+        self._remove_markers(job, token, attempt)
+
+    def _reclaim_expired(self, job: str) -> bool:
+        """Remove the lock of a job if its lease expired, also if it has no token. Returns True if the job may be
+        claimed now, with a fresh exclusive lock, which only one of the workers that noticed the expired lease gets."""
+        token = self._read_token(job)
+        if token is None or not self._expired(self._lock_file(job)):
+            return False
+        attempt = self._take(job, token)
+        if attempt is None:
+            return False
+        if not self._expired(self._lock_file(job)):
+            # renewed by its owner after all, or locked again while the lock had no token
+            self._remove_markers(job, token, attempt)
+            return False
+        self._drop(job, token, attempt)
+        return True
+
+    def claim(self, jobs: list[str]):
+        """Claim the first job that is neither done nor leased by a live worker.
+        :returns: the name of the claimed job, or None if no job can be claimed right now
+        """
+        for job in jobs:
+            if self.is_done(job):
+                continue
+            if self._try_lock(job) or (self._reclaim_expired(job) and self._try_lock(job)):
+                if self.is_done(job):
+                    # completed by another worker, between checking and locking
+                    self.release(job)
+                    continue
+                self._start_heartbeat()
+                return job
+        return None
+
+    def complete(self, job: str, info: dict = None, duration: float = None) -> None:
+        """Mark a claimed job as done, record it in the manifest and release the lease."""
+        record = dict(job=job, worker=self.worker_id, finished=time.time(), duration=duration, info=info)
+        tmp = f'{self._done_file(job)}.{self.worker_id}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, self._done_file(job))
+
+        # single writes smaller than the pipe buffer are appended atomically on local filesystems
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.release(job)
+
+    def release(self, job: str) -> None:
+        """Give up the lease of a claimed job without completing it, so another worker can retry it.
+        The lock is left alone if the lease expired and another worker reclaimed the job."""
+        with self._held_lock:
+            token = self._held.pop(job, None)
+        attempt = None if token is None else self._take(job, token)
+        if attempt is not None:
+            self._drop(job, token, attempt)
+
+    def _start_heartbeat(self) -> None:
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._beat, name='queue-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.heartbeat_seconds):
+            with self._held_lock:
+                held = list(self._held.items())
+            for job, token in held:
+                if not self._renew(job, token):
+                    with self._held_lock:
+                        self._held.pop(job, None)
+                    warnings.warn(f"The lease of job '{job}' expired and was reclaimed, another worker may run it "
+                                  f"as well")
+
+    def _renew(self, job: str, token: str) -> bool:
+        """Touch the lock of a job if it still holds the given token. Returns False if the lease was lost."""
+        try:
+            with open(self._lock_file(job), 'r') as f:
+                if json.load(f).get('token') != token:
+                    return False
+                # touches the file that was checked, even if it was replaced in the meantime
+                os.utime(f.fileno())
+        except (FileNotFoundError, ValueError):
+            return False
+        return True
+
+    def close(self) -> None:
+        """Stop renewing leases, and release the jobs that are still claimed."""
+        self._stop.set()
+        with self._held_lock:
+            held = list(self._held)
+        for job in held:
+            self.release(job)
+
+    def drain(self, jobs: list[str], func, poll_seconds: float = None) -> list:
+        """Claim and run jobs until every job is done. Waits for jobs leased by other workers,
+        because they are reclaimed if that worker dies.
+        :param jobs: names of all jobs in the queue
+        :param func: function called with the job name, its result is returned
+        :param poll_seconds: time between checks while other workers hold the remaining jobs
+        :returns: results of the jobs run by this worker, in order of completion
+        """
+        if poll_seconds is None:
+            poll_seconds = min(self.heartbeat_seconds, 10)
+
+        res = []
+        try:
+            while True:
+                job = self.claim(jobs)
+                if job is None:
+                    if all(self.is_done(j) for j in jobs):
+                        break
+                    time.sleep(poll_seconds)
+                    continue
+
+                start = time.time()
+                try:
+                    result = func(job)
+                except BaseException:
+                    self.release(job)
+                    raise
+                self.complete(job, duration=time.time() - start)
+                res.append(result)
+        finally:
+            self.close()
+        return res
+
+    def status(self, jobs: list[str]) -> dict:
+        """Number of jobs that are done, leased or still open."""
+        done = sum(self.is_done(job) for job in jobs)
+        leased = sum(os.path.exists(self._lock_file(job)) and not self.is_done(job) for job in jobs)
+        return dict(done=done, leased=leased, open=len(jobs) - done - leased)
+
+
+if __name__ == "__main__":
+    """Show the progress of every queue of a batch directory: python -m util.jobqueue <batch directory>"""
+    import sys
+
+    batch_dir = sys.argv[1]
+    queue_dir = os.path.join(batch_dir, QUEUE_DIR)
+    for queue_name in sorted(os.listdir(queue_dir)) if os.path.isdir(queue_dir) else []:
+        q = JobQueue(batch_dir, queue_name)
+        locks = [entry for entry in os.scandir(q.lock_path) if entry.name.endswith('.lock')]
+        expired = sum(time.time() - entry.stat().st_mtime > q.lease_seconds for entry in locks)
+        print(f"{queue_name}: {len(os.listdir(q.done_path))} done, {len(locks)} leased, {expired} expired leases")
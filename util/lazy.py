@@ -0,0 +1,26 @@
+"""Defer importing heavy modules, like TensorFlow or optuna, until their first use.
+Keeps scripts that only analyze results or move data sets fast to start."""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """Import a module, but only execute it when one of its attributes is first accessed.
+    Use as `tf = lazy_import('tensorflow')` at module level, instead of `import tensorflow as tf`.
+    Only works for the module itself, `from module import name` would execute it right away.
+    :param name: absolute name of the module
+    :returns: the module, executed on first attribute access
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,201 @@
+"""Live metrics of long running experiments, for headless runs where progress bars are not visible.
+Emitted from the loops that update the progress bars, to two files in a metrics directory:
+
+- events.jsonl: one JSON object per event, like a finished data set or fit, shared by all processes.
+- <prefix>_<pid>.prom: current values in the Prometheus text format, one file per process, rewritten atomically.
+  Point the textfile collector of a node exporter at the directory to scrape them.
+
+Disabled by default, then every call is a no-op. Enable with `configure(directory)`, or by setting the environment
+variable METRICS_DIR, which is inherited by worker processes."""
+
+import json
+import math
+import os
+import threading
+import time
+
+ENV_VAR = 'METRICS_DIR'
+EVENTS_FILE = 'events.jsonl'
+PROM_PREFIX = 'gda'
+WRITE_INTERVAL = 1.0
+
+_HELP = {
+    'progress_done': ('gauge', "Items finished in the current loop"),
+    'progress_total': ('gauge', "Total items in the current loop"),
+    'progress_rate': ('gauge', "Items finished per second in the current loop"),
+    'progress_eta_seconds': ('gauge', "Estimated seconds until the current loop finishes"),
+    'fits_total': ('counter', "Models fitted by this process"),
+    'fits_per_second': ('gauge', "Models fitted per second by this process, since the first fit"),
+    'fit_samples_per_second': ('gauge', "Training samples processed per second in the last fit, times epochs"),
+    'queue_depth': ('gauge', "Items waiting in a queue"),
+}
+
+
+class MetricsExporter:
+    def __init__(self, directory: str, write_interval: float = WRITE_INTERVAL):
+        """
+        Writes events and the current metric values of this process to a metrics directory.
+        :param directory: directory for events.jsonl and the Prometheus text files, created if necessary
+        :param write_interval: minimum seconds between rewrites of the Prometheus file
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.write_interval = write_interval
+        self.events_path = os.path.join(directory, EVENTS_FILE)
+        self.prom_path = os.path.join(directory, f'{PROM_PREFIX}_{os.getpid()}.prom')
+
+        # metric name -> label tuple -> value
+        self.values = dict()
+        self._lock = threading.Lock()
+        self._last_write = 0.
+        self._first_fit = None
+
+    def emit(self, event: str, **fields) -> None:
+        """Append an event to the JSON-lines file."""
+        record = dict(time=time.time(), pid=os.getpid(), event=event, **fields)
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self.events_path, 'a') as f:
+                f.write(line)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.values.setdefault(name, dict())[tuple(sorted(labels.items()))] = value
+
+    def inc(self, name: str, amount: float = 1, **labels) -> float:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.values.setdefault(name, dict())
+            series[key] = series.get(key, 0) + amount
+            return series[key]
+
+    def write(self, force: bool = False) -> None:
+        """Rewrite the Prometheus file, at most once per write_interval unless forced."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_write < self.write_interval:
+                return
+            self._last_write = now
+            lines = []
+            for name, series in self.values.items():
+                metric = f'{PROM_PREFIX}_{name}'
+                kind, text = _HELP.get(name, ('gauge', name))
+                lines += [f'# HELP {metric} {text}', f'# TYPE {metric} {kind}']
+                for labels, value in series.items():
+                    label_text = ','.join(f'{key}="{_escape(value_)}"' for key, value_ in labels)
+                    label_text = f'{{{label_text}}}' if label_text else ''
+                    lines.append(f'{metric}{label_text} {_format(value)}')
+
+        # the collector may read at any time, so never expose a partially written file
+        tmp = f'{self.prom_path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prom_path)
+
+    def record_fit(self, config: str, n_samples: int, epochs: int, seconds: float) -> None:
+        """Count a finished fit, and its throughput in training samples per second."""
+        now = time.time()
+        if self._first_fit is None:
+            self._first_fit = now - seconds
+        fits = self.inc('fits_total', config=config)
+        total = sum(self.values['fits_total'].values())
+        self.set('fits_per_second', total / max(now - self._first_fit, 1e-9))
+        samples_per_second = n_samples * epochs / max(seconds, 1e-9)
+        self.set('fit_samples_per_second', samples_per_second, config=config)
+        self.emit('fit', config=config, n_samples=n_samples, epochs=epochs, seconds=seconds,
+                  samples_per_second=samples_per_second, fits=fits)
+        self.write()
+
+
+class Progress:
+    def __init__(self, exporter: MetricsExporter, loop: str, total: int, **labels):
+        """Progress of a loop, with its rate and ETA. Use `progress` instead of creating it directly."""
+        self.exporter = exporter
+        self.loop = loop
+        self.total = total
+        self.labels = dict(labels, loop=loop)
+        self.done = 0
+        self.start = time.time()
+        exporter.set('progress_total', total, **self.labels)
+        exporter.set('progress_done', 0, **self.labels)
+        exporter.emit('start', total=total, **self.labels)
+        exporter.write(force=True)
+
+    def update(self, n: int = 1, **fields) -> None:
+        """Count n finished items, and emit an event with the given fields, e.g. the name of the data set."""
+        self.done += n
+        elapsed = time.time() - self.start
+        rate = self.done / max(elapsed, 1e-9)
+        eta = (self.total - self.done) / rate if rate > 0 else float('nan')
+        self.exporter.set('progress_done', self.done, **self.labels)
+        self.exporter.set('progress_rate', rate, **self.labels)
+        self.exporter.set('progress_eta_seconds', eta, **self.labels)
+        self.exporter.emit('progress', done=self.done, total=self.total, rate=rate, eta=eta,
+                           **self.labels, **fields)
+        self.exporter.write(force=self.done >= self.total)
+
+    def close(self) -> None:
+        self.exporter.emit('end', done=self.done, total=self.total, seconds=time.time() - self.start, **self.labels)
+        self.exporter.write(force=True)
+
+
+class _NullProgress:
+    def update(self, n: int = 1, **fields) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+_NULL_PROGRESS = _NullProgress()
+_exporter = MetricsExporter(os.environ[ENV_VAR]) if os.environ.get(ENV_VAR) else None
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value) -> str:
+    """Number in the Prometheus text format, which spells special values as NaN, +Inf and -Inf."""
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def configure(directory: str = None) -> None:
+    """Export metrics to a directory, also from worker processes started afterwards. None disables exporting."""
+    global _exporter
+    if directory is None:
+        _exporter = None
+        os.environ.pop(ENV_VAR, None)
+    else:
+        _exporter = MetricsExporter(directory)
+        os.environ[ENV_VAR] = directory
+
+
+def progress(loop: str, total: int, **labels):
+    """Track the progress of a loop, like the data sets of a batch. Call `update` where the progress bar updates.
+    :param loop: name of the loop, like 'batch_eval'
+    :param total: number of items in the loop
+    :param labels: additional labels of the metrics, like the name of the batch
+    :returns: Progress, or a no-op placeholder if exporting is disabled
+    """
+    if _exporter is None:
+        return _NULL_PROGRESS
+    return Progress(_exporter, loop, total, **labels)
+
+
+def record_fit(config: str, n_samples: int, epochs: int, seconds: float) -> None:
+    """Count a finished fit of a configuration like 's->t', see `MetricsExporter.record_fit`."""
+    if _exporter is not None:
+        _exporter.record_fit(config, n_samples, epochs, seconds)
+
+
+def set_queue_depth(queue: str, depth: int) -> None:
+    """Report the number of items waiting in a queue, like datasets loaded ahead or results waiting to be written."""
+    if _exporter is not None:
+        _exporter.set('queue_depth', depth, queue=queue)
+        _exporter.write()
@@ -1,10 +1,6 @@
 import pandas as pd
 
-from scipy.stats import ttest_ind
-from matplotlib import pyplot as plt
-from matplotlib.ticker import FuncFormatter
-
-FORMAT_PERC = FuncFormatter(lambda y, _: '{:.0%}'.format(y))
+from util.stats import summarize, N_RESAMPLES
 
 DISPLAY_NAMES = {
     "s-only": "$S_{only}$",
@@ -15,13 +11,16 @@ DISPLAY_NAMES = {
 }
 
 
-def plot_target_acc_box(results: pd.DataFrame, title: str, save: str = None) -> None:
+def plot_target_acc_box(results: pd.DataFrame, title: str, save: str = None, show: bool = True) -> None:
     """
     Plot for each model the target accuracy boxplot.
     :param results: dataframe in the format returned by batch_load_eval
     :param title: plot title
     :param save: path to save figure. If None, shows figure directly.
+    :param show: show the figure after saving it, False closes it instead, e.g. to render without a display
     """
+    from matplotlib import pyplot as plt
+
     cols = ['s-only', 's->g', 's->t', 't-only']
 
     acc = _process_target_acc(results)
@@ -30,72 +29,100 @@ def plot_target_acc_box(results: pd.DataFrame, title: str, save: str = None) ->
 
     plt.figure(dpi=300, figsize=(3.5, 3.5))
     acc.boxplot(ax=plt.gca(), showfliers=False)
-    plt.gca().yaxis.set_major_formatter(FORMAT_PERC)
+    plt.gca().yaxis.set_major_formatter(_format_perc())
 
     plt.title(title)
     plt.ylabel("Accuracy (%)")
     plt.ylim(bottom=0.4, top=1)
     plt.tight_layout()
+    _finish(save, show)
 
-    if save:
-        plt.savefig(save)
-
-    plt.show()
 
-
-def plot_adaptation(results: pd.DataFrame, title: str = None) -> None:
+def plot_adaptation(results: pd.DataFrame, title: str = None, save: str = None, show: bool = True) -> None:
     """
     For adapt-to-global, and adapt-to-target,
     plot the percentage that they reach between source-only and target-only.
     :param results: dataframe in the format returned by batch_load_eval
     :param title
+    :param save: path to save figure, see `plot_target_acc_box`
+    :param show: show the figure, see `plot_target_acc_box`
     """
+    from matplotlib import pyplot as plt
+
     acc = _process_target_acc(results)
     adaptation_g = (acc['s->g'] - acc['s-only']) / (acc['t-only'] - acc['s-only'])
     adaptation_t = (acc['s->t'] - acc['s-only']) / (acc['t-only'] - acc['s-only'])
     data = pd.DataFrame({DISPLAY_NAMES['s->g']: adaptation_g,
                          DISPLAY_NAMES['s->t']: adaptation_t})
     data.boxplot(showfliers=False)
-    plt.gca().yaxis.set_major_formatter(FORMAT_PERC)
+    plt.gca().yaxis.set_major_formatter(_format_perc())
 
     plt.title(title)
     plt.ylabel("Adaptation (%)")
     plt.tight_layout()
-    plt.show()
+    _finish(save, show)
 
 
-def plot_relative_adaptation(df: pd.DataFrame, title: str = None) -> None:
+def plot_relative_adaptation(df: pd.DataFrame, title: str = None, save: str = None, show: bool = True) -> None:
+    """
+    For adapt-to-global, plot the percentage it reaches of the improvement of adapt-to-target over source-only.
+    :param save: path to save figure, see `plot_target_acc_box`
+    :param show: show the figure, see `plot_target_acc_box`
+    """
+    from matplotlib import pyplot as plt
+
     acc = _process_target_acc(df)
     adaptation_g_rel_t = (acc['s->g'] - acc['s-only']) / (acc['s->t'] - acc['s-only'])
     data2 = pd.DataFrame({DISPLAY_NAMES['s->g']: adaptation_g_rel_t})
     data2.boxplot(showfliers=False)
-    plt.gca().yaxis.set_major_formatter(FORMAT_PERC)
+    plt.gca().yaxis.set_major_formatter(_format_perc())
 
     plt.title(title)
     plt.ylabel("Relative Adaptation(%)")
     plt.tight_layout()
-    plt.show()
+    _finish(save, show)
 
 
-def print_acc_stats(df: pd.DataFrame, alpha=0.002):
-    """Not a plotting function, but similar processing steps. Outputs to terminal."""
+def print_acc_stats(df: pd.DataFrame, alpha=0.002, n_resamples: int = N_RESAMPLES):
+    """Not a plotting function, but similar processing steps. Outputs to terminal.
+    Prints the median and mean target accuracy of every configuration with bootstrap confidence intervals,
+    and the mean paired difference between configurations with the p-value of a paired permutation test,
+    see util/stats.py. Differences with p < alpha are marked significant."""
     acc = _process_target_acc(df)
-    cols = ['s-only', 's->g', 's->t', 't-only']
-    for col in cols:
-        series = acc[col]
-        _, p = ttest_ind(acc['s-only'], series, equal_var=False)
-        print(f'{col:8} median: {series.median():.3f}, '
-              f'mean: {series.mean():.3f}, '
-              f'std: {series.std():.3f}, '
-              f'p={p:.3f} '
-              + ('(SIGN)' if p < alpha else ''))
+    res = summarize(acc.to_numpy(), list(acc.columns), n_resamples=n_resamples)
+    for col in ['s-only', 's->g', 's->t', 't-only']:
+        config = res['configs'][col]
+        print(f"{col:8} median: {config['median']:.3f} [{config['median_low']:.3f}, {config['median_high']:.3f}], "
+              f"mean: {config['mean']:.3f} [{config['mean_low']:.3f}, {config['mean_high']:.3f}], "
+              f"std: {acc[col].std():.3f}")
+    for pair, test in res['pairs'].items():
+        print(f"{pair:18} diff: {test['diff']:+.3f}, p={test['p']:.4f} " + ('(SIGN)' if test['p'] < alpha else ''))
+
+
+def _finish(save: str, show: bool) -> None:
+    """Save and show the current figure. Figures that are not shown are closed, so rendering many does not
+    accumulate them."""
+    from matplotlib import pyplot as plt
+
+    if save:
+        plt.savefig(save)
+    if show:
+        plt.show()
+    else:
+        plt.close()
+
+
+def _format_perc():
+    """Axis formatter for fractions as percentages. matplotlib is only imported when plotting."""
+    from matplotlib.ticker import FuncFormatter
+    return FuncFormatter(lambda y, _: '{:.0%}'.format(y))
 
 
 def _process_target_acc(df: pd.DataFrame) -> pd.DataFrame:
     """
     Select only target acc columns and rename to 'x->y' or 'x-only' format.
     Sorts columns by median."""
-    acc = df.loc[:, df.columns.str.contains('acc-on-t')]
+    acc = df.loc[:, df.columns.str.endswith('-acc-on-t')]
     acc = acc.rename(columns=lambda col: col.split('metrics.')[1].split('-acc-on-t')[0])
     sorted_columns = acc.median().sort_values()
     return acc[sorted_columns.index]
@@ -0,0 +1,87 @@
+"""Overlap dataset I/O with training. Loads upcoming datasets in background threads, and writes results
+asynchronously. Both are bounded, so at most a fixed number of datasets and results are held in memory."""
+
+import threading
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from util.metrics import set_queue_depth
+
+
+def prefetch(names: list[str], load, depth: int = 2, n_threads: int = 2):
+    """Iterate over (name, data), while the next datasets are loaded in the background.
+    :param names: names of the datasets, in order
+    :param load: function that loads a dataset by name
+    :param depth: number of datasets loaded ahead of the current one, 0 loads on demand without threads
+    :param n_threads: number of threads loading concurrently
+    """
+    if depth <= 0:
+        for name in names:
+            yield name, load(name)
+        return
+
+    with ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='prefetch') as pool:
+        pending = deque()
+        names = iter(names)
+        for name in names:
+            pending.append((name, pool.submit(load, name)))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            name, future = pending.popleft()
+            data = future.result()
+            # schedule the next load before handing out the current dataset, to keep depth datasets in flight
+            next_name = next(names, None)
+            if next_name is not None:
+                pending.append((next_name, pool.submit(load, next_name)))
+            set_queue_depth('prefetch', len(pending))
+            yield name, data
+
+
+class AsyncWriter:
+    """Run write operations in a background thread, in order of submission.
+    Submitting blocks while max_pending writes are still unfinished. Errors are raised on the next submit or close.
+    Leaving the context because of an exception still waits for the writes, but only warns about their errors,
+    so they do not replace the exception."""
+
+    def __init__(self, max_pending: int = 4):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, func, *args, **kwargs) -> None:
+        self._raise_errors()
+        self._slots.acquire()
+        future = self._pool.submit(func, *args, **kwargs)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        set_queue_depth('writer', len(self._futures))
+
+    def _raise_errors(self) -> None:
+        remaining = []
+        for future in self._futures:
+            if future.done():
+                future.result()
+            else:
+                remaining.append(future)
+        self._futures = remaining
+
+    def close(self) -> None:
+        """Wait for all writes to finish."""
+        self._pool.shutdown(wait=True)
+        set_queue_depth('writer', 0)
+        self._raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception as e:
+            warnings.warn(f"Writing results failed as well, while handling {exc_type.__name__}: {e!r}")
@@ -1,58 +1,114 @@
+from functools import partial
+
 from evaluate.evaluate import evaluate_deep
 from evaluate.evaluate import analyze_data
-from storage.storage import Store
+from storage.storage import Store, DEFAULT_CODEC
+from util.dtype import DEFAULT_STORAGE_DTYPE
+from util.instrument import recording, stage
 
 
-def run_generate(builder, name: str = None, store_path: str = None) -> tuple[Store, dict]:
+def run_generate(builder, name: str = None, store_path: str = None,
+                 storage_dtype: str = DEFAULT_STORAGE_DTYPE, blob_path: str = None,
+                 codec: str = DEFAULT_CODEC) -> tuple[Store, dict]:
     """Generate a dataset, and store it, along with basic analysis and configuration.
     :param builder: Dataset builder, from datagen.covshift or datagen.conceptshift
     :param name: name of the folder with the results of the run, timestamp if None
     :param store_path: path to the directory containing runs, <cwd>/results if None
-    :returns created store, and dictionary with basic stats about the created set
+    :param storage_dtype: floating point type of the features on disk, e.g. 'float16' to halve the size
+    :param blob_path: directory of a blob store to save the arrays in, once per unique content, see storage/blobs.py
+    :param codec: format of the data file, e.g. 'zlib-shuffle' to compress it, see `Store.__init__`
+    :returns created store, and dictionary with basic stats about the created set.
+    Includes the recorded stages under 'timing', if instrumentation is enabled, see util/instrument.py
     """
-    data = builder.generate()
-    data_stats = analyze_data(data)
+    with recording() as recorder:
+        with stage('generate'):
+            data = builder.generate()
+        with stage('analyze_data'):
+            data_stats = analyze_data(data)
+
+        store = Store.new(name, store_path, overwrite=True, storage_dtype=storage_dtype, blob_path=blob_path,
+                          codec=codec)
+        store.save_data(*data)
+    if recorder is not None:
+        data_stats['timing'] = recorder.summary()
 
-    store = Store.new(name, store_path, overwrite=True)
-    store.save_data(*data)
     store.save_config(builder)
     store.save_stats(data_stats)
     return store, data_stats
 
 
-def model_param_combiner(model, params):
-    """"Functions similar to `lambda: model(**params), but a method is required for lazy evaluation complications"""
-    def _func():
-        return model(**params)
-    return _func
-
-
 def run_eval(name: str, model, model_params: dict, fit_params: dict,
-             train_split: float, multi_param=False, identifier: str = None, store_path: str = None) -> dict:
+             train_split: float, multi_param=False, identifier: str = None, store_path: str = None,
+             save_models: bool = False, warm_start: bool = False, warm_start_fit_params: dict = None,
+             folds: int = None, parallel: bool = False, data: tuple = None, writer=None) -> dict:
     """Load a stored dataset and evaluate a model's performance on it, then store results.
     :param name: name of the folder with the results of the run
     :param model: class of the adaptation model, such as adapt DANN, ADDA, MDD etc.
     :param model_params: parameters for the model class's __init__.
     If multi_param is True, instead a dictionary with a nested dictionaries of values for each configuration.
-    Keys formatted like 's-only' and 's->t'.
+    Keys formatted like 's-only' and 's->t'. Can also be a function returning the parameters, to create Keras objects
+    like optimizers in the process that runs the evaluation, see util/isolate.py.
     :param fit_params: parameters for the model class's fit
     :param train_split: proportion to use for training data, use rest for test.
     :param multi_param: use different parameters for different source/target configurations. See 'model_params'.
     :param identifier: appended to the results file name.
     Use to prevent overwriting when evaluating multiple models on the same dataset.
     :param store_path: path to the directory containing runs, <cwd>/results if None
-    :returns resulting dictionary from evaluation
+    :param save_models: store the weights of every trained model in the store, under the identifier
+    :param warm_start: start training 's->t' and 's->g' from the 's-only' weights.
+    Uses the 's-only' weights stored under the identifier if they exist, instead of training 's-only' again.
+    :param warm_start_fit_params: fit parameters for the warm started models, if None uses fit_params
+    :param folds: cross-validate with this many folds instead of a single split, see `evaluate_deep`.
+    Models are not saved, nor warm started from saved weights, in this mode.
+    :param parallel: train the folds in parallel worker processes, see `evaluate_deep`
+    :param data: the already loaded dataset of the store, e.g. from a PreloadedBatch. If None, loads it from disk.
+    :param writer: AsyncWriter to save the results in the background, if None saves before returning.
+    :returns resulting dictionary from evaluation.
+    If instrumentation is enabled, the recorded stages are stored under 'timing' in the results file.
     """
+    with recording() as recorder:
+        deep_metrics, model_params = _eval(name, model, model_params, fit_params, train_split, multi_param,
+                                           identifier, store_path, save_models, warm_start,
+                                           warm_start_fit_params, folds, parallel, data)
+    timing = recorder.summary() if recorder is not None else None
+
+    store = Store(name, store_path)
+    if writer is not None:
+        writer.submit(store.save_eval, deep_metrics, model.__name__, model_params, fit_params, identifier, timing)
+    else:
+        store.save_eval(deep_metrics, model.__name__, model_params, fit_params, identifier, timing)
+    return deep_metrics
+
+
+def _eval(name, model, model_params, fit_params, train_split, multi_param, identifier, store_path,
+          save_models, warm_start, warm_start_fit_params, folds, parallel, data) -> tuple[dict, dict]:
+    """Evaluation part of `run_eval`, returns the metrics and the model parameters that were used."""
     store = Store(name, store_path)
-    data = store.load_data()
+    if data is None:
+        data = store.load_data()
+
+    if callable(model_params):
+        model_params = model_params()
 
+    # partial instead of a lambda, so folds can be trained in worker processes
     if multi_param:
         builder = dict()
         for key in model_params:
-            builder[key] = model_param_combiner(model, model_params[key])
+            builder[key] = partial(model, **model_params[key])
     else:
-        builder = lambda: model(**model_params)
+        builder = partial(model, **model_params)
 
-    deep_metrics = evaluate_deep(data, builder, fit_params, train_split)
-    store.save_eval(deep_metrics, model.__name__, model_params, fit_params, identifier)
-    return deep_metrics
+    pretrained = dict()
+    if warm_start and folds is None and store.has_model('s-only', identifier):
+        s_only_builder = builder['s-only'] if multi_param else builder
+        pretrained['s-only'] = store.load_model('s-only', s_only_builder, identifier)
+
+    checkpoint = None
+    if save_models and folds is None:
+        def checkpoint(config, trained, input_shape):
+            store.save_model(trained, config, input_shape, identifier)
+
+    deep_metrics = evaluate_deep(data, builder, fit_params, train_split, warm_start=warm_start,
+                                 warm_start_fit_params=warm_start_fit_params, pretrained=pretrained,
+                                 checkpoint=checkpoint, folds=folds, parallel=parallel)
+    return deep_metrics, model_params
@@ -0,0 +1,316 @@
+"""Pack the many small fits of a batch onto the cores of the machine.
+TensorFlow and the BLAS library each start thread pools as large as the machine. The models of a batch are too small
+to use those well, and running several fits in parallel with the defaults oversubscribes the cores, so throughput
+collapses. The scheduler instead runs tasks in worker processes that are pinned to their own cores, with the thread
+pools of each limited to those cores.
+
+The packing, how many processes with how many threads each, is tuned per workload: every call of `Scheduler.map`
+tries the next untried packing that fits its number of tasks, and measures the tasks finished per second on the real
+tasks, so no work is spent on probing. Once every packing that fits was tried, the fastest is used. Measurements are
+kept in a file per machine, so later runs start with the best packing.
+
+Set the environment variable SCHEDULE=0 to run every task in the calling process, e.g. for debugging."""
+
+import atexit
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from util.isolate import clear_session
+
+ENV_VAR = 'SCHEDULE'
+WORKER_ENV_VAR = 'SCHEDULE_WORKER'
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'global-domain-adaptation', 'schedule.json')
+
+# resident memory of a worker that trains small Keras models, bounds the number of processes on small machines
+MEMORY_PER_PROCESS_MB = 1024
+# tasks in flight per worker process, so the next task is ready when a worker finishes
+TASKS_PER_PROCESS = 2
+# a packing is only measured on calls with this many tasks per process, the first task of every process is warm-up
+MIN_TASKS_PER_PROCESS = 3
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')
+
+
+def available_cores() -> list[int]:
+    """Cores this process may run on, which can be fewer than the machine has, e.g. in a container or when pinned."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_memory_mb() -> float:
+    """Memory available for new processes in MB, or None if unknown."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def core_slices(n: int, cores: list[int] = None) -> list[list[int]]:
+    """Divide the cores into n slices of equal size. Slices share cores if there are fewer cores than slices."""
+    cores = cores or available_cores()
+    size = max(1, len(cores) // n)
+    return [[cores[(i * size + j) % len(cores)] for j in range(size)] for i in range(n)]
+
+
+def pin(cores: list[int]) -> None:
+    """Run this process only on the given cores, where supported. Processes started afterwards inherit it."""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+def limit_threads(n_threads: int) -> None:
+    """Limit the thread pools of BLAS and TensorFlow in this process, and in processes started afterwards.
+    TensorFlow only reads its limits when it initializes, so call this before building the first model."""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+
+    # BLAS libraries loaded before, e.g. by numpy, no longer read the environment
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(n_threads)
+
+
+def candidate_packings(n_cores: int, max_processes: int = None) -> list[tuple[int, int]]:
+    """Packings (processes, threads per process) that use all cores, from one process with every core,
+    to one single-threaded process per core. The process counts are powers of two, and the number of cores."""
+    max_processes = min(n_cores, max_processes or n_cores)
+    counts = sorted({2 ** k for k in range(n_cores.bit_length()) if 2 ** k <= max_processes} | {max_processes})
+    return [(processes, max(1, n_cores // processes)) for processes in counts]
+
+
+def default_packing(n_cores: int, max_processes: int = None) -> tuple[int, int]:
+    """Packing used before any was measured: small fits barely gain from more threads, so one process per core."""
+    processes = min(n_cores, max_processes or n_cores)
+    return processes, max(1, n_cores // processes)
+
+
+def pin_share(slots) -> None:
+    """Initializer of a process pool whose workers each run on their own share of the cores, like the points of a
+    sweep. Schedulers in such a worker only divide its share, see `available_cores`.
+    :param slots: queue with one list of cores per worker, see `core_slices`
+    """
+    cores = slots.get()
+    pin(cores)
+    limit_threads(len(cores))
+
+
+def _init_worker(slots, n_threads: int) -> None:
+    pin(slots.get())
+    limit_threads(n_threads)
+    # tasks in a worker never start workers of their own
+    os.environ[WORKER_ENV_VAR] = '1'
+
+
+def _run(func, clear: bool, args: tuple, kwargs: dict):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if clear:
+            clear_session()
+
+
+# worker processes are shared by all schedulers, and kept between calls, since starting them takes seconds.
+# A pool is kept per packing, so alternating workloads, like generating and evaluating the rounds of a sequential
+# evaluation, reuse their workers. Idle workers only hold memory, beyond MAX_POOLS the least recently used is stopped.
+MAX_POOLS = 2
+_pools = OrderedDict()
+
+
+def _get_pool(processes: int, n_threads: int) -> ProcessPoolExecutor:
+    packing = (processes, n_threads)
+    if packing in _pools:
+        _pools.move_to_end(packing)
+        return _pools[packing]
+    while len(_pools) >= MAX_POOLS:
+        _, pool = _pools.popitem(last=False)
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    # tensorflow does not survive fork
+    ctx = multiprocessing.get_context('spawn')
+    slots = ctx.Queue()
+    for cores in core_slices(processes):
+        slots.put(cores)
+    _pools[packing] = ProcessPoolExecutor(processes, mp_context=ctx, initializer=_init_worker,
+                                          initargs=(slots, n_threads))
+    return _pools[packing]
+
+
+def shutdown() -> None:
+    """Stop the worker processes. They are started again by the next call that needs them."""
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+def is_picklable(*objects) -> bool:
+    """Whether the objects can be sent to a worker process. Keras objects like optimizers often cannot,
+    pass a function returning them instead, see util/isolate.py."""
+    try:
+        pickle.dumps(objects)
+        return True
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+
+
+def _read_cache(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+class Scheduler:
+    def __init__(self, workload: str, packing: tuple[int, int] = None, tune: bool = True, clear: bool = True,
+                 cache_path: str = CACHE_FILE, memory_per_process_mb: float = MEMORY_PER_PROCESS_MB):
+        """
+        Runs the tasks of a workload in parallel worker processes, with a tuned packing.
+        :param workload: name of the workload, packings are tuned separately per name.
+        Include what changes the cost of a task, like the model and the number of epochs.
+        :param packing: fixed (processes, threads per process), instead of tuning it
+        :param tune: measure packings, if False uses the best measured packing, or `default_packing`
+        :param clear: clear the Keras session after every task in a worker
+        :param cache_path: file with the measurements of every workload on this machine
+        :param memory_per_process_mb: limits the number of processes to the available memory
+        """
+        self.workload = workload
+        self.packing = packing
+        self.tune = tune
+        self.clear = clear
+        self.cache_path = cache_path
+        self.memory_per_process_mb = memory_per_process_mb
+        # of every call: packing, number of tasks, and tasks per second after warm-up if measured
+        self.stats = []
+
+        self.cores = available_cores()
+        memory = available_memory_mb()
+        self.max_processes = len(self.cores)
+        if memory is not None:
+            self.max_processes = max(1, min(self.max_processes, int(memory // memory_per_process_mb)))
+        self._key = f'{platform.node()}|{len(self.cores)}|{workload}'
+
+    def measurements(self) -> dict:
+        """Measured tasks per second of this workload, per packing formatted as '<processes>x<threads>'."""
+        return _read_cache(self.cache_path).get(self._key, dict())
+
+    def _record(self, packing: tuple[int, int], rate: float) -> None:
+        # running mean over calls, concurrent schedulers may overwrite each other's latest measurement
+        cache = _read_cache(self.cache_path)
+        entry = cache.setdefault(self._key, dict()).setdefault('%dx%d' % packing, dict(rate=0., n=0))
+        entry['rate'] = (entry['rate'] * entry['n'] + rate) / (entry['n'] + 1)
+        entry['n'] += 1
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp, self.cache_path)
+
+    def choose(self, n_tasks: int) -> tuple[tuple[int, int], bool]:
+        """Packing for a call with n_tasks tasks.
+        :returns: the packing, and whether it is measured to tune the workload
+        """
+        n_cores = len(self.cores)
+        if os.environ.get(ENV_VAR) == '0' or os.environ.get(WORKER_ENV_VAR) == '1':
+            return (1, n_cores), False
+        if self.packing is not None:
+            return self.packing, False
+        if n_cores == 1:
+            return (1, 1), False
+
+        measured = self.measurements()
+        candidates = candidate_packings(n_cores, self.max_processes)
+        if self.tune:
+            for packing in candidates:
+                if '%dx%d' % packing not in measured and n_tasks >= MIN_TASKS_PER_PROCESS * packing[0]:
+                    return packing, True
+
+        best = max(candidates, key=lambda packing: measured.get('%dx%d' % packing, dict(rate=-1.))['rate'])
+        if '%dx%d' % best not in measured:
+            return default_packing(n_cores, self.max_processes), False
+        # keep measuring the best packing, so it is replaced if it was measured under unusual load
+        return best, self.tune and n_tasks >= MIN_TASKS_PER_PROCESS * best[0]
+
+    def map(self, func, items: list, *args, **kwargs):
+        """Iterate over (item, func(item, *args, **kwargs)) in order of the items, while the tasks run in parallel.
+        Runs in this process, one task at a time, if the packing has a single process. Closing the iterator early,
+        e.g. when pruning a trial, cancels the tasks that did not start yet.
+        :param func: function of the task, must be picklable, as must the items and arguments
+        :param items: first argument of every task, like the name of a data set
+        """
+        items = list(items)
+        packing, measure = self.choose(len(items))
+        processes = packing[0]
+        # finish times of the tasks, and the number of results handed out
+        finished = []
+        n_done = 0
+        start = time.perf_counter()
+        try:
+            if processes == 1:
+                # threads of this process are not limited, tensorflow may already be initialized
+                for item in items:
+                    result = func(item, *args, **kwargs)
+                    finished.append(time.perf_counter())
+                    n_done += 1
+                    yield item, result
+            else:
+                for item, result in self._map_parallel(packing, finished, func, items, args, kwargs):
+                    n_done += 1
+                    yield item, result
+        finally:
+            finished = sorted(finished)[:n_done]
+            rate = None
+            if n_done > processes:
+                # the first task of every process includes starting it, importing tensorflow and tracing the model
+                rate = (n_done - processes) / max(finished[-1] - finished[processes - 1], 1e-9)
+            if measure and rate is not None and n_done == len(items):
+                self._record(packing, rate)
+            self.stats.append(dict(packing=packing, n_tasks=n_done, seconds=time.perf_counter() - start,
+                                   tasks_per_second=rate))
+
+    def _map_parallel(self, packing: tuple[int, int], finished: list, func, items: list, args: tuple, kwargs: dict):
+        pool = _get_pool(*packing)
+        window = TASKS_PER_PROCESS * packing[0]
+        pending = []
+        remaining = iter(items)
+
+        def _submit(item):
+            future = pool.submit(_run, func, self.clear, (item, *args), kwargs)
+            future.add_done_callback(lambda _: finished.append(time.perf_counter()))
+            pending.append((item, future))
+
+        try:
+            for item in remaining:
+                _submit(item)
+                if len(pending) >= window:
+                    break
+            while pending:
+                item, future = pending.pop(0)
+                result = future.result()
+                next_item = next(remaining, None)
+                if next_item is not None:
+                    _submit(next_item)
+                yield item, result
+        except BrokenProcessPool:
+            # a worker died, most likely out of memory, the next call starts new workers
+            shutdown()
+            raise RuntimeError("A worker process died, reduce the number of processes with `packing`, "
+                               "or raise memory_per_process_mb")
+        finally:
+            for _, future in pending:
+                future.cancel()
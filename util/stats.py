@@ -0,0 +1,143 @@
+"""Resampling statistics to compare the accuracy of configurations over the data sets of a batch.
+All resamples are drawn at once, as a (resamples x data sets) matrix, and evaluated with vectorized NumPy,
+so thousands of resamples of every configuration of a batch take a fraction of a second.
+
+Configurations are evaluated on the same data sets, so they are compared with paired tests, and their intervals are
+computed from the same resampled data sets."""
+
+import numpy as np
+
+N_RESAMPLES = 10000
+CONFIDENCE = 0.95
+STATISTICS = {'mean': np.mean, 'median': np.median}
+# pairs of configurations (a, b) compared by `summarize`, testing whether a differs from b
+PAIRS = [('s->g', 's-only'), ('s->t', 's-only'), ('t-only', 's-only'), ('s->g', 's->t')]
+# maximum number of values gathered at once from the resample matrix, bounds memory for large batches
+CHUNK_SIZE = 2 ** 24
+
+
+def _statistic(name: str):
+    if name not in STATISTICS:
+        raise ValueError(f"Unknown statistic '{name}', use one of {list(STATISTICS)}")
+    return STATISTICS[name]
+
+
+def bootstrap_indices(n: int, n_resamples: int = N_RESAMPLES, seed: int = 0) -> np.ndarray:
+    """Indices of n_resamples bootstrap samples of n values, drawn with replacement, as a (n_resamples, n) matrix."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n, size=(n_resamples, n), dtype=np.int32)
+
+
+def sign_flips(n: int, n_resamples: int = N_RESAMPLES, seed: int = 0) -> np.ndarray:
+    """Random signs of n paired differences for n_resamples permutations, as a (n_resamples, n) matrix of +-1."""
+    rng = np.random.default_rng(seed)
+    return 1. - 2. * rng.integers(0, 2, size=(n_resamples, n), dtype=np.int8)
+
+
+def _apply(values: np.ndarray, resamples: np.ndarray, func, flip: bool) -> np.ndarray:
+    """Statistic of every resample, for every column of values. Gathers chunks of resamples at once,
+    with the data sets along the last axis, so the statistic reduces over contiguous memory.
+    :returns: (resamples,) or (resamples, columns) array, like values has one or two dimensions
+    """
+    columns = np.ascontiguousarray(values.reshape(len(values), -1).T)
+    rows = max(1, CHUNK_SIZE // max(values.size, 1))
+    res = []
+    for start in range(0, len(resamples), rows):
+        chunk = resamples[start:start + rows]
+        sampled = columns[:, np.newaxis, :] * chunk if flip else columns[:, chunk]
+        res.append(func(sampled, axis=-1))
+    res = np.concatenate(res, axis=1).T
+    return res if values.ndim > 1 else res[:, 0]
+
+
+def bootstrap_ci(values, statistic: str = 'median', n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE,
+                 seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Percentile bootstrap confidence interval of a statistic.
+    :param values: (data sets,) array, or (data sets, columns) to compute the intervals of every column with the same
+    resampled data sets
+    :param statistic: 'median' or 'mean'
+    :param confidence: probability that the interval covers the statistic
+    :returns: the statistic, lower and upper bound of its interval, per column
+    """
+    values = np.asarray(values, dtype=np.float64)
+    func = _statistic(statistic)
+    resampled = _apply(values, bootstrap_indices(len(values), n_resamples, seed), func, flip=False)
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(resampled, [tail, 1 - tail], axis=0)
+    return func(values, axis=0), low, high
+
+
+def paired_permutation_test(a, b, statistic: str = 'mean', n_resamples: int = N_RESAMPLES,
+                            seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Two-sided paired permutation test of the difference between two configurations evaluated on the same data sets.
+    If the configurations perform the same, their results on a data set are exchangeable, so the null distribution is
+    that of the statistic of the differences, with the sign of every difference flipped at random.
+    :param a: (data sets,) array, or (data sets, columns) to test several pairs at once
+    :param b: array of the same shape as a
+    :param statistic: 'mean' or 'median' of the differences
+    :returns: the statistic of the differences a - b, and the p-value, per column
+    """
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    func = _statistic(statistic)
+    observed = func(diff, axis=0)
+    null = _apply(diff, sign_flips(len(diff), n_resamples, seed), func, flip=True)
+
+    # the observed signs are one of the permutations, so the p-value is never 0. The tolerance keeps ties,
+    # like the many permutations that equal the observed value when most differences are 0
+    extreme = np.abs(null) >= np.abs(observed) - 1e-12
+    p = (np.sum(extreme, axis=0) + 1) / (n_resamples + 1)
+    return observed, p
+
+
+def summarize(acc: np.ndarray, columns: list[str], pairs: list[tuple[str, str]] = None,
+              n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE, seed: int = 0) -> dict:
+    """Intervals of the median and mean of every configuration, and paired tests between configurations.
+    :param acc: (data sets, configurations) array, e.g. the target accuracy of every configuration
+    :param columns: name of every configuration, like 's-only'
+    :param pairs: pairs of configurations to test, default PAIRS. Pairs with an unknown configuration are skipped.
+    :returns: per configuration, the median and mean with the bounds of their intervals as '<statistic>_low' and
+    '<statistic>_high', and per pair 'a vs b', the mean difference a - b and its p-value
+    """
+    acc = np.asarray(acc, dtype=np.float64)
+    index = {column: i for i, column in enumerate(columns)}
+    configs = {column: dict() for column in columns}
+    for statistic in ('median', 'mean'):
+        estimate, low, high = bootstrap_ci(acc, statistic, n_resamples, confidence, seed)
+        for column, i in index.items():
+            configs[column].update({statistic: estimate[i], f'{statistic}_low': low[i], f'{statistic}_high': high[i]})
+
+    pairs = [(a, b) for a, b in (PAIRS if pairs is None else pairs) if a in index and b in index]
+    tests = dict()
+    if pairs:
+        first = acc[:, [index[a] for a, _ in pairs]]
+        second = acc[:, [index[b] for _, b in pairs]]
+        diff, p = paired_permutation_test(first, second, 'mean', n_resamples, seed)
+        for i, (a, b) in enumerate(pairs):
+            tests[f'{a} vs {b}'] = dict(diff=diff[i], p=p[i])
+    return dict(configs=configs, pairs=tests)
+
+
+def interval_widths(acc: np.ndarray, columns: list[str], configs: list[str] = None,
+                    differences: list[tuple[str, str]] = None, statistic: str = 'mean',
+                    n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE, seed: int = 0) -> dict:
+    """Width of the bootstrap interval of configurations and of paired differences between them, to decide whether
+    enough data sets were evaluated. All intervals are computed from the same resampled data sets.
+    :param acc: (data sets, configurations) array, e.g. the target accuracy of every configuration
+    :param columns: name of every configuration, like 's-only'
+    :param configs: configurations whose interval is computed
+    :param differences: pairs (a, b) whose interval of the difference a - b is computed
+    :returns: width of every interval, by configuration name, and by 'a - b' for the differences
+    """
+    acc = np.asarray(acc, dtype=np.float64)
+    index = {column: i for i, column in enumerate(columns)}
+    configs, differences = list(configs or []), list(differences or [])
+    for name in configs + [name for pair in differences for name in pair]:
+        if name not in index:
+            raise KeyError(f"Unknown configuration '{name}', expected one of {list(columns)}")
+
+    values = [acc[:, index[name]] for name in configs] + [acc[:, index[a]] - acc[:, index[b]] for a, b in differences]
+    names = configs + [f'{a} - {b}' for a, b in differences]
+    if not names:
+        return dict()
+    _, low, high = bootstrap_ci(np.stack(values, axis=1), statistic, n_resamples, confidence, seed)
+    return {name: float(high[i] - low[i]) for i, name in enumerate(names)}